@@ -1,74 +1,82 @@
+import numpy as np
 import pandas as pd
-from src.util import score_reader
+from src.util import parse_scores
+from src.history import MatchStore
+from src.players import get_registry
 
-players = pd.read_csv('data/atp_players.csv')
+registry = get_registry()
+players = registry.players
 
 def get_all_player_names(player_ids):
-    first_names = pd.Series([players.loc[players['player_id'] == pid, 'name_first'].values[0] if not players.loc[players['player_id'] == pid, 'name_first'].empty else None for pid in player_ids])
-    last_names = pd.Series([players.loc[players['player_id'] == pid, 'name_last'].values[0] if not players.loc[players['player_id'] == pid, 'name_last'].empty else None for pid in player_ids])
+    first_names = registry.get_first_names(player_ids)
+    last_names = registry.get_last_names(player_ids)
     
     return first_names, last_names
 
 def get_player_name(player_id):
-    player = players[players['player_id'] == player_id]
-    first_name = player['name_first'].iloc[0]
-    last_name = player['name_last'].iloc[0]
-    return first_name, last_name
+    return registry.get_name(player_id)
+
+### Player perspective: every match twice, once for the winner and once for the loser
+PLAYER_STAT_COLUMNS = {
+    'ace_percentage': 'ace_perc',
+    'df_percentage': 'df_perc',
+    'first_in': 'first_in',
+    'first_win_perc': 'first_win_perc',
+    'second_in': 'second_in',
+    'second_win_perc': 'second_win_perc',
+    'bp_hold_perc': 'bp_hold_perc',
+    'bp_win_perc': 'bp_win_perc',
+    'first_return_win_perc': 'first_return_win_perc',
+    'second_return_win_perc': 'second_return_win_perc',
+    'return_win_perc': 'return_win_perc',
+}
+
+FILTER_RESULTS_COLUMNS = ['tourney_id', 'tourney_name', 'surface', 'tourney_date', 'player', 'opponent', 'score', 'result',
+                          'ace_percentage', 'df_percentage', 'first_in', 'first_win_perc', 'second_in', 'second_win_perc',
+                          'bp_hold_perc', 'bp_win_perc', 'opp_first_in', 'first_return_win_perc', 'second_return_win_perc',
+                          'return_win_perc']
+
+def player_match_table(df):
+    """
+    Pivot a get_percentages frame into one row per (player, match) with the w_/l_ columns swapped for losers
+
+    Score derived columns (games, tiebreaks, sets) are parsed once for the whole frame and
+    oriented to the player, so per-player aggregates are a single groupby on player_id.
+    """
+    parsed = parse_scores(df['score'].fillna(''))
+    sides = []
+    for prefix, opp_prefix, role, opp_role, result in [('w', 'l', 'winner', 'loser', 'win'), ('l', 'w', 'loser', 'winner', 'loss')]:
+        side = pd.DataFrame({
+            'tourney_id': df['tourney_id'],
+            'tourney_name': df['tourney_name'],
+            'surface': df['surface'],
+            'tourney_date': df['tourney_date'],
+            'player_id': df[f'{role}_id'],
+            'player': df[f'{role}_name'],
+            'opponent_id': df[f'{opp_role}_id'],
+            'opponent': df[f'{opp_role}_name'],
+            'score': df['score'],
+            'result': result,
+        })
+        for column, suffix in PLAYER_STAT_COLUMNS.items():
+            side[column] = df[f'{prefix}_{suffix}']
+        side.insert(side.columns.get_loc('first_return_win_perc'), 'opp_first_in', df[f'{opp_prefix}_first_in'])
+        side['games_won'] = parsed[f'{prefix}_games']
+        side['games_lost'] = parsed[f'{opp_prefix}_games']
+        side['total_games'] = parsed['total_games']
+        side['tiebreaks'] = parsed['tiebreaks']
+        side['tiebreaks_won'] = parsed[f'{prefix}_tiebreaks']
+        side['num_sets'] = parsed['num_sets']
+        sides.append(side)
+    # Stable sort keeps each match's winner row ahead of its loser row, in the original match order
+    position = np.tile(np.arange(len(df)), 2)
+    table = pd.concat(sides, ignore_index=True)
+    return table.iloc[np.argsort(position, kind='stable')].reset_index(drop=True)
 
 ### Filter out the stats of the opposing player
 def filter_results(df, player_name):
-    player_stats = []
-
-    for index, row in df.iterrows():
-        if row['winner_name'] == player_name:
-            player_stat = {
-                'tourney_id': row['tourney_id'],
-                'tourney_name': row['tourney_name'], 
-                'surface': row['surface'], 
-                'tourney_date': row['tourney_date'], 
-                'player': row['winner_name'], 
-                'opponent': row['loser_name'],
-                'score' : row['score'],
-                'result': 'win',
-                'ace_percentage' : row['w_ace_perc'],
-                'df_percentage': row['w_df_perc'],
-                'first_in': row['w_first_in'],
-                'first_win_perc': row['w_first_win_perc'],
-                'second_in': row['w_second_in'],
-                'second_win_perc': row['w_second_win_perc'],
-                'bp_hold_perc': row['w_bp_hold_perc'],
-                'bp_win_perc': row['w_bp_win_perc'],
-                'opp_first_in': row['l_first_in'],
-                'first_return_win_perc' : row['w_first_return_win_perc'],
-                'second_return_win_perc' : row['w_second_return_win_perc'],
-                'return_win_perc': row['w_return_win_perc'],
-            }
-        elif row['loser_name'] == player_name:
-            player_stat = {
-                'tourney_id': row['tourney_id'],
-                'tourney_name': row['tourney_name'], 
-                'surface': row['surface'], 
-                'tourney_date': row['tourney_date'], 
-                'player': row['loser_name'], 
-                'opponent': row['winner_name'],
-                'score' : row['score'],
-                'result': 'loss',
-                'ace_percentage' : row['l_ace_perc'],
-                'df_percentage': row['l_df_perc'],
-                'first_in': row['l_first_in'],
-                'first_win_perc': row['l_first_win_perc'],
-                'second_in': row['l_second_in'],
-                'second_win_perc': row['l_second_win_perc'],
-                'bp_hold_perc': row['l_bp_hold_perc'],
-                'bp_win_perc': row['l_bp_win_perc'],
-                'opp_first_in': row['w_first_in'],
-                'first_return_win_perc' : row['l_first_return_win_perc'],
-                'second_return_win_perc' : row['l_second_return_win_perc'],
-                'return_win_perc': row['l_return_win_perc'],
-            }
-        player_stats.append(player_stat)
-
-    player_stats_df = pd.DataFrame(player_stats)
+    table = player_match_table(df)
+    player_stats_df = table.loc[table['player'] == player_name, FILTER_RESULTS_COLUMNS].reset_index(drop=True)
     
     return player_stats_df
 
@@ -84,8 +92,7 @@ def get_percentages(orig_df):
     percentages['match_num'] = orig_df['match_num']
     percentages['score'] = orig_df['score']
     percentages['winner_id'] = orig_df['winner_id']
-    winner_first, winner_last = get_all_player_names(orig_df['winner_id'])
-    percentages['winner_name'] = winner_first + ' ' + winner_last
+    percentages['winner_name'] = registry.get_full_names(orig_df['winner_id'])
     percentages['winner_seed'] = orig_df['winner_seed']
     percentages['winner_hand'] = orig_df['winner_hand']
     percentages['winner_ht'] = orig_df['winner_ht']
@@ -93,8 +100,7 @@ def get_percentages(orig_df):
     percentages['winner_rank'] = orig_df['winner_rank']
     percentages['winner_rank_points'] = orig_df['winner_rank_points']
     percentages['loser_id'] = orig_df['loser_id']
-    loser_first, loser_last = get_all_player_names(orig_df['loser_id'])
-    percentages['loser_name'] = loser_first + ' ' + loser_last
+    percentages['loser_name'] = registry.get_full_names(orig_df['loser_id'])
     percentages['loser_seed'] = orig_df['loser_seed']
     percentages['loser_hand'] = orig_df['loser_hand']
     percentages['loser_ht'] = orig_df['loser_ht']
@@ -130,30 +136,55 @@ def get_percentages(orig_df):
 
 # Player Data Search
 def search_player(first_name, last_name, year="2024"):
-    atp_data = pd.read_csv(f'data/atp_singles/atp_matches_{year}.csv')
-    atp_data['tourney_date'] = pd.to_datetime(atp_data['tourney_date'], format='%Y%m%d')
-    df = get_percentages(atp_data)
-    player_id = players.loc[(players['name_first'] == first_name) & (players['name_last'] == last_name), 'player_id'].iloc[0]
-    data = df[(df['winner_id'] == player_id) | (df['loser_id'] == player_id)]
+    """
+    Get a player's matches with percentage stats, most recent first
+
+    :param year: a single year or an iterable of years such as range(2015, 2025)
+    """
+    years = [year] if isinstance(year, (str, int)) else list(year)
+    player_id = registry.get_id(first_name, last_name)
+    if MatchStore.exists():
+        # Columnar store built by `python src/history.py build`, only the player's rows are decoded
+        atp_data = MatchStore().player_matches(player_id, years=years).drop(columns='level')
+    else:
+        atp_data = pd.concat([pd.read_csv(f'data/atp_singles/atp_matches_{y}.csv') for y in years], ignore_index=True)
+        atp_data['tourney_date'] = pd.to_datetime(atp_data['tourney_date'], format='%Y%m%d')
+        atp_data = atp_data[(atp_data['winner_id'] == player_id) | (atp_data['loser_id'] == player_id)].reset_index(drop=True)
+    data = get_percentages(atp_data)
     data = data.sort_values(by='tourney_date', ascending=False)
     return data
 
 def get_tiebreak_win_percentage(filtered_player_df):
-    scores = filtered_player_df['score']
-    results = filtered_player_df['result']
-    tiebreaks_total = 0
-    tiebreaks_won = 0
-    for score, result in zip(scores, results):
-        print("SCORE: ", score)
-        w_games_won, l_games_won, total_games, tiebreaks, w_tiebreaks_won, l_tiebreaks_won, tiebreak_points, num_sets = score_reader(score)
-        if result == 'win':
-            tiebreaks_won += w_tiebreaks_won
-        if result == 'loss':
-            tiebreaks_won += l_tiebreaks_won
-        print(tiebreaks_won)
-        tiebreaks_total += tiebreaks
+    parsed = parse_scores(filtered_player_df['score'].fillna(''))
+    won = filtered_player_df['result'].to_numpy() == 'win'
+    lost = filtered_player_df['result'].to_numpy() == 'loss'
+    tiebreaks_won = parsed['w_tiebreaks'][won].sum() + parsed['l_tiebreaks'][lost].sum()
+    tiebreaks_total = parsed['tiebreaks'].sum()
     return tiebreaks_won / tiebreaks_total
 
+def get_player_aggregates(table):
+    """
+    Per-player serve, return and tiebreak aggregates over a player_match_table in one groupby
+
+    :return: DataFrame indexed by player_id
+    """
+    table = table.assign(
+        service_point_win_perc=table['first_in'] * table['first_win_perc'] + (1 - table['first_in']) * table['second_win_perc'],
+        return_point_win_perc=table['opp_first_in'] * table['first_return_win_perc'] + (1 - table['opp_first_in']) * table['second_return_win_perc'],
+        won=(table['result'] == 'win').astype(int))
+    aggregates = table.groupby('player_id').agg(
+        player=('player', 'last'),
+        matches=('won', 'size'),
+        wins=('won', 'sum'),
+        service_point_win_perc=('service_point_win_perc', 'mean'),
+        return_point_win_perc=('return_point_win_perc', 'mean'),
+        games_won=('games_won', 'sum'),
+        games_lost=('games_lost', 'sum'),
+        tiebreaks=('tiebreaks', 'sum'),
+        tiebreaks_won=('tiebreaks_won', 'sum'))
+    aggregates['tiebreak_win_perc'] = aggregates['tiebreaks_won'] / aggregates['tiebreaks'].where(aggregates['tiebreaks'] > 0)
+    return aggregates
+
 def serve_return_win_perc(first_name, last_name):
     stat_df = filter_results(search_player(first_name, last_name), f"{first_name} {last_name}")
     serve_df = stat_df[['first_in', 'first_win_perc', 'second_win_perc']].dropna()
@@ -0,0 +1,317 @@
+import argparse
+import contextlib
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pandas as pd
+from players import get_registry
+from rankings import refresh_rankings_index
+from results import ResultHistory, SharedResults
+from util import MARGIN_METHODS, get_expected_value, remove_margin
+
+BACKTEST_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "backtest")
+CACHE_DIR = os.path.join(BACKTEST_DIR, ".cache")
+
+# Bookmaker prefix -> (winner odds column, loser odds column)
+ODDS_COLUMNS = {
+    "B365": ("B365W", "B365L"),
+    "PS": ("PSW", "PSL"),
+    "Max": ("MaxW", "MaxL"),
+    "Avg": ("AvgW", "AvgL"),
+}
+
+CATEGORY_COLUMNS = ["Location", "Tournament", "Series", "Court", "Surface", "Round", "Comment"]
+FLOAT_COLUMNS = ["Best of", "WRank", "LRank", "WPts", "LPts", "W1", "L1", "W2", "L2", "W3", "L3", "W4", "L4", "W5", "L5",
+                 "Wsets", "Lsets"] + [column for columns in ODDS_COLUMNS.values() for column in columns]
+
+STAKING_METHODS = ["flat", "kelly", "odds"]
+
+# "void" returns the stake on retirements, walkovers and awarded matches, as books void walkovers and
+# often retirements, "settle" settles them on the listed winner like completed matches
+UNFINISHED_METHODS = ["void", "settle"]
+
+def get_completed(season):
+    """True for matches played to completion, the workbook's Comment column is Completed"""
+    if "Comment" not in season:
+        return np.ones(len(season), dtype=bool)
+    return (season["Comment"].astype(str) == "Completed").to_numpy()
+
+def load_season(year, backtest_dir=BACKTEST_DIR, cache_dir=CACHE_DIR):
+    """
+    Load a season workbook with typed columns and resolved player ids
+
+    The first load parses backtest/atp_{year}.xlsx and pickles the typed frame under
+    backtest/.cache, later loads read the pickle unless the workbook has changed.
+
+    :param year: the season, e.g. 2024
+    :return: DataFrame of the season's matches in date order with winner_id and loser_id columns
+    """
+    workbook_path = os.path.join(backtest_dir, f"atp_{year}.xlsx")
+    cache_path = os.path.join(cache_dir, f"atp_{year}.pkl")
+    if os.path.exists(cache_path) and os.path.getmtime(cache_path) >= os.path.getmtime(workbook_path):
+        return pd.read_pickle(cache_path)
+
+    season = pd.read_excel(workbook_path)
+    season["Date"] = pd.to_datetime(season["Date"])
+    for column in FLOAT_COLUMNS:
+        if column in season:
+            season[column] = pd.to_numeric(season[column], errors="coerce").astype(np.float64)
+    for column in CATEGORY_COLUMNS:
+        if column in season:
+            season[column] = season[column].astype("category")
+    season["Winner"] = season["Winner"].astype(str).str.strip()
+    season["Loser"] = season["Loser"].astype(str).str.strip()
+    registry = get_registry()
+    season["winner_id"] = np.array([registry.resolve_abbreviated(name) for name in season["Winner"]], dtype=np.int64)
+    season["loser_id"] = np.array([registry.resolve_abbreviated(name) for name in season["Loser"]], dtype=np.int64)
+    season["season"] = year
+    season = season.sort_values("Date", kind="mergesort").reset_index(drop=True)
+
+    os.makedirs(cache_dir, exist_ok=True)
+    season.to_pickle(cache_path)
+    return season
+
+class ScrapedModelPricer:
+    """
+    Prices backtest rows with predict_match at the match date, scraping each player's career results
+
+    Slow (a browser per player) and the ELO tables are today's, so prefer a pricer built on local data.
+    Without share_histories every match scrapes both players again.
+    """
+
+    def __init__(self, num_weeks=24):
+        self.num_weeks = num_weeks
+        self.histories = None
+
+    @staticmethod
+    def _names(registry, player_id):
+        # Tennis Abstract urls and ELO names drop the spaces and hyphens inside names
+        return tuple(name.replace(" ", "").replace("-", "") for name in registry.get_name(player_id))
+
+    def share_histories(self, years):
+        """
+        Scrape the career results of every player of the seasons once, into shared memory the workers pricing them map
+
+        :return: the SharedResults, owned by the caller, who closes it once the seasons are priced
+        """
+        # scrape pulls in selenium and bs4, only load them for the scraped pricer
+        from scrape import PlayerDataScraper
+
+        registry = get_registry()
+        player_ids = set()
+        for year in years:
+            season = load_season(year)
+            player_ids.update(int(player_id) for player_id in season[["winner_id", "loser_id"]].to_numpy().reshape(-1) if player_id >= 0)
+        histories = {}
+        for player_id in sorted(player_ids):
+            first_name, last_name = self._names(registry, player_id)
+            try:
+                histories[(first_name, last_name)] = ResultHistory.from_frame(PlayerDataScraper(first_name, last_name).get_all_results())
+            except Exception as e:
+                print(f"Could not scrape {first_name} {last_name}, their matches will scrape them again: {e}")
+        self.histories = SharedResults(histories)
+        return self.histories
+
+    def get(self, first_name, last_name, num_weeks, current_tournament, career=False):
+        """predict_match's player cache, building stats from the shared career results where the player has them"""
+        from manip import PlayerServeReturnStats
+
+        key = (first_name, last_name)
+        history = self.histories[key] if career and key in self.histories else None
+        return PlayerServeReturnStats(first_name, last_name, num_weeks, current_tournament, career=career, history=history)
+
+    def __call__(self, season):
+        from run import predict_match
+
+        registry = get_registry()
+        player_cache = None if self.histories is None else self
+        probabilities = np.full(len(season), np.nan)
+        for idx, (winner_id, loser_id, location, match_date) in enumerate(
+                zip(season["winner_id"], season["loser_id"], season["Location"], season["Date"])):
+            if winner_id < 0 or loser_id < 0:
+                continue
+            winner_first, winner_last = self._names(registry, winner_id)
+            loser_first, loser_last = self._names(registry, loser_id)
+            try:
+                probabilities[idx] = predict_match(winner_first, winner_last, loser_first, loser_last, str(location),
+                                                   self.num_weeks, match_date, player_cache)[0]
+            except Exception as e:
+                print(f"Could not price {season['Winner'].iloc[idx]} vs {season['Loser'].iloc[idx]}: {e}")
+        return probabilities
+
+def get_stakes(probabilities, decimal_odds, staking="flat", min_edge=0.0, kelly_fraction=0.25, bankroll=100.0, unit=1.0):
+    """
+    Size a bet on each selection
+
+    :param probabilities: model probability of each selection winning
+    :param decimal_odds: decimal odds available on each selection
+    :param staking: "flat" bets one unit, "kelly" bets kelly_fraction of the full Kelly stake of a
+    starting bankroll, "odds" risks one unit on underdogs and bets to win one unit on favourites
+    :param min_edge: minimum expected value per unit staked to place a bet
+    :return: array of stakes in units, 0 where no bet is placed
+    """
+    expected_value = probabilities * decimal_odds - 1
+    bet = (expected_value > min_edge) & np.isfinite(expected_value)
+    if staking == "flat":
+        stakes = np.full(len(probabilities), unit)
+    elif staking == "kelly":
+        stakes = kelly_fraction * bankroll * expected_value / (decimal_odds - 1)
+    elif staking == "odds":
+        stakes = np.where(decimal_odds < 2, unit / (decimal_odds - 1), unit)
+    else:
+        raise ValueError(f"Unknown staking method: {staking}, expected one of {STAKING_METHODS}")
+    return np.where(bet, stakes, 0.0)
+
+def get_max_drawdown(pnl):
+    """Largest peak to trough fall of the cumulative profit, in units"""
+    if len(pnl) == 0:
+        return 0.0
+    cumulative = np.concatenate([[0.0], np.cumsum(pnl)])
+    return float(np.max(np.maximum.accumulate(cumulative) - cumulative))
+
+def evaluate_season(season, probabilities, bookmaker="PS", staking="flat", min_edge=0.0, kelly_fraction=0.25, margin="multiplicative",
+                    unfinished="void"):
+    """
+    Compute the EV of both sides of every match, pick the better one and settle the bets
+
+    :param season: a load_season frame
+    :param probabilities: the model's probability that the listed winner wins each match
+    :param margin: how the bookmaker margin is removed for the market probability, one of util.MARGIN_METHODS
+    :param unfinished: "void" places no bets on matches that weren't completed, "settle" settles them
+    :return: the season frame with model, market, edge, EV, completed, stake and profit columns added
+    """
+    if unfinished not in UNFINISHED_METHODS:
+        raise ValueError(f"Unknown unfinished method: {unfinished}, expected one of {UNFINISHED_METHODS}")
+    winner_column, loser_column = ODDS_COLUMNS[bookmaker]
+    winner_odds = season[winner_column].to_numpy(dtype=np.float64)
+    loser_odds = season[loser_column].to_numpy(dtype=np.float64)
+    winner_ev = get_expected_value(probabilities, winner_odds)
+    loser_ev = get_expected_value(1 - probabilities, loser_odds)
+    market_winner = remove_margin(np.stack([winner_odds, loser_odds], axis=-1), margin)[:, 0]
+
+    back_winner = np.nan_to_num(winner_ev, nan=-np.inf) >= np.nan_to_num(loser_ev, nan=-np.inf)
+    selection_probability = np.where(back_winner, probabilities, 1 - probabilities)
+    selection_odds = np.where(back_winner, winner_odds, loser_odds)
+    selection_ev = np.where(back_winner, winner_ev, loser_ev)
+    stakes = get_stakes(selection_probability, selection_odds, staking, min_edge, kelly_fraction)
+    completed = get_completed(season)
+    if unfinished == "void":
+        stakes = np.where(completed, stakes, 0.0)
+    # The workbook lists the winner first, so a bet on the winner always pays out
+    profit = np.where(back_winner, stakes * (selection_odds - 1), -stakes)
+
+    results = season.copy()
+    results["p_winner"] = probabilities
+    results["market_p_winner"] = market_winner
+    results["edge"] = probabilities - market_winner
+    results["winner_ev"] = winner_ev
+    results["loser_ev"] = loser_ev
+    results["completed"] = completed
+    results["bet_on"] = np.where(stakes > 0, np.where(back_winner, results["Winner"], results["Loser"]), None)
+    results["bet_odds"] = np.where(stakes > 0, selection_odds, np.nan)
+    results["bet_ev"] = np.where(stakes > 0, selection_ev, np.nan)
+    results["stake"] = stakes
+    results["profit"] = profit
+    return results
+
+def summarize_results(results):
+    """
+    Bets, turnover, profit, ROI, drawdown and model quality of an evaluated backtest
+
+    Log-loss and Brier score are over completed matches only, a retirement or walkover says little
+    about who was the better player on the day.
+    """
+    bets = results[results["stake"] > 0]
+    completed = results["completed"].to_numpy(dtype=bool) if "completed" in results else get_completed(results)
+    priced = results["p_winner"].notna().to_numpy() & completed
+    probabilities = np.clip(results.loc[priced, "p_winner"].to_numpy(dtype=np.float64), 1e-6, 1 - 1e-6)
+    # The margin-free market over the same priced matches, the bar the model has to beat
+    market = results.loc[priced, "market_p_winner"].dropna().to_numpy(dtype=np.float64)
+    staked = bets["stake"].sum()
+    profit = bets["profit"].sum()
+    return {
+        "matches": int(len(results)),
+        "unfinished": int((~completed).sum()),
+        "priced": int(priced.sum()),
+        "bets": int(len(bets)),
+        "staked": float(staked),
+        "profit": float(profit),
+        "roi": float(profit / staked) if staked > 0 else 0.0,
+        "avg_ev": float(bets["bet_ev"].mean()) if len(bets) else 0.0,
+        "max_drawdown": get_max_drawdown(bets.sort_values("Date", kind="mergesort")["profit"].to_numpy()),
+        # The listed winner always won, so these are the log-loss and Brier score of the model
+        "log_loss": float(-np.mean(np.log(probabilities))) if len(probabilities) else np.nan,
+        "brier": float(np.mean((1 - probabilities) ** 2)) if len(probabilities) else np.nan,
+        "market_log_loss": float(-np.mean(np.log(np.clip(market, 1e-6, 1)))) if len(market) else np.nan,
+    }
+
+def run_season(year, pricer, bookmaker="PS", staking="flat", min_edge=0.0, kelly_fraction=0.25, margin="multiplicative", unfinished="void"):
+    """Load, price and evaluate one season, module level so it can run in a worker process"""
+    season = load_season(year)
+    probabilities = np.asarray(pricer(season), dtype=np.float64)
+    return evaluate_season(season, probabilities, bookmaker, staking, min_edge, kelly_fraction, margin, unfinished)
+
+def run_backtest(years, pricer, bookmaker="PS", staking="flat", min_edge=0.0, kelly_fraction=0.25, workers=None,
+                 margin="multiplicative", unfinished="void"):
+    """
+    Backtest a pricer over several seasons, one worker process per season
+
+    :param years: the seasons to run, e.g. range(2021, 2026)
+    :param pricer: picklable callable taking a load_season frame and returning the listed winner's win probabilities
+    :param workers: number of processes, 1 runs in this process
+    :return: (per match results DataFrame, per season summary DataFrame with a total row)
+    """
+    years = list(years)
+    workers = min(len(years), os.cpu_count() or 1) if workers is None else workers
+    if workers <= 1:
+        seasons = [run_season(year, pricer, bookmaker, staking, min_edge, kelly_fraction, margin, unfinished) for year in years]
+    else:
+        # Rebuild a stale rankings index once here rather than in every worker
+        refresh_rankings_index()
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            seasons = list(executor.map(run_season, years, [pricer] * len(years), [bookmaker] * len(years),
+                                        [staking] * len(years), [min_edge] * len(years), [kelly_fraction] * len(years),
+                                        [margin] * len(years), [unfinished] * len(years)))
+    results = pd.concat(seasons, ignore_index=True)
+    summary = pd.DataFrame([summarize_results(season) for season in seasons] + [summarize_results(results)],
+                           index=[str(year) for year in years] + ["total"])
+    return results, summary
+
+def main():
+    parser = argparse.ArgumentParser(description="Backtest the model against closing odds in backtest/atp_*.xlsx")
+    parser.add_argument("--years", nargs="*", type=int, default=list(range(2021, 2026)))
+    parser.add_argument("--bookmaker", default="PS", choices=list(ODDS_COLUMNS))
+    parser.add_argument("--staking", default="flat", choices=STAKING_METHODS)
+    parser.add_argument("--min-edge", type=float, default=0.0)
+    parser.add_argument("--kelly-fraction", type=float, default=0.25)
+    parser.add_argument("--margin", default="multiplicative", choices=MARGIN_METHODS,
+                        help="How the bookmaker margin is removed for the market probability and edge columns")
+    parser.add_argument("--unfinished", default="void", choices=UNFINISHED_METHODS,
+                        help="void returns the stake on retirements, walkovers and awarded matches, settle pays them on the listed winner")
+    parser.add_argument("--pricer", default="local", choices=["local", "scraped"],
+                        help="local prices from data/ only, scraped calls predict_match against Tennis Abstract")
+    parser.add_argument("--num-weeks", type=int, default=52)
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--output", default=None, help="Write the per match results to this csv")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    if args.pricer == "local":
+        from features import PointInTimePricer
+        pricer = PointInTimePricer({"num_weeks": args.num_weeks})
+        shared = contextlib.nullcontext()
+    else:
+        pricer = ScrapedModelPricer(args.num_weeks)
+        # Every player is scraped once here and mapped by the workers, instead of once per match
+        shared = pricer.share_histories(args.years)
+    with shared:
+        results, summary = run_backtest(args.years, pricer, args.bookmaker, args.staking, args.min_edge,
+                                        args.kelly_fraction, args.workers, args.margin, args.unfinished)
+    print(summary.to_string())
+    print(f"Backtest took {time.perf_counter() - start:.1f}s")
+    if args.output:
+        results.to_csv(args.output, index=False)
+
+if __name__ == "__main__":
+    main()
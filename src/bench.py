@@ -0,0 +1,555 @@
+import argparse
+import contextlib
+import html
+import io
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+import numpy as np
+import pandas as pd
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BENCH_DIR = os.path.join(REPO_DIR, "bench")
+HISTORY_PATH = os.path.join(BENCH_DIR, "history.jsonl")
+BASELINE_PATH = os.path.join(BENCH_DIR, "baseline.json")
+# Tennis Abstract pages saved by `python bench.py record`, used instead of rendered ones when present
+PAGES_DIR = os.path.join(BENCH_DIR, "fixtures")
+RESULTS_TABLES = ["recent_results_serve", "recent_results_return"]
+
+FIXTURE_SEASON = 2023
+SLATE_SIZE = 64
+
+# Pricing-only modules that must import without pulling in any of HEAVY_MODULES. They all need
+# numpy, so it is timed first as the floor the others are read against
+LIGHT_MODULES = ["numpy", "mdp", "util", "model", "recency", "run"]
+HEAVY_MODULES = ["pandas", "tqdm", "selenium", "bs4", "scrape", "manip"]
+
+IMPORT_SCRIPT = """
+import json, sys, time
+start = time.perf_counter()
+import {module}
+seconds = time.perf_counter() - start
+print(json.dumps({{"seconds": seconds, "heavy": [name for name in {heavy!r} if name in sys.modules]}}))
+"""
+
+FIXTURE_COLUMNS = ["tourney_date", "tourney_name", "surface", "round", "best_of", "winner_id", "loser_id",
+                   "winner_ioc", "loser_ioc", "winner_rank", "loser_rank", "score",
+                   "w_ace", "w_df", "w_svpt", "w_1stIn", "w_1stWon", "w_2ndWon",
+                   "l_ace", "l_df", "l_svpt", "l_1stIn", "l_1stWon", "l_2ndWon"]
+
+# Columns of Tennis Abstract's classic results tables, the blank one holds the scoreline
+RESULTS_HEADERS = {
+    "recent_results_serve": ["Date", "Tournament", "Surface", "Rd", "Rk", "vRk", "", "More", "DR", "A%", "DF%", "1stIn", "1st%", "2nd%",
+                             "BPSvd", "Time"],
+    "recent_results_return": ["Date", "Tournament", "Surface", "Rd", "Rk", "vRk", "", "More", "DR", "TPW", "RPW", "vA%", "v1st%", "v2nd%",
+                              "BPCnv", "Time"],
+}
+
+def measure(function, repeat=5, number=1, warmup=1):
+    """
+    Time a callable, timeit style
+
+    :param repeat: number of timed samples
+    :param number: calls per sample
+    :return: dict with the best, median and mean seconds per call
+    """
+    for _ in range(warmup):
+        function()
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for _ in range(number):
+            function()
+        samples.append((time.perf_counter() - start) / number)
+    return {"best": min(samples), "median": statistics.median(samples), "mean": statistics.fmean(samples),
+            "repeat": repeat, "number": number}
+
+def measure_import(module, repeat=5):
+    """
+    Time importing a module in fresh interpreters
+
+    :return: dict like measure's, plus the HEAVY_MODULES the import loaded
+    """
+    samples = []
+    for _ in range(repeat):
+        output = subprocess.run([sys.executable, "-c", IMPORT_SCRIPT.format(module=module, heavy=HEAVY_MODULES)],
+                                cwd=os.path.dirname(os.path.abspath(__file__)), capture_output=True, text=True, check=True).stdout
+        sample = json.loads(output)
+        samples.append(sample["seconds"])
+    return {"best": min(samples), "median": statistics.median(samples), "mean": statistics.fmean(samples),
+            "repeat": repeat, "number": 1, "heavy": sample["heavy"]}
+
+@contextlib.contextmanager
+def quiet():
+    """Swallow the progress prints and bars of the code being timed"""
+    with contextlib.redirect_stdout(io.StringIO()), contextlib.redirect_stderr(io.StringIO()):
+        yield
+
+class Fixtures:
+    """
+    Inputs for the benchmarks, built lazily from data/ so no benchmark touches the network
+
+    The scraped tables (a player's Tennis Abstract results, surface speeds and the ELO table) are
+    rebuilt in the scraped format from the local match history of FIXTURE_SEASON, and the results
+    pages they are parsed from are rendered from it unless recorded ones are in PAGES_DIR.
+    """
+
+    def __init__(self, season=FIXTURE_SEASON):
+        self.season = season
+        self._cache = {}
+
+    def _cached(self, name, build):
+        if name not in self._cache:
+            self._cache[name] = build()
+        return self._cache[name]
+
+    @property
+    def matches(self):
+        """The season's singles matches with point stats"""
+        def build():
+            from history import MatchStore, drop_unknown_players, load_matches
+
+            if MatchStore.exists():
+                matches = drop_unknown_players(MatchStore().year(self.season, columns=FIXTURE_COLUMNS))
+            else:
+                matches = load_matches(("singles",), FIXTURE_COLUMNS)
+                matches = matches[matches["tourney_date"].dt.year == self.season]
+            return matches[(matches["w_svpt"] > 0) & (matches["l_svpt"] > 0)].reset_index(drop=True)
+        return self._cached("matches", build)
+
+    @property
+    def raw_season(self):
+        """The season's csv as get_percentages expects it"""
+        def build():
+            from history import DATA_DIR, level_files
+
+            path = dict(level_files(DATA_DIR, "singles"))[self.season]
+            return pd.read_csv(path)
+        return self._cached("raw_season", build)
+
+    @property
+    def elo_table(self):
+        def build():
+            from elo import local_adjusted_elo
+
+            return local_adjusted_elo(f"{self.season + 1}-01-01")
+        return self._cached("elo_table", build)
+
+    @property
+    def players(self):
+        """(player id, first name, last name) of the 2 * SLATE_SIZE players with the most matches, named as in the ELO table"""
+        def build():
+            matches = self.matches
+            counts = pd.concat([matches["winner_id"], matches["loser_id"]]).value_counts()
+            names = self.elo_table.set_index("player_id")["Player"]
+            players = []
+            for player_id in counts.index:
+                if player_id in names.index and " " in names[player_id]:
+                    first_name, last_name = names[player_id].split(" ", 1)
+                    players.append((int(player_id), first_name, last_name))
+                if len(players) == 2 * SLATE_SIZE:
+                    break
+            return players
+        return self._cached("players", build)
+
+    @property
+    def surface_data(self):
+        """A surface speed table in the scraped format, each event at its surface's fallback speed"""
+        def build():
+            from model import DEFAULT_MODEL_CONFIG
+
+            events = self.matches.drop_duplicates("tourney_name")
+            speeds = events["surface"].map(DEFAULT_MODEL_CONFIG["fallback_speeds"]).fillna(1.0)
+            return pd.DataFrame({"Tournament": events["tourney_name"].astype(str).to_numpy(),
+                                 "Surface Speed": [f"{speed:.3f}" for speed in speeds]})
+        return self._cached("surface_data", build)
+
+    def scraped_results(self, player_id):
+        """A player's season in the format of PlayerDataScraper.get_recent_results, newest first"""
+        key = ("results", player_id)
+        if key not in self._cache:
+            matches = self.matches
+            names = self.elo_table.set_index("player_id")["Player"]
+            player_matches = matches[(matches["winner_id"] == player_id) | (matches["loser_id"] == player_id)]
+            won = (player_matches["winner_id"] == player_id).to_numpy()
+            opponent_ids = np.where(won, player_matches["loser_id"], player_matches["winner_id"])
+            opponent_names = pd.Series(opponent_ids).map(names).fillna("Unknown Player").to_numpy()
+            opponent_ioc = np.where(won, player_matches["loser_ioc"], player_matches["winner_ioc"])
+            own_svpt = np.where(won, player_matches["w_svpt"], player_matches["l_svpt"])
+            own_sv_won = np.where(won, player_matches["w_1stWon"] + player_matches["w_2ndWon"], player_matches["l_1stWon"] + player_matches["l_2ndWon"])
+            opp_svpt = np.where(won, player_matches["l_svpt"], player_matches["w_svpt"])
+            opp_sv_won = np.where(won, player_matches["l_1stWon"] + player_matches["l_2ndWon"], player_matches["w_1stWon"] + player_matches["w_2ndWon"])
+            results = pd.DataFrame({
+                "Match": [f"{date.year} {name} {round_name}" for date, name, round_name in
+                          zip(player_matches["tourney_date"], player_matches["tourney_name"], player_matches["round"])],
+                "Date": player_matches["tourney_date"].to_numpy(),
+                "Surface": player_matches["surface"].to_numpy(),
+                "Scoreline": [f"{'d.' if player_won else 'L'} {name} [{ioc}] {score}" for player_won, name, ioc, score in
+                              zip(won, opponent_names, opponent_ioc, player_matches["score"])],
+                "vRk": pd.Series(np.where(won, player_matches["loser_rank"], player_matches["winner_rank"])).astype("Int64").astype(str).to_numpy(),
+                "SPW": [f"{100 * won_points / points:.1f}%" for won_points, points in zip(own_sv_won, own_svpt)],
+                "RPW": [f"{100 - 100 * won_points / points:.1f}%" for won_points, points in zip(opp_sv_won, opp_svpt)],
+            })
+            self._cache[key] = results.sort_values("Date", ascending=False, kind="stable").reset_index(drop=True)
+        return self._cache[key]
+
+    def results_pages(self, player_id):
+        """
+        The HTML of a player's results pages, by PlayerDataScraper table name
+
+        Pages recorded by `python bench.py record` are used as they are, otherwise the player's
+        season is rendered into Tennis Abstract's results table layout.
+        """
+        recorded = {name: os.path.join(PAGES_DIR, f"{name}.html") for name in RESULTS_TABLES}
+        if all(os.path.exists(path) for path in recorded.values()):
+            pages = {}
+            for name, path in recorded.items():
+                with open(path, encoding="utf-8") as f:
+                    pages[name] = f.read()
+            return pages
+        key = ("pages", player_id)
+        if key not in self._cache:
+            matches = self.matches
+            player_matches = matches[(matches["winner_id"] == player_id) | (matches["loser_id"] == player_id)]
+            player_matches = player_matches.sort_values("tourney_date", ascending=False, kind="stable")
+            won = (player_matches["winner_id"] == player_id).to_numpy()
+
+            def side(own, column):
+                return np.where(won == own, player_matches[f"w_{column}"], player_matches[f"l_{column}"]).astype(np.float64)
+
+            def percent(numerator, denominator):
+                with np.errstate(divide="ignore", invalid="ignore"):
+                    return [f"{value:.1f}%" for value in np.nan_to_num(100 * numerator / denominator)]
+
+            svpt, first_in, first_won, second_won = side(True, "svpt"), side(True, "1stIn"), side(True, "1stWon"), side(True, "2ndWon")
+            opp_svpt, opp_first_in = side(False, "svpt"), side(False, "1stIn")
+            opp_first_won, opp_second_won = side(False, "1stWon"), side(False, "2ndWon")
+            ranks = np.where(won, player_matches["winner_rank"], player_matches["loser_rank"])
+            opponent_ranks = np.where(won, player_matches["loser_rank"], player_matches["winner_rank"])
+            scores = self.scraped_results(player_id)["Scoreline"].to_numpy()
+            common = {
+                # Tennis Abstract separates the date's parts with non-breaking hyphens
+                "Date": [date.strftime("%d\u2011%b\u2011%Y") for date in player_matches["tourney_date"]],
+                "Tournament": player_matches["tourney_name"].astype(str).to_numpy(),
+                "Surface": player_matches["surface"].astype(str).to_numpy(),
+                "Rd": player_matches["round"].astype(str).to_numpy(),
+                "Rk": pd.Series(ranks).astype("Int64").astype(str).to_numpy(),
+                "vRk": pd.Series(opponent_ranks).astype("Int64").astype(str).to_numpy(),
+                "": scores,
+                "More": ["More"] * len(player_matches),
+                "DR": ["1.00"] * len(player_matches),
+                "Time": ["1:30"] * len(player_matches),
+            }
+            columns = {
+                "recent_results_serve": dict(common, **{
+                    "A%": percent(side(True, "ace"), svpt), "DF%": percent(side(True, "df"), svpt),
+                    "1stIn": percent(first_in, svpt), "1st%": percent(first_won, first_in), "2nd%": percent(second_won, svpt - first_in),
+                    "BPSvd": ["0/0"] * len(player_matches)}),
+                "recent_results_return": dict(common, **{
+                    "TPW": percent(first_won + second_won + opp_svpt - opp_first_won - opp_second_won, svpt + opp_svpt),
+                    "RPW": percent(opp_svpt - opp_first_won - opp_second_won, opp_svpt), "vA%": percent(side(False, "ace"), opp_svpt),
+                    "v1st%": percent(opp_first_in - opp_first_won, opp_first_in),
+                    "v2nd%": percent(opp_svpt - opp_first_in - opp_second_won, opp_svpt - opp_first_in),
+                    "BPCnv": ["0/0"] * len(player_matches)}),
+            }
+            self._cache[key] = {name: render_table(RESULTS_HEADERS[name], table) for name, table in columns.items()}
+        return self._cache[key]
+
+    def install_shared_data(self):
+        """Point TennisDataScraper's shared tables at the fixtures so nothing is scraped"""
+        from manip import TennisDataScraper
+
+        TennisDataScraper._shared_data.update({
+            "surface_data": self.surface_data,
+            "elo_data": self.elo_table,
+            "y_elo_data": None,
+            "adjusted_elo": self.elo_table,
+            "initialized": True,
+        })
+
+    def player_stats(self, first_name, last_name, num_weeks=52, current_tournament="Wimbledon"):
+        """A PlayerServeReturnStats over the fixture results, built without a browser"""
+        from manip import PlayerServeReturnStats
+        from model import get_model_config
+        from results import ResultHistory
+
+        player_id = next(player[0] for player in self.players if player[1:] == (first_name, last_name))
+        stats = PlayerServeReturnStats.__new__(PlayerServeReturnStats)
+        stats.config = get_model_config()
+        stats.first_name = first_name
+        stats.last_name = last_name
+        stats.recent_history = ResultHistory.from_frame(self.scraped_results(player_id))
+        stats.num_weeks = num_weeks
+        stats.current_tournament = current_tournament
+        return stats
+
+    @property
+    def slate(self):
+        """SLATE_SIZE (first, last, first, last, tournament) matches between the fixture players"""
+        players = self.players
+        return [(players[2 * idx][1], players[2 * idx][2], players[2 * idx + 1][1], players[2 * idx + 1][2], "Wimbledon")
+                for idx in range(len(players) // 2)]
+
+def render_table(headers, columns):
+    """An HTML page holding one table with a header row and a row of cells per value"""
+    head = "".join(f"<th>{html.escape(header)}</th>" for header in headers)
+    rows = "".join("<tr>" + "".join(f"<td>{html.escape(str(value))}</td>" for value in row) + "</tr>"
+                   for row in zip(*(columns[header] for header in headers)))
+    return f"<html><body><table><thead><tr>{head}</tr></thead><tbody>{rows}</tbody></table></body></html>"
+
+def record_pages(first_name, last_name, path=PAGES_DIR):
+    """Save a player's Tennis Abstract results pages, as the browser renders them, for the parse benchmark"""
+    from scrape import PlayerDataScraper
+
+    scraper = PlayerDataScraper(first_name, last_name)
+    os.makedirs(path, exist_ok=True)
+    for name in RESULTS_TABLES:
+        page = scraper.scrape_html(scraper.player_stats_url.get_url(name))
+        with open(os.path.join(path, f"{name}.html"), "w", encoding="utf-8") as f:
+            f.write(str(page))
+
+class FixturePlayerCache:
+    """A run.predict_match player cache serving fixture stats"""
+
+    def __init__(self, fixtures):
+        self.fixtures = fixtures
+
+    def get(self, first_name, last_name, num_weeks, current_tournament, career=False):
+        return self.fixtures.player_stats(first_name, last_name, num_weeks, current_tournament)
+
+def bench_match_prob(fixtures):
+    from mdp import get_match_prob
+
+    return lambda: get_match_prob(0.66, 0.62), {"number": 100}
+
+def bench_match_prob_batch(fixtures):
+    from mdp import get_match_prob_batch
+
+    rng = np.random.default_rng(0)
+    p1_service, p2_service = rng.uniform(0.55, 0.75, 2700), rng.uniform(0.55, 0.75, 2700)
+    return lambda: get_match_prob_batch(p1_service, p2_service), {"repeat": 3}
+
+def bench_normalize_data(fixtures):
+    fixtures.install_shared_data()
+    first_name, last_name = fixtures.players[0][1:]
+    stats = fixtures.player_stats(first_name, last_name)
+    return lambda: stats.normalize_data(), {}
+
+def bench_parse_results(fixtures):
+    from results import ResultHistory
+
+    results = fixtures.scraped_results(fixtures.players[0][0])
+    return lambda: ResultHistory.from_frame(results), {}
+
+def bench_parse_results_pages(fixtures):
+    from bs4 import BeautifulSoup
+    from scrape import PlayerDataScraper
+
+    player_id, first_name, last_name = fixtures.players[0]
+    pages = fixtures.results_pages(player_id)
+    scraper = PlayerDataScraper(first_name, last_name)
+
+    def run():
+        tables = {name: scraper.parse_table_df(BeautifulSoup(page, "html.parser"), name) for name, page in pages.items()}
+        return scraper.merge_results(*(tables[name] for name in RESULTS_TABLES))
+    return run, {}
+
+def bench_estimate_spw_rpw(fixtures):
+    fixtures.install_shared_data()
+    first_name, last_name = fixtures.players[0][1:]
+    stats = fixtures.player_stats(first_name, last_name)
+
+    def run():
+        with quiet():
+            stats.estimate_spw_rpw()
+    return run, {}
+
+def bench_get_percentages(fixtures):
+    if REPO_DIR not in sys.path:
+        sys.path.insert(0, REPO_DIR)
+    from player_historical_data import get_percentages
+
+    season = fixtures.raw_season
+    return lambda: get_percentages(season), {"repeat": 3}
+
+def bench_parse_scores(fixtures):
+    from util import parse_scores
+
+    scores = fixtures.raw_season["score"].to_numpy(dtype=object)
+    return lambda: parse_scores(scores), {}
+
+def bench_score_reader(fixtures):
+    from util import score_reader
+
+    scores = fixtures.raw_season["score"].dropna().to_numpy(dtype=object)[:2000]
+
+    def run():
+        for score in scores:
+            score_reader(score)
+    return run, {}
+
+def bench_batch_prediction(fixtures):
+    from run import batch_predeiction
+
+    fixtures.install_shared_data()
+    slate = fixtures.slate
+    player_cache = FixturePlayerCache(fixtures)
+
+    def run():
+        with quiet():
+            batch_predeiction(slate, num_weeks=52, player_cache=player_cache)
+    return run, {"repeat": 3}
+
+def bench_price_draw(fixtures):
+    from draw import price_draw
+
+    rng = np.random.default_rng(0)
+    spw, rpw, elo = rng.uniform(55, 75, 128), rng.uniform(30, 45, 128), rng.uniform(1600, 2200, 128)
+    return lambda: price_draw(list(range(128)), spw, rpw, elo, best_of=5), {}
+
+# name -> setup taking the fixtures and returning (callable, measure options)
+BENCHMARKS = {
+    "mdp.get_match_prob": bench_match_prob,
+    "mdp.get_match_prob_batch[2700]": bench_match_prob_batch,
+    "scrape.parse_results_pages": bench_parse_results_pages,
+    "results.ResultHistory.from_frame": bench_parse_results,
+    "manip.normalize_data": bench_normalize_data,
+    "manip.estimate_spw_rpw": bench_estimate_spw_rpw,
+    "player_historical_data.get_percentages[season]": bench_get_percentages,
+    "util.parse_scores[season]": bench_parse_scores,
+    "util.score_reader[2000]": bench_score_reader,
+    f"run.batch_predeiction[{SLATE_SIZE}]": bench_batch_prediction,
+    "draw.price_draw[128]": bench_price_draw,
+}
+
+def get_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=REPO_DIR, capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def run_benchmarks(names=None, repeat=None):
+    """
+    Run the benchmarks, skipping (with the reason) any whose imports or fixtures are unavailable
+
+    :param names: substrings selecting benchmarks, defaults to all of them
+    :return: a history record dict
+    """
+    fixtures = Fixtures()
+    results = {}
+    skipped = {}
+    for name, setup in BENCHMARKS.items():
+        if names and not any(selected in name for selected in names):
+            continue
+        try:
+            function, options = setup(fixtures)
+        except ImportError as e:
+            skipped[name] = f"{type(e).__name__}: {e}"
+            print(f"{name:<50} skipped ({skipped[name]})")
+            continue
+        if repeat is not None:
+            options = dict(options, repeat=repeat)
+        results[name] = measure(function, **options)
+        print(f"{name:<50} {results[name]['best'] * 1000:10.3f}ms best, {results[name]['median'] * 1000:10.3f}ms median")
+    for module in LIGHT_MODULES:
+        name = f"import.{module}"
+        if names and not any(selected in name for selected in names):
+            continue
+        results[name] = measure_import(module, repeat or 5)
+        heavy = f", loaded {', '.join(results[name]['heavy'])}" if results[name]["heavy"] else ""
+        print(f"{name:<50} {results[name]['best'] * 1000:10.3f}ms best, {results[name]['median'] * 1000:10.3f}ms median{heavy}")
+    return {
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "commit": get_commit(),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "pandas": pd.__version__,
+        "machine": platform.machine(),
+        "results": results,
+        "skipped": skipped,
+    }
+
+def append_history(record, path=HISTORY_PATH):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "a") as f:
+        f.write(json.dumps(record) + "\n")
+
+def load_history(path=HISTORY_PATH):
+    if not os.path.exists(path):
+        return []
+    with open(path) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+def compare_records(current, baseline, threshold=0.1):
+    """
+    Compare two runs benchmark by benchmark on their best times
+
+    An import that now loads a heavy module its baseline did not is a regression whatever its time.
+
+    :param threshold: relative slowdown that counts as a regression, 0.1 is 10% slower
+    :return: DataFrame with baseline, current, ratio and status (regression, improvement, ok, new or missing)
+    """
+    rows = []
+    for name in sorted(set(current["results"]) | set(baseline["results"])):
+        base = baseline["results"].get(name, {}).get("best")
+        now = current["results"].get(name, {}).get("best")
+        if base is None or now is None:
+            status, ratio = ("new" if base is None else "missing"), np.nan
+        else:
+            ratio = now / base
+            status = "regression" if ratio > 1 + threshold else "improvement" if ratio < 1 / (1 + threshold) else "ok"
+            if set(current["results"][name].get("heavy", [])) - set(baseline["results"][name].get("heavy", [])):
+                status = "regression"
+        rows.append({"benchmark": name, "baseline_ms": None if base is None else base * 1000,
+                     "current_ms": None if now is None else now * 1000, "ratio": ratio, "status": status})
+    return pd.DataFrame(rows)
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the pricing, featurization and parsing hot paths")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    run_parser = subparsers.add_parser("run", help="Run the benchmarks and append the timings to the history file")
+    run_parser.add_argument("names", nargs="*", help="Only run benchmarks whose name contains one of these")
+    run_parser.add_argument("--repeat", type=int, default=None)
+    run_parser.add_argument("--history", default=HISTORY_PATH)
+    run_parser.add_argument("--save-baseline", action="store_true", help=f"Also write this run to {BASELINE_PATH}")
+    compare_parser = subparsers.add_parser("compare", help="Compare the latest run against the baseline, exit 1 on a regression")
+    compare_parser.add_argument("--history", default=HISTORY_PATH)
+    compare_parser.add_argument("--baseline", default=BASELINE_PATH, help="A baseline json, or a run number in the history (0 is the first)")
+    compare_parser.add_argument("--threshold", type=float, default=0.1)
+    subparsers.add_parser("list", help="List the benchmarks")
+    record_parser = subparsers.add_parser("record", help=f"Save a player's results pages to {PAGES_DIR}, needs a browser")
+    record_parser.add_argument("first_name")
+    record_parser.add_argument("last_name")
+    args = parser.parse_args()
+
+    if args.command == "list":
+        print("\n".join(BENCHMARKS))
+    elif args.command == "record":
+        record_pages(args.first_name, args.last_name)
+    elif args.command == "run":
+        record = run_benchmarks(args.names, args.repeat)
+        append_history(record, args.history)
+        if args.save_baseline:
+            with open(BASELINE_PATH, "w") as f:
+                json.dump(record, f, indent=1)
+    else:
+        history = load_history(args.history)
+        if not history:
+            parser.error(f"No runs in {args.history}, run `python bench.py run` first")
+        if args.baseline.isdigit():
+            baseline = history[int(args.baseline)]
+        else:
+            with open(args.baseline) as f:
+                baseline = json.load(f)
+        comparison = compare_records(history[-1], baseline, args.threshold)
+        print(f"{history[-1]['commit']} ({history[-1]['timestamp']}) vs {baseline['commit']} ({baseline['timestamp']})")
+        print(comparison.to_string(index=False, float_format=lambda value: f"{value:.3f}"))
+        if (comparison["status"] == "regression").any():
+            sys.exit(1)
+
+if __name__ == "__main__":
+    main()
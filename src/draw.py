@@ -0,0 +1,250 @@
+import argparse
+import time
+import numpy as np
+import pandas as pd
+from mdp import get_match_prob_batch
+from model import combine_serve_return, get_model_config
+from util import prob_to_decimal
+
+ROUND_ORDER = ["R128", "R64", "R32", "R16", "QF", "SF", "F"]
+
+def round_names(draw_size):
+    """Names of the rounds a player can reach in a draw, from entering it to winning it: R128, ..., F, W"""
+    names = []
+    size = draw_size
+    while size > 1:
+        names.append({8: "QF", 4: "SF", 2: "F"}.get(size, f"R{size}"))
+        size //= 2
+    return names + ["W"]
+
+def get_tournament_speed(tournament, surface=None, config=None, surface_data=None):
+    """
+    The surface speed a tournament is played at
+
+    :param surface_data: a surface speed table with Tournament and Surface Speed columns, defaults to
+    TennisDataScraper's if this process has already loaded it
+    :return: the tournament's speed from the table, else its surface's fallback speed from the config,
+    1.0 when surface speed is switched off
+    """
+    config = get_model_config(config)
+    if not config["use_surface_speed"]:
+        return 1.0
+    if surface_data is None:
+        surface_data = _loaded_surface_data()
+    if surface_data is not None:
+        speed = surface_data.loc[surface_data["Tournament"] == tournament, "Surface Speed"]
+        if not speed.empty:
+            return float(speed.iloc[0])
+    return float(config["fallback_speeds"].get(surface, 1.0))
+
+def _loaded_surface_data():
+    """TennisDataScraper's scraped surface speed table, without scraping it if it isn't loaded yet"""
+    try:
+        from manip import TennisDataScraper
+    except ImportError:
+        return None
+    return TennisDataScraper._shared_data["surface_data"]
+
+def fill_unknown(values, quantile=0.25):
+    """Price players without enough data as a weak member of the field, at the field's quantile"""
+    values = np.asarray(values, dtype=np.float64)
+    known = np.isfinite(values)
+    if known.all() or not known.any():
+        return values
+    return np.where(known, values, np.quantile(values[known], quantile))
+
+def get_pairwise_probs(spw, rpw, elo=None, best_of=3, config=None):
+    """
+    Every player's chance to beat every other player, priced in one batch
+
+    :param spw: array of service points won percentages (0-100), already adjusted for the tournament's surface
+    :param rpw: array of return points won percentages (0-100)
+    :param elo: optional array of ELO ratings, used to weight the serve/return blend
+    :param best_of: the number of sets in each match
+    :return: (n, n) array with the row player's win probability against the column player
+    """
+    config = get_model_config(config)
+    spw, rpw = np.asarray(spw, dtype=np.float64), np.asarray(rpw, dtype=np.float64)
+    rows, cols = np.triu_indices(len(spw), k=1)
+    elo_diffs = np.asarray(elo, dtype=np.float64)[rows] - np.asarray(elo, dtype=np.float64)[cols] if config["use_elo"] and elo is not None else 0
+    row_combined, col_combined = combine_serve_return(spw[rows], rpw[rows], spw[cols], rpw[cols], elo_diffs,
+                                                      config["min_weight"], config["max_weight"])
+    # Serve percentages pushed past 0 or 1 by the adjustments can't be priced
+    row_win_probs = get_match_prob_batch(np.clip(row_combined, 1, 99) / 100, np.clip(col_combined, 1, 99) / 100, best_of)[0]
+    win_probs = np.zeros((len(spw), len(spw)))
+    win_probs[rows, cols] = row_win_probs
+    win_probs[cols, rows] = 1 - row_win_probs
+    return win_probs
+
+def get_round_probs(win_probs, entrants=None):
+    """
+    Exact chance of every draw position reaching every round
+
+    A player reaches the next round by winning the current one against whoever comes out of the
+    other half of their section, so each round is one (n, n) matrix product over the previous
+    round's reach probabilities.
+
+    :param win_probs: (n, n) pairwise win probabilities in draw order, n a power of two
+    :param entrants: optional boolean array, False for byes
+    :return: (n, rounds + 1) array, column r being the chance of winning r matches
+    """
+    num_slots = len(win_probs)
+    num_rounds = num_slots.bit_length() - 1
+    if num_slots != 2 ** num_rounds:
+        raise ValueError(f"Draw size must be a power of two, got {num_slots}")
+    entrants = np.ones(num_slots, dtype=bool) if entrants is None else np.asarray(entrants, dtype=bool)
+    win_probs = np.where(entrants[:, None] & entrants[None, :], np.nan_to_num(win_probs), 0.0)
+    reach = np.zeros((num_slots, num_rounds + 1))
+    reach[:, 0] = entrants
+    slots = np.arange(num_slots)
+    for round_idx in range(num_rounds):
+        half = 2 ** round_idx
+        opponents = ((slots[:, None] // (2 * half) == slots[None, :] // (2 * half))
+                     & (slots[:, None] // half != slots[None, :] // half))
+        alive = reach[:, round_idx]
+        # A player whose opponents' half is all byes walks over
+        faced = opponents @ alive
+        reach[:, round_idx + 1] = alive * ((win_probs * opponents) @ alive + 1 - faced)
+    return reach
+
+def price_draw(players, spw, rpw, elo=None, best_of=3, config=None):
+    """
+    Round progression and outright prices of a draw
+
+    :param players: player labels in draw order, None for byes
+    :param spw: array of service points won percentages (0-100) in draw order, adjusted for the surface
+    :param rpw: array of return points won percentages (0-100)
+    :param elo: optional array of ELO ratings
+    :return: DataFrame with each player's chance of reaching every round and fair decimal odds to win it
+    """
+    entrants = np.array([player is not None for player in players])
+    win_probs = get_pairwise_probs(fill_unknown(spw), fill_unknown(rpw), None if elo is None else fill_unknown(elo), best_of, config)
+    reach = get_round_probs(win_probs, entrants)
+    draw = pd.DataFrame(reach, columns=round_names(len(players)))
+    draw.insert(0, "player", list(players))
+    draw["odds"] = prob_to_decimal(draw["W"].to_numpy())
+    return draw[entrants].reset_index(drop=True)
+
+def local_field_inputs(player_ids, date, surface, tournament=None, config=None, pricer=None):
+    """
+    Serve/return and ELO inputs of a field from local data only, as PointInTimePricer builds them
+
+    :param player_ids: player ids of the field, None for byes
+    :param date: the date the draw is priced on
+    :param pricer: optional PointInTimePricer to reuse its features
+    :return: (spw, rpw, elo) arrays, NaN for byes and players without enough matches
+    """
+    from features import PointInTimePricer
+
+    config = get_model_config(config)
+    pricer = PointInTimePricer(config) if pricer is None else pricer
+    entrants = np.array([player_id is not None for player_id in player_ids])
+    entrant_ids = np.array([player_id for player_id in player_ids if player_id is not None], dtype=np.int64)
+    # Each player meeting themselves, so the pricer's winner side is the whole field
+    field = pd.DataFrame({"winner_id": entrant_ids, "loser_id": entrant_ids, "Date": pd.Timestamp(date), "Surface": surface})
+    spw, rpw = (side[:len(entrant_ids)] for side in pricer.get_adjusted_serve_return(field, config))
+    elo = pricer.get_elo(field)[:len(entrant_ids)]
+    speed = get_tournament_speed(tournament, surface, config)
+    inputs = np.full((3, len(player_ids)), np.nan)
+    inputs[:, entrants] = spw * speed, rpw / speed, elo
+    return inputs[0], inputs[1], inputs[2]
+
+def scraped_field_inputs(players, tournament, num_weeks=-1, player_cache=None, config=None):
+    """
+    Serve/return and ELO inputs of a field from Tennis Abstract, as predict_match builds them
+
+    :param players: (first name, last name) pairs in draw order, None for byes
+    :return: (spw, rpw, elo) arrays, NaN for byes
+    """
+    from run import load_player_stats
+
+    config = get_model_config(config)
+    inputs = np.full((3, len(players)), np.nan)
+    elo_table = None
+    for slot, player in enumerate(players):
+        if player is None:
+            continue
+        first_name, last_name = player
+        player_stats = load_player_stats(first_name, last_name, num_weeks, tournament, player_cache=player_cache, config=config)
+        # estimate_spw_rpw applies the tournament's surface speed
+        inputs[0, slot], inputs[1, slot] = player_stats.estimate_spw_rpw(config=config)
+        if elo_table is None:
+            elo_table = player_stats.get_adjusted_elo()
+        player_elo = elo_table.loc[elo_table["Player"] == f"{first_name} {last_name}", "Average Elo"]
+        if not player_elo.empty:
+            inputs[2, slot] = float(player_elo.iloc[0])
+    return inputs[0], inputs[1], inputs[2]
+
+def get_historical_draw(tourney_name, year):
+    """
+    Rebuild a past draw from the match history, byes included
+
+    :return: (player ids in draw order with None for byes, dict of the tournament's date, surface, best_of and
+    each player's last round as a number of matches won)
+    """
+    from history import MatchStore, drop_unknown_players, load_matches
+
+    columns = ["tourney_name", "tourney_date", "surface", "best_of", "round", "match_num", "winner_id", "loser_id"]
+    if MatchStore.exists():
+        matches = drop_unknown_players(MatchStore().year(year, columns=columns))
+    else:
+        matches = load_matches(("singles",), columns)
+        matches = matches[matches["tourney_date"].dt.year == year]
+    matches = matches[(matches["tourney_name"] == tourney_name) & matches["round"].isin(ROUND_ORDER)]
+    if matches.empty:
+        raise ValueError(f"No {tourney_name} {year} draw in the match history")
+    rounds = [round_name for round_name in ROUND_ORDER if round_name in set(matches["round"])]
+    played = {(row.round, player_id): (row.winner_id, row.loser_id)
+              for row in matches.itertuples() for player_id in (row.winner_id, row.loser_id)}
+
+    def expand(player_id, depth):
+        # The draw positions a player came through to win their first depth rounds, a bye where they didn't play
+        if depth == 0:
+            return [player_id]
+        match = played.get((rounds[depth - 1], player_id))
+        if match is None:
+            return expand(player_id, depth - 1) + [None] * 2 ** (depth - 1)
+        return expand(match[0], depth - 1) + expand(match[1], depth - 1)
+
+    final = matches[matches["round"] == rounds[-1]].iloc[0]
+    slots = expand(final["winner_id"], len(rounds))
+    wins = matches.groupby("winner_id").size()
+    info = {
+        "date": final["tourney_date"],
+        "surface": final["surface"],
+        "best_of": int(final["best_of"]) if pd.notna(final["best_of"]) else 3,
+        "wins": {int(player_id): int(wins.get(player_id, 0)) for player_id in slots if player_id is not None},
+    }
+    return [None if player_id is None else int(player_id) for player_id in slots], info
+
+def main():
+    parser = argparse.ArgumentParser(description="Price round progression and outright odds for a past draw from local data")
+    parser.add_argument("tournament", help='Tournament name as in the match history, e.g. "Australian Open"')
+    parser.add_argument("year", type=int)
+    parser.add_argument("--best-of", type=int, default=None, help="Defaults to the draw's format")
+    parser.add_argument("--num-weeks", type=int, default=52)
+    parser.add_argument("--scrape-speeds", action="store_true", help="Use Tennis Abstract's surface speed table for the tournament")
+    parser.add_argument("--top", type=int, default=16)
+    args = parser.parse_args()
+
+    from players import get_registry
+
+    if args.scrape_speeds:
+        from manip import TennisDataScraper
+        TennisDataScraper()
+    player_ids, info = get_historical_draw(args.tournament, args.year)
+    config = get_model_config({"num_weeks": args.num_weeks})
+    start = time.perf_counter()
+    spw, rpw, elo = local_field_inputs(player_ids, info["date"], info["surface"], args.tournament, config)
+    features_time = time.perf_counter() - start
+    start = time.perf_counter()
+    draw = price_draw(player_ids, spw, rpw, elo, args.best_of or info["best_of"], config)
+    pricing_time = time.perf_counter() - start
+
+    draw["won"] = draw["player"].map(info["wins"])
+    draw["player"] = get_registry().get_full_names(draw["player"].to_numpy())
+    print(draw.sort_values("W", ascending=False).head(args.top).to_string(index=False, float_format=lambda value: f"{value:.3f}"))
+    print(f"{len(draw)} players, features in {features_time:.2f}s, draw priced in {pricing_time:.3f}s")
+
+if __name__ == "__main__":
+    main()
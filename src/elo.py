@@ -0,0 +1,430 @@
+import argparse
+import collections
+import json
+import os
+import threading
+import time
+import numpy as np
+import pandas as pd
+from features import DAY_BITS, DAY_OFFSET, SURFACES, estimate_match_days, to_days
+from history import DATA_DIR, STORE_DIR, level_files, load_matches
+from players import get_registry
+from util import compress_name
+
+ELO_PATH = os.path.join(STORE_DIR, "elo.npz")
+ELO_LEVELS = ("singles", "challenger", "futures")
+
+# local_adjusted_elo tables kept per engine, one per as-of day
+ADJUSTED_ELO_CACHE_SIZE = 64
+
+ELO_COLUMNS = ["tourney_date", "tourney_name", "tourney_level", "surface", "round", "best_of", "winner_id", "loser_id", "score"]
+
+# Per match history kept so ratings can be looked up as of any date
+HISTORY_FIELDS = ["days", "winners", "losers", "surfaces",
+                  "winner_elo", "loser_elo", "winner_surface_elo", "loser_surface_elo",
+                  "winner_elo_after", "loser_elo_after", "winner_surface_elo_after", "loser_surface_elo_after"]
+
+def prepare_matches(matches):
+    """
+    Drop walkovers, team events and undated rows, and estimate the day each match was played
+
+    :param matches: DataFrame with the ELO_COLUMNS
+    :return: (days, winner ids, loser ids, surface codes) arrays in play order
+    """
+    matches = matches[matches["tourney_date"].notna() & (matches["tourney_level"] != "D")]
+    matches = matches[~matches["tourney_name"].astype(str).str.contains("Laver Cup", na=False)]
+    matches = matches[~matches["score"].astype(str).str.contains("W/O", na=False)]
+    days = estimate_match_days(matches["tourney_date"], matches["round"], matches["best_of"])
+    order = np.argsort(days, kind="stable")
+    surfaces = pd.Categorical(matches["surface"], categories=SURFACES).codes.astype(np.int8)
+    return (days[order], matches["winner_id"].to_numpy(dtype=np.int64)[order],
+            matches["loser_id"].to_numpy(dtype=np.int64)[order], surfaces[order])
+
+def get_generations(winners, losers, last_generation):
+    """
+    Group matches into generations where no player appears twice
+
+    A match's generation is one more than the latest generation of either player, so every
+    generation only depends on earlier ones and can be rated as a single vectorized step.
+
+    :param last_generation: list of each player's latest generation, updated in place
+    """
+    generations = np.empty(len(winners), dtype=np.int64)
+    for idx, (winner, loser) in enumerate(zip(winners.tolist(), losers.tolist())):
+        generation = max(last_generation[winner], last_generation[loser]) + 1
+        last_generation[winner] = generation
+        last_generation[loser] = generation
+        generations[idx] = generation
+    return generations
+
+class EloEngine:
+    """
+    Overall and per-surface ELO replayed from the local match history
+
+    Player state lives in arrays indexed by a dense player index, and matches are rated a
+    generation at a time (see get_generations). K decays with the number of matches played,
+    K = k_scale / (matches + k_offset) ** k_shape. Every rated match keeps both players' ratings
+    before and after it so ratings can be looked up as of any date without replaying.
+    """
+
+    def __init__(self, initial_rating=1500.0, k_scale=250.0, k_offset=5.0, k_shape=0.4):
+        self.initial_rating = initial_rating
+        self.k_scale = k_scale
+        self.k_offset = k_offset
+        self.k_shape = k_shape
+        self.ids = np.zeros(0, dtype=np.int64)
+        self.ratings = np.zeros(0)
+        self.counts = np.zeros(0)
+        self.surface_ratings = np.zeros((0, len(SURFACES)))
+        self.surface_counts = np.zeros((0, len(SURFACES)))
+        self.last_generation = []
+        self.history = {field: np.zeros(0, dtype=np.int64 if field in ("days", "winners", "losers") else np.float64)
+                        for field in HISTORY_FIELDS}
+        self.history["surfaces"] = np.zeros(0, dtype=np.int8)
+        self._index = {}
+        self._lookup = None
+        self._adjusted_elo = collections.OrderedDict()
+        self._adjusted_elo_lock = threading.Lock()
+
+    def k_factor(self, counts):
+        return self.k_scale / (counts + self.k_offset) ** self.k_shape
+
+    @property
+    def last_day(self):
+        return int(self.history["days"][-1]) if len(self.history["days"]) else None
+
+    def _player_index(self, player_ids):
+        """Dense indexes of player ids, growing the state arrays for new players"""
+        new_ids = pd.unique(player_ids[~np.isin(player_ids, self.ids)])
+        if len(new_ids):
+            for player_id in new_ids.tolist():
+                self._index[player_id] = len(self._index)
+            self.ids = np.concatenate([self.ids, new_ids])
+            self.ratings = np.concatenate([self.ratings, np.full(len(new_ids), self.initial_rating)])
+            self.counts = np.concatenate([self.counts, np.zeros(len(new_ids))])
+            self.surface_ratings = np.vstack([self.surface_ratings, np.full((len(new_ids), len(SURFACES)), self.initial_rating)])
+            self.surface_counts = np.vstack([self.surface_counts, np.zeros((len(new_ids), len(SURFACES)))])
+            self.last_generation.extend([0] * len(new_ids))
+        return np.array([self._index[player_id] for player_id in player_ids.tolist()], dtype=np.int64)
+
+    def _rate(self, winners, losers, surfaces):
+        """Rate matches in play order, returning the HISTORY_FIELDS rating columns"""
+        rated = {field: np.zeros(len(winners)) for field in HISTORY_FIELDS[4:]}
+        generations = get_generations(winners, losers, self.last_generation)
+        order = np.argsort(generations, kind="stable")
+        bounds = np.flatnonzero(np.diff(generations[order])) + 1
+        for rows in np.split(order, bounds):
+            winner, loser = winners[rows], losers[rows]
+            winner_elo, loser_elo = self.ratings[winner], self.ratings[loser]
+            loss_probability = 1 / (1 + 10 ** ((winner_elo - loser_elo) / 400))
+            self.ratings[winner] = winner_elo + self.k_factor(self.counts[winner]) * loss_probability
+            self.ratings[loser] = loser_elo - self.k_factor(self.counts[loser]) * loss_probability
+            self.counts[winner] += 1
+            self.counts[loser] += 1
+            rated["winner_elo"][rows], rated["loser_elo"][rows] = winner_elo, loser_elo
+            rated["winner_elo_after"][rows], rated["loser_elo_after"][rows] = self.ratings[winner], self.ratings[loser]
+
+            surface = surfaces[rows]
+            known = surface >= 0
+            winner, loser, surface, rows = winner[known], loser[known], surface[known], rows[known]
+            winner_elo, loser_elo = self.surface_ratings[winner, surface], self.surface_ratings[loser, surface]
+            loss_probability = 1 / (1 + 10 ** ((winner_elo - loser_elo) / 400))
+            self.surface_ratings[winner, surface] = winner_elo + self.k_factor(self.surface_counts[winner, surface]) * loss_probability
+            self.surface_ratings[loser, surface] = loser_elo - self.k_factor(self.surface_counts[loser, surface]) * loss_probability
+            self.surface_counts[winner, surface] += 1
+            self.surface_counts[loser, surface] += 1
+            rated["winner_surface_elo"][rows], rated["loser_surface_elo"][rows] = winner_elo, loser_elo
+            rated["winner_surface_elo_after"][rows] = self.surface_ratings[winner, surface]
+            rated["loser_surface_elo_after"][rows] = self.surface_ratings[loser, surface]
+        return rated
+
+    def update(self, matches):
+        """
+        Rate matches played on or after the last rated day
+
+        :param matches: DataFrame with the ELO_COLUMNS, e.g. from history.load_matches
+        :return: self
+        :raises ValueError: if a match was played before the last rated day, replay from scratch instead
+        """
+        days, winner_ids, loser_ids, surfaces = prepare_matches(matches)
+        if len(days) == 0:
+            return self
+        if self.last_day is not None and days[0] < self.last_day:
+            raise ValueError(f"Matches from {np.datetime64(int(days[0]), 'D')} are before the last rated day "
+                             f"{np.datetime64(self.last_day, 'D')}, replay the whole history instead")
+        winners = self._player_index(winner_ids)
+        losers = self._player_index(loser_ids)
+        rated = self._rate(winners, losers, surfaces)
+        rated.update({"days": days, "winners": winners, "losers": losers, "surfaces": surfaces})
+        for field in HISTORY_FIELDS:
+            self.history[field] = np.concatenate([self.history[field], rated[field]])
+        self._lookup = None
+        with self._adjusted_elo_lock:
+            self._adjusted_elo.clear()
+        return self
+
+    @classmethod
+    def replay(cls, levels=ELO_LEVELS, matches=None, **params):
+        """Rate every match of the given levels from the start of the history"""
+        if matches is None:
+            matches = load_matches(levels, ELO_COLUMNS)
+        return cls(**params).update(matches)
+
+    def _lookup_tables(self):
+        """
+        Every (player, day) rating change sorted by (player index << DAY_BITS) + day + DAY_OFFSET,
+        overall and per surface, so as-of lookups are binary searches
+        """
+        if self._lookup is None:
+            history = self.history
+            players = np.concatenate([history["winners"], history["losers"]])
+            days = np.concatenate([history["days"], history["days"]])
+            surfaces = np.concatenate([history["surfaces"], history["surfaces"]])
+            keys = (players << DAY_BITS) + days + DAY_OFFSET
+            # Ties on a day keep play order, so a player's later match that day wins
+            order = np.lexsort((np.tile(np.arange(len(history["days"])), 2), keys))
+            lookup = {"keys": keys[order],
+                      "elo": np.concatenate([history["winner_elo_after"], history["loser_elo_after"]])[order]}
+            surface_elo = np.concatenate([history["winner_surface_elo_after"], history["loser_surface_elo_after"]])
+            for code, surface in enumerate(SURFACES):
+                on_surface = order[surfaces[order] == code]
+                lookup[surface] = (keys[on_surface], surface_elo[on_surface])
+            self._lookup = lookup
+        return self._lookup
+
+    @staticmethod
+    def _latest(keys, values, query_keys, default):
+        """The value of the last row before each query key with the same player, default when there is none"""
+        if len(keys) == 0:
+            return np.full(len(query_keys), default)
+        positions = np.searchsorted(keys, query_keys, side="left") - 1
+        clipped = np.maximum(positions, 0)
+        found = (positions >= 0) & ((keys[clipped] >> DAY_BITS) == (query_keys >> DAY_BITS))
+        return np.where(found, values[clipped], default)
+
+    def batch_ratings(self, player_ids, dates, surfaces=None):
+        """
+        Ratings of many players going into a date, from matches strictly before it
+
+        :param player_ids: array of player ids, unknown players get the initial rating
+        :param dates: array of as-of dates
+        :param surfaces: optional array of surface names for the surface ratings
+        :return: (overall ratings, surface ratings or None)
+        """
+        player_ids = np.atleast_1d(np.asarray(player_ids, dtype=np.int64))
+        days = np.broadcast_to(np.atleast_1d(to_days(dates)), player_ids.shape)
+        index = np.array([self._index.get(player_id, -1) for player_id in player_ids.tolist()], dtype=np.int64)
+        known = index >= 0
+        # Unknown players search a key no row has so they fall back to the initial rating
+        query_keys = np.where(known, (np.maximum(index, 0) << DAY_BITS) + days + DAY_OFFSET, -1)
+        lookup = self._lookup_tables()
+        elo = np.where(known, self._latest(lookup["keys"], lookup["elo"], query_keys, self.initial_rating), self.initial_rating)
+        if surfaces is None:
+            return elo, None
+        surfaces = np.broadcast_to(np.atleast_1d(np.asarray(surfaces, dtype=object)), player_ids.shape)
+        surface_elo = np.full(len(player_ids), np.nan)
+        for surface in SURFACES:
+            on_surface = surfaces == surface
+            if on_surface.any():
+                keys, values = lookup[surface]
+                surface_elo[on_surface] = self._latest(keys, values, query_keys[on_surface], self.initial_rating)
+        return elo, surface_elo
+
+    def ratings_at(self, player_id, date, surface=None):
+        """(overall, surface) rating of one player going into a date, see batch_ratings"""
+        elo, surface_elo = self.batch_ratings([player_id], [date], None if surface is None else [surface])
+        return float(elo[0]), None if surface_elo is None else float(surface_elo[0])
+
+    def snapshot(self, date=None, surface=None):
+        """
+        Every rated player's ratings going into a date
+
+        :param date: the as-of date, defaults to after the last rated match
+        :return: DataFrame with player_id, Elo, matches, last_played and, with a surface, surface_elo
+        """
+        history = self.history
+        days = history["days"]
+        if date is None:
+            end_day = days[-1] + 1 if len(days) else 0
+        else:
+            end_day = int(to_days([date])[0])
+        before = days < end_day
+        players = np.concatenate([history["winners"][before], history["losers"][before]])
+        played = np.bincount(players, minlength=len(self.ids))
+        last_played = np.full(len(self.ids), np.iinfo(np.int64).min)
+        np.maximum.at(last_played, players, np.concatenate([days[before], days[before]]))
+        rated = np.flatnonzero(played > 0)
+        elo, surface_elo = self.batch_ratings(self.ids[rated], np.full(len(rated), end_day).astype("datetime64[D]"),
+                                              None if surface is None else np.full(len(rated), surface, dtype=object))
+        table = pd.DataFrame({
+            "player_id": self.ids[rated],
+            "Elo": elo,
+            "matches": played[rated],
+            "last_played": last_played[rated].astype("datetime64[D]"),
+        })
+        if surface is not None:
+            table["surface_elo"] = surface_elo
+        return table.sort_values("Elo", ascending=False, kind="stable").reset_index(drop=True)
+
+    def top_average(self, dates, top_n=300, active_weeks=52):
+        """
+        Average rating of the top_n players active in the active_weeks before each date
+
+        :param dates: array of dates, each distinct date is snapshotted once
+        :return: array with one average per date
+        """
+        days = np.atleast_1d(to_days(dates))
+        unique_days, inverse = np.unique(days, return_inverse=True)
+        history = self.history
+        ends = np.searchsorted(history["days"], unique_days, side="left")
+        # Sweep forward through the history once, keeping every player's latest rating and match day
+        ratings = np.full(len(self.ids), -np.inf)
+        last_played = np.full(len(self.ids), np.iinfo(np.int64).min)
+        averages = np.empty(len(unique_days))
+        start = 0
+        for idx, (day, end) in enumerate(zip(unique_days.tolist(), ends.tolist())):
+            if end > start:
+                players = np.concatenate([history["winners"][start:end], history["losers"][start:end]])
+                after = np.concatenate([history["winner_elo_after"][start:end], history["loser_elo_after"][start:end]])
+                rows = np.tile(np.arange(start, end), 2)
+                order = np.lexsort((rows, players))
+                latest = order[np.append(players[order][1:] != players[order][:-1], True)]
+                ratings[players[latest]] = after[latest]
+                last_played[players[latest]] = history["days"][rows[latest]]
+                start = end
+            active = ratings[last_played >= day - 7 * active_weeks]
+            if len(active) > top_n:
+                active = np.partition(active, len(active) - top_n)[-top_n:]
+            averages[idx] = active.mean() if len(active) else self.initial_rating
+        return averages[inverse.reshape(-1)]
+
+    def trailing(self, date, weeks=52):
+        """A fresh engine rated only on the matches in the weeks before a date, like Tennis Abstract's yElo"""
+        end_day = int(to_days([date])[0])
+        window = (self.history["days"] >= end_day - 7 * weeks) & (self.history["days"] < end_day)
+        engine = EloEngine(self.initial_rating, self.k_scale, self.k_offset, self.k_shape)
+        winner_ids = self.ids[self.history["winners"][window]]
+        loser_ids = self.ids[self.history["losers"][window]]
+        winners = engine._player_index(winner_ids)
+        losers = engine._player_index(loser_ids)
+        surfaces = self.history["surfaces"][window]
+        rated = engine._rate(winners, losers, surfaces)
+        rated.update({"days": self.history["days"][window], "winners": winners, "losers": losers, "surfaces": surfaces})
+        engine.history = rated
+        return engine
+
+    def save(self, path=ELO_PATH, levels=ELO_LEVELS):
+        """
+        Write the ratings, match history and parameters to a .npz file
+
+        :param levels: the levels the engine was replayed from, their csv mtimes are saved so is_stale can tell
+        when the file is out of date
+        """
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        np.savez(path, ids=self.ids, ratings=self.ratings, counts=self.counts,
+                 sources=np.array(json.dumps({"levels": list(levels), "files": elo_sources(levels)})),
+                 surface_ratings=self.surface_ratings, surface_counts=self.surface_counts,
+                 last_generation=np.asarray(self.last_generation, dtype=np.int64),
+                 params=np.array([self.initial_rating, self.k_scale, self.k_offset, self.k_shape]),
+                 **{f"history_{field}": values for field, values in self.history.items()})
+
+    @classmethod
+    def load(cls, path=ELO_PATH):
+        saved = np.load(path)
+        engine = cls(*saved["params"].tolist())
+        engine.ids = saved["ids"]
+        engine.ratings = saved["ratings"]
+        engine.counts = saved["counts"]
+        engine.surface_ratings = saved["surface_ratings"]
+        engine.surface_counts = saved["surface_counts"]
+        engine.last_generation = saved["last_generation"].tolist()
+        engine.history = {field: saved[f"history_{field}"] for field in HISTORY_FIELDS}
+        engine._index = {player_id: idx for idx, player_id in enumerate(engine.ids.tolist())}
+        return engine
+
+def elo_sources(levels=ELO_LEVELS, data_dir=DATA_DIR):
+    """The mtime of every csv the engine is replayed from, keyed by level/file name"""
+    return {f"{level}/{os.path.basename(path)}": os.path.getmtime(path) for level in levels for _, path in level_files(data_dir, level)}
+
+def is_stale(path=ELO_PATH, data_dir=DATA_DIR):
+    """True if the saved ratings are missing, predate recording their sources, or any of their csvs changed since"""
+    if not os.path.exists(path):
+        return True
+    with np.load(path) as saved:
+        if "sources" not in saved:
+            return True
+        sources = json.loads(str(saved["sources"]))
+    current = elo_sources(sources["levels"], data_dir)
+    # Without the csvs there is nothing to replay, serve the saved ratings
+    return bool(current) and current != sources["files"]
+
+_engine = None
+_engine_lock = threading.Lock()
+
+def get_elo_engine(path=ELO_PATH):
+    """Get the process-wide EloEngine, loading the saved ratings or replaying and saving the history if they are stale"""
+    global _engine
+    if _engine is None:
+        with _engine_lock:
+            if _engine is None:
+                if is_stale(path):
+                    print(f"Replaying the match history into {path}, the saved ratings are missing or out of date")
+                    EloEngine.replay().save(path)
+                _engine = EloEngine.load(path)
+    return _engine
+
+def local_adjusted_elo(as_of=None, engine=None, active_weeks=52):
+    """
+    The adjusted ELO table of TennisDataScraper.get_adjusted_elo built from local data as of a date
+
+    Elo is the full history rating and yElo the rating from only the last 52 weeks of matches.
+    Only players with a match in the active_weeks before the date are listed.
+
+    Tables are memoized on the engine per as-of day, the latest ADJUSTED_ELO_CACHE_SIZE of them,
+    so callers share them and must not modify them.
+
+    :param as_of: the as-of date, defaults to after the last rated match
+    :return: DataFrame with Elo Rank, Player, Elo, yElo, Average Elo and player_id columns
+    """
+    engine = get_elo_engine() if engine is None else engine
+    if as_of is None:
+        as_of = np.datetime64(engine.last_day + 1, "D")
+    key = (int(to_days([as_of])[0]), active_weeks)
+    with engine._adjusted_elo_lock:
+        table = engine._adjusted_elo.get(key)
+        if table is not None:
+            engine._adjusted_elo.move_to_end(key)
+            return table
+    table = _build_adjusted_elo(engine, as_of, active_weeks)
+    with engine._adjusted_elo_lock:
+        engine._adjusted_elo[key] = table
+        while len(engine._adjusted_elo) > ADJUSTED_ELO_CACHE_SIZE:
+            engine._adjusted_elo.popitem(last=False)
+    return table
+
+def _build_adjusted_elo(engine, as_of, active_weeks):
+    table = engine.snapshot(as_of)
+    table = table[table["last_played"] >= np.datetime64(pd.Timestamp(as_of), "D") - np.timedelta64(7 * active_weeks, "D")]
+    trailing = engine.trailing(as_of).snapshot(as_of)[["player_id", "Elo"]].rename(columns={"Elo": "yElo"})
+    table = table.merge(trailing, on="player_id", how="left").reset_index(drop=True)
+    table["Elo Rank"] = np.arange(1, len(table) + 1)
+    table["Player"] = get_registry().get_full_names(table["player_id"]).fillna("").map(compress_name).to_numpy()
+    table["Average Elo"] = table[["Elo", "yElo"]].mean(axis=1)
+    return table[["Elo Rank", "Player", "Elo", "yElo", "Average Elo", "player_id"]]
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay the local match history into overall and surface ELO ratings")
+    parser.add_argument("--levels", nargs="*", default=["singles", "challenger", "futures"])
+    parser.add_argument("--as-of", default=None, help="Print the ratings going into this date")
+    parser.add_argument("--top", type=int, default=20)
+    parser.add_argument("--output", default=ELO_PATH)
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    engine = EloEngine.replay(args.levels)
+    print(f"Rated {len(engine.history['days'])} matches between {len(engine.ids)} players in {time.perf_counter() - start:.1f}s")
+    engine.save(args.output, args.levels)
+    print(local_adjusted_elo(args.as_of, engine).head(args.top).to_string(index=False))
+
+if __name__ == "__main__":
+    main()
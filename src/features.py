@@ -0,0 +1,507 @@
+import numpy as np
+import pandas as pd
+from history import load_matches
+from mdp import get_match_prob_batch
+from model import combine_serve_return, get_model_config, get_opponent_quality_factor
+from rankings import get_rankings, ranking_files
+from recency import EVENT_DAYS, RecencyState
+
+FEATURE_COLUMNS = ["tourney_date", "tourney_name", "tourney_level", "surface", "round", "best_of",
+                   "winner_id", "loser_id", "winner_rank", "loser_rank",
+                   "w_svpt", "w_1stWon", "w_2ndWon", "l_svpt", "l_1stWon", "l_2ndWon"]
+
+SURFACES = ["Hard", "Clay", "Grass", "Carpet"]
+
+# How far into the event each round is played, as a fraction of the event's length
+ROUND_PROGRESS = {
+    "Q1": 0.0, "Q2": 0.0, "Q3": 0.0, "Q4": 0.0,
+    "R128": 0.1, "R64": 0.25, "R32": 0.35, "R16": 0.5, "RR": 0.5,
+    "QF": 0.7, "SF": 0.85, "BR": 1.0, "F": 1.0, "ER": 0.25,
+}
+
+# Sort keys are (player index << DAY_BITS) + days since 1970 + DAY_OFFSET, so one sorted int64
+# array orders rows by player then day, DAY_OFFSET keeps pre-1970 days positive
+DAY_BITS = 20
+DAY_OFFSET = 40000
+
+# A listed match is looked for among its players' events that started from MATCH_LOOKBACK_DAYS
+# before its date to MATCH_LOOKAHEAD_DAYS after, as slams list the Monday but start on Sunday
+MATCH_LOOKBACK_DAYS = 28
+MATCH_LOOKAHEAD_DAYS = 3
+
+# RecencyStates kept by PointInTimeFeatures, one per (half life, point weighting) pair
+RECENCY_STATES = 4
+
+def to_days(dates):
+    """Convert dates (anything pd.to_datetime accepts) to int days since 1970-01-01"""
+    return pd.to_datetime(dates).to_numpy().astype("datetime64[D]").astype(np.int64)
+
+def estimate_match_days(tourney_dates, rounds, best_of):
+    """
+    Estimate the day each match was played from its event start and round
+
+    tourney_date is the event's start, so every round of an event shares it. Spreading rounds
+    over the event (two weeks for best of five, one week otherwise) keeps later rounds of an
+    event out of the history used to price its earlier rounds.
+    """
+    progress = pd.Series(rounds).map(ROUND_PROGRESS).fillna(0.0).to_numpy()
+    event_days = np.where(np.asarray(best_of, dtype=np.float64) >= 5, 13, 6)
+    return to_days(tourney_dates) + np.floor(progress * event_days).astype(np.int64)
+
+def fill_ranks(ranks, player_ids, dates, max_age_days=28):
+    """Fill missing ranks in the match files from the weekly rankings as of each date, where they cover it"""
+    missing = ~np.isfinite(ranks)
+    if not missing.any() or not ranking_files():
+        return ranks
+    filled, _, _ = get_rankings().batch_lookup(player_ids[missing], dates[missing], max_age_days)
+    ranks = ranks.copy()
+    ranks[missing] = filled
+    return ranks
+
+class PointInTimeFeatures:
+    """
+    Serve/return, opponent strength and surface features built only from matches before a date
+
+    Every match is stored twice (once per player) sorted by (player, estimated match day), with
+    prefix sums of the point counts, so any window is two binary searches and a subtraction.
+    Davis Cup and Laver Cup matches are left out, as in PlayerServeReturnStats. Ranks missing from
+    the match files are filled from the weekly rankings where they cover the date.
+    """
+
+    def __init__(self, levels=("singles", "challenger"), matches=None):
+        if matches is None:
+            matches = load_matches(levels, FEATURE_COLUMNS)
+        matches = matches[(matches["tourney_level"] != "D") & ~matches["tourney_name"].astype(str).str.contains("Laver Cup", na=False)]
+        matches = matches[matches["tourney_date"].notna()]
+
+        days = estimate_match_days(matches["tourney_date"], matches["round"], matches["best_of"])
+        surface_codes = pd.Categorical(matches["surface"], categories=SURFACES).codes.astype(np.int8)
+        w_svpt = matches["w_svpt"].to_numpy(dtype=np.float64)
+        l_svpt = matches["l_svpt"].to_numpy(dtype=np.float64)
+        w_sv_won = matches["w_1stWon"].to_numpy(dtype=np.float64) + matches["w_2ndWon"].to_numpy(dtype=np.float64)
+        l_sv_won = matches["l_1stWon"].to_numpy(dtype=np.float64) + matches["l_2ndWon"].to_numpy(dtype=np.float64)
+        has_stats = (w_svpt > 0) & (l_svpt > 0) & np.isfinite(w_sv_won) & np.isfinite(l_sv_won)
+        w_rank = fill_ranks(matches["winner_rank"].to_numpy(dtype=np.float64), matches["winner_id"].to_numpy(), matches["tourney_date"].to_numpy())
+        l_rank = fill_ranks(matches["loser_rank"].to_numpy(dtype=np.float64), matches["loser_id"].to_numpy(), matches["tourney_date"].to_numpy())
+
+        player_ids = np.concatenate([matches["winner_id"].to_numpy(dtype=np.int64), matches["loser_id"].to_numpy(dtype=np.int64)])
+        self.ids, player_index = np.unique(player_ids, return_inverse=True)
+        player_index = player_index.reshape(-1)
+        keys = (player_index << DAY_BITS) + np.concatenate([days, days]) + DAY_OFFSET
+        order = np.argsort(keys, kind="stable")
+        self.keys = keys[order]
+        self.days = np.concatenate([days, days])[order]
+        event_days = to_days(matches["tourney_date"])
+        self.event_days = np.concatenate([event_days, event_days])[order]
+        self.opponent_ids = np.concatenate([matches["loser_id"].to_numpy(dtype=np.int64), matches["winner_id"].to_numpy(dtype=np.int64)])[order]
+        self.surfaces = np.concatenate([surface_codes, surface_codes])[order]
+        self.won = np.concatenate([np.ones(len(matches)), np.zeros(len(matches))])[order]
+        stats = np.concatenate([has_stats, has_stats])[order]
+        opponent_rank = np.concatenate([l_rank, w_rank])[order]
+        self.has_stats = stats
+
+        # Per row quantities, zeroed where missing so the prefix sums stay finite
+        columns = {
+            "matches": np.ones(len(order)),
+            "wins": self.won,
+            "stat_matches": stats.astype(np.float64),
+            "svpt": np.where(stats, np.concatenate([w_svpt, l_svpt])[order], 0.0),
+            "sv_won": np.where(stats, np.concatenate([w_sv_won, l_sv_won])[order], 0.0),
+            "rtpt": np.where(stats, np.concatenate([l_svpt, w_svpt])[order], 0.0),
+            "rt_won": np.where(stats, np.concatenate([l_svpt - l_sv_won, w_svpt - w_sv_won])[order], 0.0),
+            "opp_rank_count": np.isfinite(opponent_rank).astype(np.float64),
+            "opp_rank_sum": np.nan_to_num(opponent_rank),
+            "opp_log_rank_sum": np.nan_to_num(np.log(opponent_rank)),
+        }
+        self.prefix = {name: np.concatenate([[0.0], np.cumsum(values)]) for name, values in columns.items()}
+        self.points = {name: columns[name] for name in ["svpt", "sv_won", "rtpt", "rt_won"]}
+        self.surface_rows = {code: np.flatnonzero(self.surfaces == code) for code in range(-1, len(SURFACES))}
+        self._recency = {}
+        self.surface_prefix = {}
+        for code, surface in enumerate(SURFACES):
+            on_surface = self.surfaces == code
+            for name in ["matches", "stat_matches", "svpt", "sv_won", "rtpt", "rt_won"]:
+                self.surface_prefix[(surface, name)] = np.concatenate([[0.0], np.cumsum(np.where(on_surface, columns[name], 0.0))])
+
+    def _keys(self, player_ids, days):
+        positions = np.searchsorted(self.ids, player_ids)
+        positions = np.minimum(positions, len(self.ids) - 1)
+        known = self.ids[positions] == player_ids
+        return (positions << DAY_BITS) + days + DAY_OFFSET, known
+
+    def _window_keys(self, player_ids, days, weeks):
+        """Sort keys of each window's start and end and whether each player is known"""
+        player_ids = np.atleast_1d(np.asarray(player_ids, dtype=np.int64))
+        end_keys, known = self._keys(player_ids, days)
+        if weeks == -1:
+            start_keys = (end_keys >> DAY_BITS) << DAY_BITS
+        else:
+            start_keys = end_keys - 7 * weeks
+        return start_keys, end_keys, known
+
+    def windows(self, player_ids, dates, weeks):
+        """
+        Row ranges holding each player's matches in the weeks before each date
+
+        :param player_ids: array of player ids
+        :param dates: array of dates, matches on or after the date are excluded
+        :param weeks: window length in weeks, -1 for the whole career
+        :return: (lo, hi) arrays of row indexes into the sorted tables
+        """
+        start_keys, end_keys, known = self._window_keys(player_ids, np.atleast_1d(to_days(dates)), weeks)
+        lo = np.searchsorted(self.keys, start_keys, side="left")
+        hi = np.searchsorted(self.keys, end_keys, side="left")
+        hi = np.where(known, hi, lo)
+        return lo, hi
+
+    def match_days(self, winner_ids, loser_ids, dates):
+        """
+        The estimated day each listed match was played, from its own row in the history
+
+        Windows end strictly before the day they are asked for, so asking at a match's own
+        estimated day leaves out the match and the later rounds of its event, which asking at
+        its real date doesn't when the estimate falls before it. A match is found by its players
+        and the latest of their events that started around its date.
+
+        :param winner_ids: array of winner ids
+        :param loser_ids: array of loser ids
+        :param dates: array of the matches' real dates
+        :return: int array of days since 1970, the real date's where the match isn't in the history
+        """
+        winner_ids = np.atleast_1d(np.asarray(winner_ids, dtype=np.int64))
+        loser_ids = np.atleast_1d(np.asarray(loser_ids, dtype=np.int64))
+        days = np.atleast_1d(to_days(dates))
+        end_keys, known = self._keys(winner_ids, days + MATCH_LOOKAHEAD_DAYS + 1)
+        lo = np.searchsorted(self.keys, end_keys - MATCH_LOOKBACK_DAYS - MATCH_LOOKAHEAD_DAYS - 1, side="left")
+        hi = np.where(known, np.searchsorted(self.keys, end_keys, side="left"), lo)
+        lengths = hi - lo
+        pairs = np.repeat(np.arange(len(lo)), lengths)
+        rows = lo[pairs] + np.arange(lengths.sum()) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+        own = ((self.opponent_ids[rows] == loser_ids[pairs]) & (self.event_days[rows] >= days[pairs] - MATCH_LOOKBACK_DAYS)
+               & (self.event_days[rows] <= days[pairs] + MATCH_LOOKAHEAD_DAYS))
+        # Rows are in day order, so the last one found is from the players' latest meeting
+        latest = np.full(len(days), -1)
+        latest[pairs[own]] = rows[own]
+        return np.where(latest >= 0, self.days[np.maximum(latest, 0)], days)
+
+    def batch_features(self, player_ids, dates, weeks=52, surfaces=None):
+        """
+        Features for many (player, date) pairs at once
+
+        :param player_ids: array of player ids
+        :param dates: array of as-of dates, only matches strictly before each date are used
+        :param weeks: window length in weeks, -1 for the whole career
+        :param surfaces: optional array of surfaces for surface specific features
+        :return: DataFrame with one row per pair: matches, win_rate, spw and rpw (percent of points
+        won over the window), opponent_rank, opponent_log_rank and, with surfaces, surface_matches,
+        surface_share, surface_spw and surface_rpw
+        """
+        lo, hi = self.windows(player_ids, dates, weeks)
+
+        def window_sum(prefix):
+            return prefix[hi] - prefix[lo]
+
+        with np.errstate(divide="ignore", invalid="ignore"):
+            matches = window_sum(self.prefix["matches"])
+            opp_rank_count = window_sum(self.prefix["opp_rank_count"])
+            features = pd.DataFrame({
+                "matches": matches.astype(np.int64),
+                "stat_matches": window_sum(self.prefix["stat_matches"]).astype(np.int64),
+                "win_rate": window_sum(self.prefix["wins"]) / matches,
+                "spw": 100 * window_sum(self.prefix["sv_won"]) / window_sum(self.prefix["svpt"]),
+                "rpw": 100 * window_sum(self.prefix["rt_won"]) / window_sum(self.prefix["rtpt"]),
+                "opponent_rank": window_sum(self.prefix["opp_rank_sum"]) / opp_rank_count,
+                "opponent_log_rank": window_sum(self.prefix["opp_log_rank_sum"]) / opp_rank_count,
+            })
+            if surfaces is not None:
+                surfaces = np.atleast_1d(np.asarray(surfaces, dtype=object))
+                surface_sums = {name: np.zeros(len(lo)) for name in ["matches", "svpt", "sv_won", "rtpt", "rt_won"]}
+                for surface in SURFACES:
+                    on_surface = surfaces == surface
+                    if not on_surface.any():
+                        continue
+                    for name in surface_sums:
+                        prefix = self.surface_prefix[(surface, name)]
+                        surface_sums[name][on_surface] = prefix[hi[on_surface]] - prefix[lo[on_surface]]
+                features["surface_matches"] = surface_sums["matches"].astype(np.int64)
+                features["surface_share"] = surface_sums["matches"] / matches
+                features["surface_spw"] = 100 * surface_sums["sv_won"] / surface_sums["svpt"]
+                features["surface_rpw"] = 100 * surface_sums["rt_won"] / surface_sums["rtpt"]
+        return features
+
+    def window_rows(self, player_ids, dates, weeks):
+        """
+        Every row of every window, flattened
+
+        :return: (lo, hi, pairs, rows) where rows are the sorted table rows of all windows and
+        pairs the index of the (player, date) pair each row belongs to
+        """
+        lo, hi = self.windows(player_ids, dates, weeks)
+        lengths = hi - lo
+        pairs = np.repeat(np.arange(len(lo)), lengths)
+        rows = lo[pairs] + np.arange(lengths.sum()) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+        return lo, hi, pairs, rows
+
+    def recency_state(self, half_life_weeks, point_weighted=True):
+        """
+        RecencyStates of serve and return sums for each surface code, -1 for unknown surfaces
+
+        Each surface's matches are kept in their own state so surface speeds and surface
+        specific estimates are linear combinations of the same sums. The states of the last few
+        (half life, weighting) pairs are kept, so configs that only change the window, event
+        boost or speeds reuse them.
+
+        :return: dict of surface code -> RecencyState with sv_num, sv_den, rt_num, rt_den and
+        stat match columns
+        """
+        key = (half_life_weeks, point_weighted)
+        if key not in self._recency:
+            if point_weighted:
+                values = [self.points["sv_won"], self.points["svpt"], self.points["rt_won"], self.points["rtpt"]]
+            else:
+                with np.errstate(divide="ignore", invalid="ignore"):
+                    values = [np.where(self.has_stats, self.points["sv_won"] / self.points["svpt"], 0.0), self.has_stats,
+                              np.where(self.has_stats, self.points["rt_won"] / self.points["rtpt"], 0.0), self.has_stats]
+            values = np.column_stack(values + [self.has_stats]).astype(np.float64)
+            half_life_days = None if half_life_weeks is None else 7 * half_life_weeks
+            while len(self._recency) >= RECENCY_STATES:
+                self._recency.pop(next(iter(self._recency)))
+            self._recency[key] = {code: RecencyState(self.keys[rows] >> DAY_BITS, self.days[rows], values[rows], half_life_days)
+                                  for code, rows in self.surface_rows.items()}
+        return self._recency[key]
+
+    def decayed_serve_return(self, player_ids, dates, weeks=-1, half_life_weeks=26, event_boost=1.0, point_weighted=True, surfaces=None,
+                             surface_speeds=None):
+        """
+        Time-decayed serve and return points won for many (player, date) pairs at once
+
+        Each match in the window is weighted by 0.5 ** (age / half life), times its serve points
+        when point_weighted (otherwise every match's rate counts equally, as np.average does in
+        estimate_spw_rpw), times event_boost when it was played since the start of the player's
+        latest event and that event started within EVENT_DAYS of the date. The sums come from
+        recency_state, so a pair costs a few binary searches whatever its window's length.
+
+        :param half_life_weeks: weeks for a match's weight to halve, None for no decay
+        :param surfaces: optional array of surfaces, adds surface_spw and surface_rpw from the
+        matches on each pair's surface
+        :param surface_speeds: optional dict of surface -> speed, serve points won are divided and
+        return points won multiplied by the speed of each match's surface, as in normalize_data
+        :return: DataFrame with spw, rpw (percent) and weight, the effective number of matches
+        """
+        days = np.atleast_1d(to_days(dates))
+        start_keys, end_keys, known = self._window_keys(player_ids, days, weeks)
+        lo = np.searchsorted(self.keys, start_keys, side="left")
+        hi = np.where(known, np.searchsorted(self.keys, end_keys, side="left"), lo)
+        latest_event = self.event_days[np.maximum(hi - 1, 0)]
+        current_event = (hi > lo) & (days - latest_event <= EVENT_DAYS)
+        event_keys = np.maximum(((end_keys >> DAY_BITS) << DAY_BITS) + latest_event + DAY_OFFSET, start_keys)
+        if surfaces is not None:
+            surface_codes = pd.Categorical(np.atleast_1d(np.asarray(surfaces, dtype=object)), categories=SURFACES).codes
+            surface_totals = np.zeros((len(days), 5))
+
+        totals = np.zeros((len(days), 5))
+        for code, state in self.recency_state(half_life_weeks, point_weighted).items():
+            keys = self.keys[self.surface_rows[code]]
+            surface_lo = np.searchsorted(keys, start_keys, side="left")
+            surface_hi = np.where(known, np.searchsorted(keys, end_keys, side="left"), surface_lo)
+            event_lo = np.minimum(np.searchsorted(keys, event_keys, side="left"), surface_hi)
+            sums = state.window_sums(surface_lo, surface_hi, days)
+            sums += np.where(current_event, event_boost - 1, 0.0)[:, None] * state.window_sums(event_lo, surface_hi, days)
+            if surface_speeds is not None:
+                speed = surface_speeds.get(SURFACES[code], 1.0) if code >= 0 else 1.0
+                sums[:, 0] /= speed
+                sums[:, 2] *= speed
+            totals += sums
+            if surfaces is not None:
+                on_surface = surface_codes == code
+                surface_totals[on_surface] = sums[on_surface]
+
+        def rate(sums, stat_matches):
+            # Windows without stats get exactly zero weight rather than rounding error
+            return np.where(stat_matches > 0, 100 * sums[:, 0] / sums[:, 1], np.nan), np.where(stat_matches > 0, 100 * sums[:, 2] / sums[:, 3], np.nan)
+
+        with np.errstate(divide="ignore", invalid="ignore"):
+            stat_matches = self.prefix["stat_matches"][hi] - self.prefix["stat_matches"][lo]
+            spw, rpw = rate(totals, stat_matches)
+            decayed = pd.DataFrame({"spw": spw, "rpw": rpw, "weight": np.where(stat_matches > 0, totals[:, 4], 0.0)})
+            if surfaces is not None:
+                surface_stat_matches = np.zeros(len(days))
+                for code, surface in enumerate(SURFACES):
+                    on_surface = surface_codes == code
+                    prefix = self.surface_prefix[(surface, "stat_matches")]
+                    surface_stat_matches[on_surface] = prefix[hi[on_surface]] - prefix[lo[on_surface]]
+                decayed["surface_spw"], decayed["surface_rpw"] = rate(surface_totals, surface_stat_matches)
+        return decayed
+
+    def features(self, player_id, date, weeks=52, surface=None):
+        """Features of one player as of a date, see batch_features"""
+        surfaces = None if surface is None else [surface]
+        return self.batch_features([player_id], [date], weeks, surfaces).iloc[0].to_dict()
+
+    def player_history(self, player_id, date, weeks=52):
+        """The rows of a player's window: estimated day, opponent, surface, won and point counts"""
+        lo, hi = self.windows([player_id], [date], weeks)
+        rows = slice(lo[0], hi[0])
+        return pd.DataFrame({
+            "date": self.days[rows].astype("datetime64[D]"),
+            "opponent_id": self.opponent_ids[rows],
+            "surface": np.array(SURFACES + [None], dtype=object)[self.surfaces[rows]],
+            "won": self.won[rows].astype(bool),
+            "svpt": self.points["svpt"][rows],
+            "sv_won": self.points["sv_won"][rows],
+            "rtpt": self.points["rtpt"][rows],
+            "rt_won": self.points["rt_won"][rows],
+        })
+
+def blend_surface(overall, surface_value, surface_matches, surface_prior=10):
+    """Shrink a surface specific rate towards the overall rate when the player has few matches on the surface"""
+    surface_weight = surface_matches / (surface_matches + surface_prior)
+    return np.where(np.isfinite(surface_value), surface_weight * surface_value + (1 - surface_weight) * overall, overall)
+
+class PointInTimePricer:
+    """
+    Backtest pricer using predict_match's serve/return blend on features from local data only
+
+    Every constant and toggle comes from a model config (see model.DEFAULT_MODEL_CONFIG). The
+    features are built lazily in each process, so instances are cheap to send to workers, and the
+    per-season intermediate arrays are cached by the config values they depend on, so pricing the
+    same seasons under many configs only redoes the steps a config changes.
+    """
+
+    def __init__(self, config=None, levels=("singles", "challenger")):
+        self.config = get_model_config(config)
+        self.levels = tuple(levels)
+        self._features = None
+        self._cache = {}
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["_features"] = None
+        state["_cache"] = {}
+        return state
+
+    @property
+    def point_in_time_features(self):
+        if self._features is None:
+            self._features = PointInTimeFeatures(self.levels)
+        return self._features
+
+    def _cached(self, season, key, compute):
+        # Keyed by the frame's id, holding the frame so the id can't be reused while cached
+        season_cache = self._cache.setdefault(id(season), (season, {}))[1]
+        if key not in season_cache:
+            season_cache[key] = compute()
+        return season_cache[key]
+
+    def _sides(self, season):
+        """
+        Player ids, as-of dates and surfaces of both sides of every match, winners first
+
+        The as-of date is the match's own estimated day, see PointInTimeFeatures.match_days, so
+        no feature or rating sees the match or the later rounds of its event.
+        """
+        def compute():
+            return self.point_in_time_features.match_days(season["winner_id"].to_numpy(), season["loser_id"].to_numpy(),
+                                                          season["Date"].to_numpy()).astype("datetime64[D]")
+        dates = self._cached(season, ("as_of",), compute)
+        return (np.concatenate([season["winner_id"].to_numpy(), season["loser_id"].to_numpy()]),
+                np.tile(dates, 2), np.tile(season["Surface"].astype(str).to_numpy(), 2))
+
+    def get_serve_return(self, season, config):
+        """Both sides' serve and return points won percentages, winners first, NaN without enough matches"""
+        speeds = config["fallback_speeds"] if config["use_surface_speed"] else None
+        key = ("serve_return", config["num_weeks"], config["half_life_weeks"], config["event_boost"], config["point_weighted"],
+               config["min_stat_matches"], config["surface_prior"], None if speeds is None else tuple(sorted(speeds.items())))
+
+        def compute():
+            player_ids, dates, surfaces = self._sides(season)
+            features = self.point_in_time_features
+            counts = self._cached(season, ("counts", config["num_weeks"]),
+                                  lambda: features.batch_features(player_ids, dates, config["num_weeks"], surfaces))
+            decayed = features.decayed_serve_return(player_ids, dates, config["num_weeks"], config["half_life_weeks"],
+                                                    config["event_boost"], config["point_weighted"], surfaces, speeds)
+            surface_matches = counts["surface_matches"].to_numpy()
+            spw = blend_surface(decayed["spw"].to_numpy(), decayed["surface_spw"].to_numpy(), surface_matches, config["surface_prior"])
+            rpw = blend_surface(decayed["rpw"].to_numpy(), decayed["surface_rpw"].to_numpy(), surface_matches, config["surface_prior"])
+            enough = counts["stat_matches"].to_numpy() >= config["min_stat_matches"]
+            return np.where(enough, spw, np.nan), np.where(enough, rpw, np.nan)
+        return self._cached(season, key, compute)
+
+    def get_elo(self, season):
+        """Both sides' overall and surface ELO averaged going into each match, winners first"""
+        def compute():
+            from elo import get_elo_engine
+
+            player_ids, dates, surfaces = self._sides(season)
+            elo, surface_elo = get_elo_engine().batch_ratings(player_ids, dates, surfaces)
+            return np.where(np.isfinite(surface_elo), (elo + surface_elo) / 2, elo)
+        return self._cached(season, ("elo",), compute)
+
+    def get_opponent_elo(self, season, num_weeks):
+        """Average ELO of both sides' opponents over the window, each rated going into that match"""
+        def compute():
+            from elo import get_elo_engine
+
+            player_ids, dates, _ = self._sides(season)
+            features = self.point_in_time_features
+            _, _, pairs, rows = features.window_rows(player_ids, dates, num_weeks)
+            opponent_elo, _ = get_elo_engine().batch_ratings(features.opponent_ids[rows], features.days[rows].astype("datetime64[D]"))
+            with np.errstate(divide="ignore", invalid="ignore"):
+                return np.bincount(pairs, weights=opponent_elo, minlength=len(player_ids)) / np.bincount(pairs, minlength=len(player_ids))
+        return self._cached(season, ("opponent_elo", num_weeks), compute)
+
+    def get_tour_elo(self, season, top_n):
+        """Average ELO of the top_n active players going into each match, as of its own estimated day"""
+        def compute():
+            from elo import get_elo_engine
+
+            return get_elo_engine().top_average(self._sides(season)[1][:len(season)], top_n)
+        return self._cached(season, ("tour_elo", top_n), compute)
+
+    def get_elo_diffs(self, season, config=None):
+        """Winner minus loser ELO going into each match, averaging the overall and surface ratings"""
+        config = self.config if config is None else config
+        if not config["use_elo"]:
+            return np.zeros(len(season))
+        winner_elo, loser_elo = np.split(self.get_elo(season), 2)
+        return winner_elo - loser_elo
+
+    def get_adjusted_serve_return(self, season, config=None):
+        """Both sides' serve and return points won percentages scaled by opponent quality, winners first"""
+        config = self.config if config is None else config
+        spw, rpw = self.get_serve_return(season, config)
+        if config["use_opponent_quality"] and config["use_elo"]:
+            tour_elo = np.tile(self.get_tour_elo(season, config["tour_top_n"]), 2)
+            opponent_elo = self.get_opponent_elo(season, config["num_weeks"])
+            opponent_elo = np.where(np.isfinite(opponent_elo), opponent_elo, tour_elo)
+            factor = get_opponent_quality_factor(tour_elo, opponent_elo, config["opponent_factor_per_100"],
+                                                 config["opponent_factor_min"], config["opponent_factor_max"])
+            spw, rpw = spw * factor, rpw * factor
+        return spw, rpw
+
+    def price(self, season, config=None):
+        """
+        The listed winner's win probability for every match of a load_season frame
+
+        :param config: a full model config, defaults to this pricer's
+        """
+        config = self.config if config is None else config
+        spw, rpw = self.get_adjusted_serve_return(season, config)
+
+        if config["use_surface_speed"]:
+            current_speed = np.tile(season["Surface"].astype(str).map(config["fallback_speeds"]).fillna(1.0).to_numpy(dtype=np.float64), 2)
+            spw, rpw = spw * current_speed, rpw / current_speed
+
+        winner_spw, loser_spw = np.split(spw, 2)
+        winner_rpw, loser_rpw = np.split(rpw, 2)
+        elo_diffs = self.get_elo_diffs(season, config)
+        winner_combined, loser_combined = combine_serve_return(winner_spw, winner_rpw, loser_spw, loser_rpw, elo_diffs,
+                                                               config["min_weight"], config["max_weight"])
+        best_of = season["Best of"].fillna(3).to_numpy(dtype=np.int64) if "Best of" in season else 3
+        # Serve percentages pushed past 0 or 1 by the adjustments can't be priced
+        winner_combined = np.clip(winner_combined, 1, 99)
+        loser_combined = np.clip(loser_combined, 1, 99)
+        return get_match_prob_batch(winner_combined / 100, loser_combined / 100, best_of)[0]
+
+    def __call__(self, season):
+        return self.price(season)
@@ -0,0 +1,421 @@
+import argparse
+import glob
+import json
+import os
+import re
+import shutil
+import time
+import numpy as np
+import pandas as pd
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "data")
+STORE_DIR = os.path.join(DATA_DIR, "store")
+
+# level name -> folder under data/
+LEVELS = {
+    "singles": "atp_singles",
+    "challenger": "atp_challenger",
+    "futures": "atp_futures",
+    "doubles": "atp_doubles",
+}
+
+# Columns holding player ids, used to build the per-player index
+ID_COLUMNS = ["winner_id", "loser_id", "winner1_id", "winner2_id", "loser1_id", "loser2_id"]
+
+# Free-text columns stored as int32 codes into a per-column vocabulary
+CATEGORICAL_COLUMNS = {
+    "tourney_id", "tourney_name", "surface", "tourney_level", "winner_entry", "loser_entry",
+    "winner_name", "loser_name", "winner1_name", "winner2_name", "loser1_name", "loser2_name",
+    "winner_hand", "loser_hand", "winner1_hand", "winner2_hand", "loser1_hand", "loser2_hand",
+    "winner_ioc", "loser_ioc", "winner1_ioc", "winner2_ioc", "loser1_ioc", "loser2_ioc",
+    "score", "round",
+}
+
+INT_COLUMNS = set(ID_COLUMNS) | {"tourney_date", "draw_size", "match_num"}
+
+def to_yyyymmdd(value):
+    """
+    Convert a date given as yyyymmdd int/str, ISO string, datetime or Timestamp to a yyyymmdd int
+
+    :return: the date as an int, or None if value is None
+    """
+    if value is None:
+        return None
+    if isinstance(value, (int, np.integer)):
+        return int(value)
+    if isinstance(value, str) and value.isdigit() and len(value) == 8:
+        return int(value)
+    timestamp = pd.Timestamp(value)
+    return timestamp.year * 10000 + timestamp.month * 100 + timestamp.day
+
+def level_files(data_dir, level):
+    """Get (year, path) pairs for every yearly csv of a level in year order"""
+    files = []
+    for path in glob.glob(os.path.join(data_dir, LEVELS[level], "*.csv")):
+        year_match = re.search(r"_(\d{4})\.csv$", path)
+        if year_match:
+            files.append((int(year_match.group(1)), path))
+    return sorted(files)
+
+def _encode_column(series, name):
+    """Convert a raw csv column into (array, vocabulary or None)"""
+    if name in INT_COLUMNS:
+        return pd.to_numeric(series, errors="coerce").fillna(-1).astype(np.int32).to_numpy(), None
+    if name in CATEGORICAL_COLUMNS or series.dtype == object or pd.api.types.is_string_dtype(series):
+        codes, vocab = pd.factorize(series.astype("string"), use_na_sentinel=True)
+        return codes.astype(np.int32), [str(v) for v in vocab]
+    return pd.to_numeric(series, errors="coerce").astype(np.float32).to_numpy(), None
+
+def build_level(level, data_dir=DATA_DIR, store_dir=STORE_DIR):
+    """
+    Convert every yearly csv of a level into a typed columnar store partitioned by year
+
+    Each column is written as its own .npy file so it can be memory mapped, with rows sorted by
+    (file year, tourney_date). String columns are stored as int32 codes plus a json vocabulary.
+    A per-player index of row numbers sorted by (player_id, tourney_date) is written alongside.
+
+    :param level: one of LEVELS
+    :return: the number of rows written
+    """
+    files = level_files(data_dir, level)
+    if not files:
+        return 0
+    frames = []
+    for year, path in files:
+        year_df = pd.read_csv(path, low_memory=False)
+        year_df["year"] = year
+        frames.append(year_df)
+    matches = pd.concat(frames, ignore_index=True)
+    matches["tourney_date"] = pd.to_numeric(matches["tourney_date"], errors="coerce").fillna(0).astype(np.int32)
+    matches = matches.sort_values(["year", "tourney_date"], kind="mergesort").reset_index(drop=True)
+
+    # Written next to the live store and swapped in whole, so readers never see a half-built level
+    level_dir = os.path.join(store_dir, level)
+    build_dir = f"{level_dir}.building-{os.getpid()}"
+    if os.path.exists(build_dir):
+        shutil.rmtree(build_dir)
+    os.makedirs(build_dir)
+
+    columns = {}
+    for name in matches.columns:
+        if name == "year":
+            continue
+        values, vocab = _encode_column(matches[name], name)
+        np.save(os.path.join(build_dir, f"{name}.npy"), values)
+        columns[name] = {"dtype": str(values.dtype), "categorical": vocab is not None}
+        if vocab is not None:
+            with open(os.path.join(build_dir, f"{name}.vocab.json"), "w") as f:
+                json.dump(vocab, f)
+
+    years = matches["year"].to_numpy()
+    partition_years = np.unique(years)
+    starts = np.searchsorted(years, partition_years, side="left")
+    ends = np.searchsorted(years, partition_years, side="right")
+    partitions = {str(year): [int(start), int(end)] for year, start, end in zip(partition_years, starts, ends)}
+
+    # Player index: every (player, row) appearance sorted by player then date
+    id_columns = [name for name in ID_COLUMNS if name in matches.columns]
+    row_numbers = np.arange(len(matches), dtype=np.int64)
+    player_ids = np.concatenate([
+        pd.to_numeric(matches[name], errors="coerce").fillna(-1).to_numpy(dtype=np.int64) for name in id_columns])
+    player_rows = np.tile(row_numbers, len(id_columns))
+    player_dates = np.tile(matches["tourney_date"].to_numpy(), len(id_columns))
+    valid = player_ids >= 0
+    player_ids, player_rows, player_dates = player_ids[valid], player_rows[valid], player_dates[valid]
+    order = np.lexsort((player_rows, player_dates, player_ids))
+    player_ids, player_rows, player_dates = player_ids[order], player_rows[order], player_dates[order]
+    index_ids, index_starts = np.unique(player_ids, return_index=True)
+    index_offsets = np.append(index_starts, len(player_ids))
+    np.save(os.path.join(build_dir, "_player_ids.npy"), index_ids.astype(np.int32))
+    np.save(os.path.join(build_dir, "_player_offsets.npy"), index_offsets.astype(np.int64))
+    np.save(os.path.join(build_dir, "_player_rows.npy"), player_rows.astype(np.int32))
+    np.save(os.path.join(build_dir, "_player_dates.npy"), player_dates.astype(np.int32))
+
+    meta = {
+        "level": level,
+        "rows": int(len(matches)),
+        "columns": columns,
+        "id_columns": id_columns,
+        "partitions": partitions,
+        "sources": {os.path.basename(path): os.path.getmtime(path) for _, path in files},
+    }
+    with open(os.path.join(build_dir, "meta.json"), "w") as f:
+        json.dump(meta, f, indent=1)
+    _swap_in(build_dir, level_dir)
+    return len(matches)
+
+def _swap_in(build_dir, level_dir):
+    old_dir = f"{level_dir}.old-{os.getpid()}"
+    try:
+        os.rename(level_dir, old_dir)
+    except FileNotFoundError:
+        pass
+    try:
+        os.rename(build_dir, level_dir)
+    except OSError:
+        # Another process swapped in its own build of the same csvs first
+        shutil.rmtree(build_dir, ignore_errors=True)
+    shutil.rmtree(old_dir, ignore_errors=True)
+
+def is_stale(level, data_dir=DATA_DIR, store_dir=STORE_DIR):
+    """True if a level's store is missing or any of its csvs was added, removed or changed since it was built"""
+    meta_path = os.path.join(store_dir, level, "meta.json")
+    if not os.path.exists(meta_path):
+        return True
+    files = level_files(data_dir, level)
+    if not files:
+        # Nothing to rebuild from, serve the store as it is
+        return False
+    with open(meta_path) as f:
+        sources = json.load(f)["sources"]
+    return sources != {os.path.basename(path): os.path.getmtime(path) for _, path in files}
+
+def refresh_match_store(levels=("singles",), data_dir=DATA_DIR, store_dir=STORE_DIR):
+    """
+    Rebuild the built levels whose csvs changed since they were built
+
+    :return: the levels rebuilt
+    """
+    rebuilt = []
+    for level in levels:
+        if MatchStore.exists(store_dir, level) and is_stale(level, data_dir, store_dir):
+            print(f"Rebuilding the {level} match store, its csvs changed since it was built")
+            build_level(level, data_dir, store_dir)
+            rebuilt.append(level)
+    return rebuilt
+
+def drop_unknown_players(matches):
+    """Drop matches with a missing winner or loser id, which the store holds as -1"""
+    known = np.ones(len(matches), dtype=bool)
+    for name in ("winner_id", "loser_id"):
+        if name in matches:
+            ids = pd.to_numeric(matches[name], errors="coerce")
+            known &= (ids.notna() & (ids >= 0)).to_numpy()
+    return matches if known.all() else matches[known].reset_index(drop=True)
+
+def build_match_store(data_dir=DATA_DIR, store_dir=STORE_DIR, levels=None):
+    """
+    Ingest the data/atp_* csvs into the columnar match store
+
+    :param levels: the levels to build, defaults to all of LEVELS
+    :return: dict of level -> rows written
+    """
+    levels = list(LEVELS) if levels is None else levels
+    written = {}
+    for level in levels:
+        start = time.perf_counter()
+        written[level] = build_level(level, data_dir, store_dir)
+        print(f"Built {level}: {written[level]} matches in {time.perf_counter() - start:.1f}s")
+    return written
+
+class MatchStoreLevel:
+    """Memory-mapped columns and indexes of one level of the match store"""
+
+    def __init__(self, level_dir):
+        self.level_dir = level_dir
+        with open(os.path.join(level_dir, "meta.json")) as f:
+            self.meta = json.load(f)
+        self.rows = self.meta["rows"]
+        self._columns = {}
+        self._vocabs = {}
+        self.player_ids = self._load("_player_ids")
+        self.player_offsets = self._load("_player_offsets")
+        self.player_rows = self._load("_player_rows")
+        self.player_dates = self._load("_player_dates")
+
+    def _load(self, name):
+        return np.load(os.path.join(self.level_dir, f"{name}.npy"), mmap_mode="r")
+
+    @property
+    def column_names(self):
+        return list(self.meta["columns"])
+
+    def column(self, name):
+        """Get the raw (encoded) array of a column"""
+        if name not in self._columns:
+            self._columns[name] = self._load(name)
+        return self._columns[name]
+
+    def vocab(self, name):
+        if name not in self._vocabs:
+            with open(os.path.join(self.level_dir, f"{name}.vocab.json")) as f:
+                self._vocabs[name] = np.array(json.load(f), dtype=object)
+        return self._vocabs[name]
+
+    def partition(self, year):
+        """Get the (start, end) row range of a year's partition"""
+        return tuple(self.meta["partitions"].get(str(year), (0, 0)))
+
+    def player_slice(self, player_id, start=None, end=None):
+        """
+        Get the row numbers of a player's matches with start <= tourney_date <= end, in date order
+        """
+        position = np.searchsorted(self.player_ids, player_id)
+        if position >= len(self.player_ids) or self.player_ids[position] != player_id:
+            return np.empty(0, dtype=np.int32)
+        lo, hi = int(self.player_offsets[position]), int(self.player_offsets[position + 1])
+        dates = self.player_dates[lo:hi]
+        if start is not None:
+            lo += int(np.searchsorted(dates, start, side="left"))
+        if end is not None:
+            hi = int(self.player_offsets[position]) + int(np.searchsorted(dates, end, side="right"))
+        return np.asarray(self.player_rows[lo:hi])
+
+    def date_slice(self, start=None, end=None):
+        """Get the row numbers of every match with start <= tourney_date <= end"""
+        dates = self.column("tourney_date")
+        row_ranges = []
+        for year, (lo, hi) in self.meta["partitions"].items():
+            year = int(year)
+            # Partitions are by file year, which can hold matches from the last days of the previous year
+            if (start is not None and year < start // 10000) or (end is not None and year - 1 > end // 10000):
+                continue
+            part_dates = dates[lo:hi]
+            part_lo = lo + (int(np.searchsorted(part_dates, start, side="left")) if start is not None else 0)
+            part_hi = lo + (int(np.searchsorted(part_dates, end, side="right")) if end is not None else hi - lo)
+            if part_hi > part_lo:
+                row_ranges.append(np.arange(part_lo, part_hi))
+        return np.concatenate(row_ranges) if row_ranges else np.empty(0, dtype=np.int64)
+
+    def take(self, rows, columns=None):
+        """
+        Decode the given rows into a DataFrame with the original csv columns
+
+        :param columns: the columns to return, defaults to all of them
+        """
+        columns = self.column_names if columns is None else columns
+        decoded = {}
+        for name in columns:
+            values = np.asarray(self.column(name)[rows])
+            if self.meta["columns"][name]["categorical"]:
+                vocab = self.vocab(name)
+                decoded_values = np.full(len(values), None, dtype=object)
+                present = values >= 0
+                decoded_values[present] = vocab[values[present]]
+                decoded[name] = decoded_values
+            elif name == "tourney_date":
+                decoded[name] = pd.to_datetime(values.astype(str), format="%Y%m%d", errors="coerce")
+            elif values.dtype == np.float32:
+                # Stored as float32 to halve the footprint, widened so ratios match the csv path
+                decoded[name] = values.astype(np.float64)
+            else:
+                decoded[name] = values
+        return pd.DataFrame(decoded)
+
+class MatchStore:
+    """Query interface over the columnar store written by build_match_store"""
+
+    def __init__(self, store_dir=STORE_DIR, data_dir=DATA_DIR):
+        self.store_dir = store_dir
+        self.data_dir = data_dir
+        self._levels = {}
+
+    @classmethod
+    def exists(cls, store_dir=STORE_DIR, level="singles"):
+        return os.path.exists(os.path.join(store_dir, level, "meta.json"))
+
+    def level(self, level):
+        """The level's memory-mapped store, rebuilt first if its csvs changed since it was built"""
+        if level not in self._levels:
+            level_dir = os.path.join(self.store_dir, level)
+            if not os.path.exists(os.path.join(level_dir, "meta.json")):
+                raise FileNotFoundError(f"No match store for '{level}' in {self.store_dir}, run `python history.py build` first")
+            refresh_match_store((level,), self.data_dir, self.store_dir)
+            self._levels[level] = MatchStoreLevel(level_dir)
+        return self._levels[level]
+
+    def player_matches(self, player_id, start=None, end=None, levels=("singles",), columns=None, years=None):
+        """
+        Get all matches of a player between two dates (inclusive) across the given levels
+
+        :param player_id: the atp player id
+        :param start: earliest tourney date, anything to_yyyymmdd accepts
+        :param end: latest tourney date
+        :param levels: the store levels to search
+        :param columns: the columns to return, defaults to all of them
+        :param years: optionally only the given yearly partitions (csv file years)
+        :return: DataFrame of matches in date order with a level column
+        """
+        start, end = to_yyyymmdd(start), to_yyyymmdd(end)
+        frames = []
+        for level in levels:
+            store_level = self.level(level)
+            rows = store_level.player_slice(player_id, start, end)
+            if years is not None:
+                in_years = np.zeros(len(rows), dtype=bool)
+                for year in years:
+                    part_start, part_end = store_level.partition(year)
+                    in_years |= (rows >= part_start) & (rows < part_end)
+                rows = rows[in_years]
+            if len(rows):
+                level_df = store_level.take(rows, columns)
+                level_df["level"] = level
+                frames.append(level_df)
+        if not frames:
+            return pd.DataFrame(columns=(columns or self.level(levels[0]).column_names) + ["level"])
+        return pd.concat(frames, ignore_index=True).sort_values("tourney_date", kind="mergesort", ignore_index=True)
+
+    def matches_between(self, start=None, end=None, levels=("singles",), columns=None):
+        """Get every match with a tourney date between start and end (inclusive)"""
+        start, end = to_yyyymmdd(start), to_yyyymmdd(end)
+        frames = []
+        for level in levels:
+            store_level = self.level(level)
+            level_df = store_level.take(store_level.date_slice(start, end), columns)
+            level_df["level"] = level
+            frames.append(level_df)
+        return pd.concat(frames, ignore_index=True)
+
+    def year(self, year, level="singles", columns=None):
+        """Get one year's partition, the same rows as data/<level>/..._{year}.csv"""
+        store_level = self.level(level)
+        start, end = store_level.partition(year)
+        return store_level.take(np.arange(start, end), columns)
+
+def load_matches(levels=("singles",), columns=None, data_dir=DATA_DIR, store_dir=STORE_DIR):
+    """
+    Load whole levels of match history, from the store when it has been built and the csvs otherwise
+
+    :param levels: the levels to load
+    :param columns: the columns to return, defaults to all of them
+    :return: DataFrame with a datetime tourney_date and a level column, without matches missing a player id
+    """
+    frames = []
+    for level in levels:
+        if MatchStore.exists(store_dir, level):
+            store_level = MatchStore(store_dir, data_dir).level(level)
+            level_df = store_level.take(np.arange(store_level.rows), columns)
+        else:
+            level_df = pd.concat([pd.read_csv(path, usecols=columns, low_memory=False) for _, path in level_files(data_dir, level)],
+                                 ignore_index=True)
+            if "tourney_date" in level_df:
+                level_df["tourney_date"] = pd.to_datetime(level_df["tourney_date"].astype("Int64").astype(str), format="%Y%m%d", errors="coerce")
+        level_df["level"] = level
+        frames.append(level_df)
+    return drop_unknown_players(pd.concat(frames, ignore_index=True))
+
+def main():
+    parser = argparse.ArgumentParser(description="Build or query the columnar historical match store")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    build_parser = subparsers.add_parser("build", help="Ingest data/atp_* csvs into the store")
+    build_parser.add_argument("--levels", nargs="*", default=None, choices=list(LEVELS))
+    build_parser.add_argument("--store-dir", default=STORE_DIR)
+    query_parser = subparsers.add_parser("query", help="Time a player's match lookup")
+    query_parser.add_argument("player_id", type=int)
+    query_parser.add_argument("--start", default=None)
+    query_parser.add_argument("--end", default=None)
+    query_parser.add_argument("--levels", nargs="*", default=["singles", "challenger", "futures"])
+    query_parser.add_argument("--store-dir", default=STORE_DIR)
+    args = parser.parse_args()
+
+    if args.command == "build":
+        build_match_store(store_dir=args.store_dir, levels=args.levels)
+    else:
+        store = MatchStore(args.store_dir)
+        start = time.perf_counter()
+        matches = store.player_matches(args.player_id, args.start, args.end, levels=args.levels)
+        print(matches[["tourney_date", "tourney_name", "winner_name", "loser_name", "score", "level"]])
+        print(f"{len(matches)} matches in {(time.perf_counter() - start) * 1000:.1f}ms")
+
+if __name__ == "__main__":
+    main()
@@ -1,7 +1,11 @@
 import numpy as np
 import pandas as pd
-import re
-from scrape import DataScraper, PlayerDataScraper
+import threading
+from model import get_model_config, get_opponent_quality_factor
+from recency import EVENT_DAYS, recency_weights
+from results import ResultHistory
+from tracing import span, traced
+from util import compress_name
 
 class TennisDataScraper:
     """Base class for tennis data scraping with common datasets"""
@@ -11,8 +15,10 @@ class TennisDataScraper:
         'surface_data': None,
         'elo_data': None,
         'y_elo_data': None,
+        'adjusted_elo': None,
         'initialized': False
     }
+    _shared_lock = threading.RLock()
     
     def __init__(self):
         # Initialize common datasets only if they haven't been loaded yet
@@ -22,11 +28,37 @@ class TennisDataScraper:
     def _ensure_data_initialized(cls):
         """Ensure the shared data is initialized"""
         if not cls._shared_data['initialized']:
-            print("Initializing shared tennis data (surface speeds and ELO ratings)...")
-            temp_scraper = DataScraper()
-            cls._shared_data['surface_data'] = temp_scraper.get_surface_speed()
-            cls._shared_data['elo_data'], cls._shared_data['y_elo_data'] = temp_scraper.get_elo_data()
+            with cls._shared_lock:
+                if not cls._shared_data['initialized']:
+                    print("Initializing shared tennis data (surface speeds and ELO ratings)...")
+                    cls._load_shared_data()
+
+    @classmethod
+    @traced()
+    def _load_shared_data(cls):
+        """Scrape fresh surface and ELO tables and swap them into the shared data"""
+        from scrape import DataScraper
+
+        temp_scraper = DataScraper()
+        surface_data = temp_scraper.get_surface_speed()
+        elo_data, y_elo_data = temp_scraper.get_elo_data()
+        # Only replace the shared tables once every scrape has succeeded so readers never see a partial refresh
+        with cls._shared_lock:
+            cls._shared_data['surface_data'] = surface_data
+            cls._shared_data['elo_data'] = elo_data
+            cls._shared_data['y_elo_data'] = y_elo_data
+            cls._shared_data['adjusted_elo'] = None
             cls._shared_data['initialized'] = True
+
+    @classmethod
+    def refresh_shared_data(cls):
+        """Re-scrape the surface speed and ELO tables, keeping the old ones if the scrape fails"""
+        try:
+            cls._load_shared_data()
+            return True
+        except Exception as e:
+            print(f"Error refreshing shared tennis data: {e}")
+            return False
     
     @property
     def surface_data(self):
@@ -46,152 +78,179 @@ class TennisDataScraper:
         self._ensure_data_initialized()
         return self._shared_data['y_elo_data']
     
-    def get_adjusted_elo(self):
-        """Calculate adjusted ELO ratings by combining regular and yearly ELO data"""
+    @traced(describe=lambda self, as_of=None: {"as_of": as_of})
+    def get_adjusted_elo(self, as_of=None):
+        """
+        Calculate adjusted ELO ratings by combining regular and yearly ELO data
+
+        :param as_of: optional date, rates players from the local match history going into that date
+        instead of using today's Tennis Abstract tables
+        """
+        if as_of is not None:
+            from elo import local_adjusted_elo
+            return local_adjusted_elo(as_of)
+        cached_elo = self._shared_data['adjusted_elo']
+        if cached_elo is not None:
+            return cached_elo
+        elo_data = self.elo_data
         combined_elo = pd.merge(
-            self.elo_data[['Elo Rank', 'Player', 'Elo', 'Log diff']],
+            elo_data[['Elo Rank', 'Player', 'Elo', 'Log diff']],
             self.y_elo_data[['Rank', 'Player', 'yElo']],
             on='Player',
             how='left')
 
         # Modify Player names to remove all spaces after the first
-        def compress_name(name):
-            parts = name.split()
-            if len(parts) > 2:
-                return parts[0] + ' ' + ''.join(parts[1:])
-            return name
-
         combined_elo['Player'] = combined_elo['Player'].apply(compress_name)
 
         combined_elo['Average Elo'] = combined_elo.apply(
             lambda row: (float(row['Elo']) + float(row['yElo'])) / 2 if pd.notnull(row['yElo']) else float(row['Elo']),
             axis=1)
 
+        with self._shared_lock:
+            # Don't cache a table built from ELO data that was refreshed while we were merging
+            if self._shared_data['elo_data'] is elo_data:
+                self._shared_data['adjusted_elo'] = combined_elo
         return combined_elo
 
+def _describe_player(self, *args, **kwargs):
+    """Span args of a PlayerServeReturnStats method"""
+    return {"player": f"{self.first_name} {self.last_name}"}
+
 class PlayerServeReturnStats(TennisDataScraper):
     """Class for analyzing player's serve and return statistics"""
     
-    def __init__(self, first_name, last_name, num_weeks, current_tournament, career=False):
+    def __init__(self, first_name, last_name, num_weeks, current_tournament, career=False, config=None, history=None):
+        """
+        :param history: optional ResultHistory already scraped for the player, used instead of scraping, their career
+        results when career is set and their recent ones otherwise
+        """
         # Call parent class's __init__ to ensure common data is initialized
         super().__init__()
         
+        # Model constants and feature toggles, see model.DEFAULT_MODEL_CONFIG
+        self.config = get_model_config(config)
         self.first_name = first_name
         self.last_name = last_name
         # Initialize player-specific data
-        player_scraper = PlayerDataScraper(first_name, last_name)
+        if history is None:
+            from scrape import PlayerDataScraper
+
+            player_scraper = PlayerDataScraper(first_name, last_name)
+            with span("scrape_player", "manip", player=f"{first_name} {last_name}", career=career):
+                # Parsed once into typed records, the scraped tables aren't kept
+                scraped = player_scraper.get_all_results() if career else player_scraper.get_recent_results()
+                history = ResultHistory.from_frame(scraped)
         if career:
-            self.all_results = player_scraper.get_all_results()
+            self.all_history = history
         else:
-            self.recent_results = player_scraper.get_recent_results()
+            self.recent_history = history
         self.num_weeks = num_weeks
         self.current_tournament = current_tournament
-        
+
+    @property
+    def recent_results(self):
+        """The recent results as a DataFrame, newest first, see ResultHistory.to_frame for the columns"""
+        return self.recent_history.to_frame().iloc[::-1].reset_index(drop=True)
+
+    @property
+    def all_results(self):
+        """The career results as a DataFrame, newest first, only scraped for career stats"""
+        return self.all_history.to_frame().iloc[::-1].reset_index(drop=True)
+
     def gather_last_x_weeks(self, num_weeks=-1):
-        abbreviated_data = self.recent_results[["Match", "Date", "Surface", "Scoreline", "vRk", "SPW", "RPW"]]
-        abbreviated_data = abbreviated_data[~abbreviated_data["Match"].str.contains("Davis Cup", na=False)]
-        abbreviated_data = abbreviated_data[~abbreviated_data["Match"].str.contains("Laver Cup", na=False)]
-        if num_weeks == -1:
-            return abbreviated_data
-        most_recent_date = self.recent_results["Date"].max()
-        cutoff_date = most_recent_date - pd.Timedelta(weeks=num_weeks)
-        return abbreviated_data[abbreviated_data["Date"] >= cutoff_date]
-    
+        """The recent results of the last num_weeks weeks before the latest match, all of them for -1, as a ResultHistory"""
+        return self.recent_history.last_weeks(num_weeks)
+
     def gather_from_match_date(self, match_date):
-        all_results = self.all_results[["Match", "Date", "Surface", "Scoreline", "vRk", "SPW", "RPW"]]
-        all_results = all_results[~all_results["Match"].str.contains("Davis Cup", na=False)]
-        all_results = all_results[~all_results["Match"].str.contains("Laver Cup", na=False)]
-        lower_bound = match_date - pd.Timedelta(days=7 * self.num_weeks)
-        results_from_match_date = all_results[(all_results["Date"] > lower_bound) & (all_results["Date"] <= match_date)]
-        return results_from_match_date
-    
-    def normalize_data(self, match_date=None):
-        abbreviated_data = self.gather_last_x_weeks(num_weeks=self.num_weeks) if match_date is None else self.gather_from_match_date(match_date)
-        
-        for index, row in abbreviated_data.iterrows():
-            tournament = row["Match"]
-            surface = row["Surface"]
-            match = re.search(r"\d{4}\s+(.+?)\s+\S+$", tournament)
-            if match:
-                tournament_name = match.group(1)
-            surface_speed = self.surface_data.loc[self.surface_data["Tournament"].str.contains(tournament_name, case=False), "Surface Speed"]
-            
+        """The career results of the num_weeks weeks up to and including match_date, as a ResultHistory"""
+        return self.all_history.before(match_date, self.num_weeks)
+
+    def _surface_speed(self, tournament_name, surface, config):
+        """The speed a past match was played at, its tournament's from the surface table else its surface's fallback"""
+        if tournament_name is not None:
+            with span("surface_lookup", "manip", tournament=tournament_name):
+                surface_speed = self.surface_data.loc[self.surface_data["Tournament"].str.contains(tournament_name, case=False), "Surface Speed"]
             if not surface_speed.empty:
-                surface_speed = surface_speed.iloc[0]
-            else:
-                print("No Surface Speed Found for: ", tournament_name)
-                if surface == "Grass":
-                    surface_speed = 1.140000
-                elif surface == "Clay":
-                    surface_speed = 0.719500
-                elif surface == "Hard":
-                    surface_speed = 1.118158
-                else: 
-                    print("SOMETHING WRONG WITH THE SURFACE SPEED")
-                    surface_speed = 1.0
-
-            spw_num = float(row["SPW"][:-1])
-            rpw_num = float(row["RPW"][:-1])
-
-            spw = spw_num / float(surface_speed)
-            rpw = rpw_num * float(surface_speed)
-            
-            abbreviated_data.at[index, "SPW"] = spw
-            abbreviated_data.at[index, "RPW"] = rpw
-        return abbreviated_data
+                return float(surface_speed.iloc[0])
+            print("No Surface Speed Found for: ", tournament_name)
+        if surface in config["fallback_speeds"]:
+            return float(config["fallback_speeds"][surface])
+        print("SOMETHING WRONG WITH THE SURFACE SPEED")
+        return 1.0
+
+    @traced(describe=_describe_player)
+    def normalize_data(self, match_date=None, config=None):
+        """
+        The results in the window as a DataFrame, SPW and RPW adjusted for the speed each match was played at
+
+        Every tournament's speed is looked up once, however many of its matches are in the window.
+
+        :param config: optional full model config, defaults to these stats' own
+        """
+        config = self.config if config is None else config
+        window = self.gather_last_x_weeks(num_weeks=self.num_weeks) if match_date is None else self.gather_from_match_date(match_date)
+        normalized_data = window.to_frame()
+        if normalized_data[["SPW", "RPW"]].isna().any().any():
+            raise ValueError(f"Missing SPW or RPW in {self.first_name} {self.last_name}'s results")
+
+        surface_speeds = np.ones(len(normalized_data))
+        if config["use_surface_speed"]:
+            matches = normalized_data.groupby(["Event", "Surface"], dropna=False, sort=False).indices
+            for (tournament_name, surface), rows in matches.items():
+                surface_speeds[rows] = self._surface_speed(None if pd.isna(tournament_name) else tournament_name, surface, config)
+        normalized_data["SPW"] = normalized_data["SPW"] / surface_speeds
+        normalized_data["RPW"] = normalized_data["RPW"] * surface_speeds
+        return normalized_data
     
-    def estimate_spw_rpw(self, match_date=None):
+    @traced(describe=_describe_player)
+    def estimate_spw_rpw(self, match_date=None, config=None):
         """
         Estimate service and return points won percentages adjusted for both surface speed
         and the quality of opponents faced.
+
+        Recent and current tournament matches are weighted up by the config's half_life_weeks
+        and event_boost, the window is weighted evenly by default.
+
+        :param config: optional full model config, defaults to these stats' own, so stats shared
+        between callers can be priced under different configs
         """
-        normalized_data = self.normalize_data(match_date=match_date)
+        config = self.config if config is None else config
+        normalized_data = self.normalize_data(match_date=match_date, config=config)
         
-        # Get all players' ELO data
-        all_players_elo = self.get_adjusted_elo()
+        # Get all players' ELO data, as it stood on the match date when pricing a past match
+        all_players_elo = self.get_adjusted_elo(as_of=match_date)
         
         # Calculate average tour ELO for reference
-        avg_tour_elo = all_players_elo['Average Elo'].sort_values(ascending=False).head(300).mean()
-        # Extract opponent ELOs and calculate average
-        opponent_elos = []
-        
+        avg_tour_elo = all_players_elo['Average Elo'].sort_values(ascending=False).head(config["tour_top_n"]).mean()
         # TODO: Add a weighting difference based on whether or not they won or lost against the opponent
-        for index, row in normalized_data.iterrows():
-            # Extract opponent information from the match description
-            match_info = row["Scoreline"]
-            pattern = r"(?:\(?\d+\)?\s*)?([A-Za-z]+(?:\s[A-Za-z]+)?)\s*\[[A-Z]+\]"
-            opponent_match = re.search(pattern, match_info)
-            if opponent_match:
-                def normalize_name(name):
-                    parts = name.split()
-                    if len(parts) > 2:
-                        return parts[0] + ' ' + ''.join(parts[1:])
-                    return name
-                opponent_name = normalize_name(opponent_match.group(1).strip())
-
-                # Look up opponent's ELO
-                opponent_elo_row = all_players_elo[all_players_elo['Player'] == opponent_name]
-                if not opponent_elo_row.empty:
-                    opponent_elo = float(opponent_elo_row['Average Elo'].iloc[0])
-                    opponent_elos.append(opponent_elo)
-                    
-                    # Store opponent ELO for potential debugging
-                    normalized_data.at[index, "Opp_ELO"] = opponent_elo
+        # Opponents are parsed from the scorelines when the results are set, look each one up once
+        opponent_elo_table = all_players_elo.drop_duplicates("Player").set_index("Player")["Average Elo"].astype(float)
+        with span("opponent_elo_lookup", "manip", matches=len(normalized_data)):
+            # Store opponent ELO for potential debugging
+            normalized_data["Opp_ELO"] = normalized_data["Opponent"].map(opponent_elo_table)
+        opponent_elos = normalized_data["Opp_ELO"].dropna()
         
         # Calculate average opponent ELO
-        avg_opponent_elo = np.mean(opponent_elos) if opponent_elos else avg_tour_elo
-        
-        # Calculate opponent quality adjustment factor
-        # For every 100 ELO points above average, scale performance down by 5%
-        # For every 100 ELO points below average, scale performance up by 5%
-        opponent_quality_factor = 1 - ((avg_tour_elo - avg_opponent_elo) / 100) * 0.05
+        avg_opponent_elo = opponent_elos.mean() if len(opponent_elos) else avg_tour_elo
         
-        # Limit adjustment factor to reasonable range (0.6 to 1.4)
-        opponent_quality_factor = max(0.8, min(1.2, opponent_quality_factor))
+        # Calculate opponent quality adjustment factor, 5% per 100 ELO limited to 0.8 to 1.2 by default
+        opponent_quality_factor = 1.0
+        if config["use_opponent_quality"]:
+            opponent_quality_factor = float(get_opponent_quality_factor(
+                avg_tour_elo, avg_opponent_elo, config["opponent_factor_per_100"],
+                config["opponent_factor_min"], config["opponent_factor_max"]))
         
-        # Calculate raw averages
-        spw = np.average(normalized_data["SPW"])
-        rpw = np.average(normalized_data["RPW"])
+        # Calculate raw averages, weighting recent and current tournament matches more if asked
+        weights = None
+        half_life_weeks, event_boost = config["half_life_weeks"], config["event_boost"]
+        if half_life_weeks is not None or event_boost != 1.0:
+            as_of = normalized_data["Date"].max() if match_date is None else match_date
+            current_event = (normalized_data["Event"].str.contains(self.current_tournament, case=False, regex=False, na=False)
+                             & (normalized_data["Date"] >= as_of - pd.Timedelta(days=EVENT_DAYS))).to_numpy()
+            weights = recency_weights(normalized_data["Date"].to_numpy(), as_of,
+                                      None if half_life_weeks is None else 7 * half_life_weeks, current_event, event_boost)
+        spw = np.average(normalized_data["SPW"].astype(float), weights=weights)
+        rpw = np.average(normalized_data["RPW"].astype(float), weights=weights)
         print("avg opp elo: ", avg_opponent_elo)
         print("qual factor: ", opponent_quality_factor)
         # Apply opponent quality adjustment
@@ -200,7 +259,7 @@ class PlayerServeReturnStats(TennisDataScraper):
         
         # Apply current surface adjustment
         current_surface_speed = self.surface_data.loc[self.surface_data["Tournament"] == self.current_tournament, "Surface Speed"]
-        if current_surface_speed.empty:
+        if current_surface_speed.empty or not config["use_surface_speed"]:
             current_surface_speed = 1
         else:
             current_surface_speed = float(current_surface_speed.iloc[0])
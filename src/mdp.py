@@ -1,5 +1,7 @@
 import numpy as np
+from tracing import traced
 
+@traced()
 def get_fund_matrix(transition_mat, num_absorbing):
     """
     Get the fundamental matrix for an absorbing markov chain
@@ -15,6 +17,20 @@ def get_fund_matrix(transition_mat, num_absorbing):
     fund_mat = np.dot(N_mat, R_mat)
     return fund_mat
 
+@traced()
+def get_batch_fund_matrix(transition_mats, num_absorbing):
+    """
+    Get the fundamental matrix of a stack of absorbing markov chains with one linear solve
+
+    :param transition_mats: array of transition matrices with the chains on the first axis
+    :param num_absorbing: the number of absorbing states in each markov chain
+    :return: array of absorption probabilities, one matrix per chain
+    """
+    Q_mats = transition_mats[:, :-num_absorbing, :-num_absorbing]
+    R_mats = transition_mats[:, :-num_absorbing, -num_absorbing:]
+    identity_mat = np.eye(transition_mats.shape[1] - num_absorbing)
+    return np.linalg.solve(identity_mat - Q_mats, R_mats)
+
 def get_game_transition_matrix(service_pc):
     """
     Create the transition matrix with states:
@@ -25,7 +41,7 @@ def get_game_transition_matrix(service_pc):
     :param service_pc: the decimal percentage that a player wins their serve
     :return: transition matrix for a game of tennis
     """
-    transition_matrix = np.zeros((20, 20))
+    transition_matrix = np.zeros((20, 20) + np.shape(service_pc))
     transition_matrix[19][19] = 1
     transition_matrix[18][18] = 1
     return_pc = 1 - service_pc
@@ -111,7 +127,7 @@ def get_tiebreak_transition_matrix(p1_service_perc, p2_service_perc):
     :return: transition matrix for a tiebreak in a tennis match
     """
     
-    transition_matrix = np.zeros((53, 53))
+    transition_matrix = np.zeros((53, 53) + np.shape(p1_service_perc))
     transition_matrix[52][52] = 1
     transition_matrix[51][51] = 1
     
@@ -146,7 +162,7 @@ def get_set_transition_matrix(p1_service_game_perc, p2_service_game_perc):
     :param p2_service_game_perc: the decimal percentage that a player 2 wins a game
     :return: transition matrix for a set in a tennis match
     """
-    transition_matrix = np.zeros((41, 41))
+    transition_matrix = np.zeros((41, 41) + np.shape(p1_service_game_perc))
     transition_matrix[40][40] = 1
     transition_matrix[39][39] = 1
     transition_matrix[38][38] = 1
@@ -157,8 +173,8 @@ def get_set_transition_matrix(p1_service_game_perc, p2_service_game_perc):
     p1_serve_coords = [(0, 1), (3, 6), (4, 7), (5, 8), (10, 15), (11, 16), (12, 17), (13, 18), (14, 19), (21, 38), (22, 26), (23, 27), (24, 28), (25, 29), (30, 38), (31, 33), (32, 34), (35, 36)]
     p2_return_coords = [(0, 2), (3, 7), (4, 8), (5, 9), (10, 16), (11, 17), (12, 18), (13, 19), (14, 20), (21, 26), (22, 27), (23, 28), (24, 29), (25, 39), (30, 33), (31, 34), (32, 39), (35, 37)]
     
-    p2_serve_coords = [(1, 4), (2, 5), (6, 10), (7, 11), (8, 12), (9, 13), (15, 21), (16, 22), (17, 23), (18, 24), (19, 25), (20, 39), (26, 30), (27, 31), (28, 32), (29, 39), (33, 35), (34, 39), (36, 40), (37, 39)]
-    p1_return_coords = [(1, 3), (2, 4), (6, 11), (7, 12), (8, 13), (9, 14), (15, 38), (16, 21), (17, 22), (18, 23), (19, 24), (20, 25), (26, 38), (27, 30), (28, 31), (29, 32), (33, 38), (34, 35), (36, 38), (37, 40)]
+    p2_serve_coords = [(1, 4), (2, 5), (6, 11), (7, 12), (8, 13), (9, 14), (15, 21), (16, 22), (17, 23), (18, 24), (19, 25), (20, 39), (26, 30), (27, 31), (28, 32), (29, 39), (33, 35), (34, 39), (36, 40), (37, 39)]
+    p1_return_coords = [(1, 3), (2, 4), (6, 10), (7, 11), (8, 12), (9, 13), (15, 38), (16, 21), (17, 22), (18, 23), (19, 24), (20, 25), (26, 38), (27, 30), (28, 31), (29, 32), (33, 38), (34, 35), (36, 38), (37, 40)]
     
     for t in range(0, len(p1_return_coords)):
         if t < 18:
@@ -174,6 +190,7 @@ def get_set_transition_matrix(p1_service_game_perc, p2_service_game_perc):
     
     return transition_matrix
 
+@traced()
 def get_set_win_perc(p1_service_perc, p2_service_perc):
     """
     Get the percentage chance of each of 2 players to win a set of tennis
@@ -205,15 +222,159 @@ def get_set_win_perc(p1_service_perc, p2_service_perc):
     
     return p1_win_perc, p2_win_perc
 
-def get_match_prob(p1_service_perc, p2_service_perc):
+def get_game_win_perc_batch(service_perc):
+    """
+    Chance of holding serve, the closed form of get_game_transition_matrix's absorbing chain
+
+    :param service_perc: array of decimal percentage winrates on serve
+    :return: array of service game win percentages
+    """
+    service_perc = np.asarray(service_perc, dtype=np.float64)
+    return_perc = 1 - service_perc
+    # Games won to love, 15 and 30, then deuce reached at 3-3 and won by two points
+    deuce_perc = 20 * service_perc ** 3 * return_perc ** 3
+    return (service_perc ** 4 * (1 + 4 * return_perc + 10 * return_perc ** 2)
+            + deuce_perc * service_perc ** 2 / (1 - 2 * service_perc * return_perc))
+
+def get_tiebreak_win_perc_batch(p1_service_perc, p2_service_perc):
+    """
+    Player 1's chance to win a tiebreak they serve the first point of, walking the point scores
+    forward as in get_tiebreak_transition_matrix's chain
+
+    :param p1_service_perc: array of decimal percentage winrates of player 1 on their serve
+    :param p2_service_perc: array of decimal percentage winrates of player 2 on their serve
+    :return: array of player 1's tiebreak win percentages
+    """
+    p1_service_perc = np.asarray(p1_service_perc, dtype=np.float64)
+    p2_service_perc = np.asarray(p2_service_perc, dtype=np.float64)
+    scores = {(0, 0): np.ones(p1_service_perc.shape)}
+    win_perc = np.zeros(p1_service_perc.shape)
+    for point_idx in range(12):
+        # Player 1 serves the first point, then the serve changes every two points
+        p1_point_perc = p1_service_perc if (point_idx + 1) // 2 % 2 == 0 else 1 - p2_service_perc
+        next_scores = {}
+        for (p1_points, p2_points), score_perc in scores.items():
+            if p1_points + 1 == 7:
+                win_perc = win_perc + score_perc * p1_point_perc
+            else:
+                next_scores[(p1_points + 1, p2_points)] = next_scores.get((p1_points + 1, p2_points), 0.0) + score_perc * p1_point_perc
+            if p2_points + 1 < 7:
+                next_scores[(p1_points, p2_points + 1)] = next_scores.get((p1_points, p2_points + 1), 0.0) + score_perc * (1 - p1_point_perc)
+        scores = next_scores
+    # From 6-6 each pair of points has one serve each, and the first player to take both wins
+    p1_takes_both = p1_service_perc * (1 - p2_service_perc)
+    p2_takes_both = (1 - p1_service_perc) * p2_service_perc
+    return win_perc + scores[(6, 6)] * p1_takes_both / (p1_takes_both + p2_takes_both)
+
+@traced(describe=lambda p1_service_perc, *args, **kwargs: {"sets": len(np.atleast_1d(p1_service_perc))})
+def get_set_win_perc_batch(p1_service_perc, p2_service_perc):
+    """
+    get_set_win_perc for arrays of service point win percentages
+
+    Walks the game scores forward instead of solving the set, game and tiebreak chains, which gives
+    the same absorption probabilities in a few dozen array operations, so pricing every pairing of
+    a 128 player field takes milliseconds.
+
+    :param p1_service_perc: array of decimal percentage winrates of player 1 on their serve
+    :param p2_service_perc: array of decimal percentage winrates of player 2 on their serve
+    :return: arrays of set win percentages for each player
+    """
+    p1_service_perc = np.asarray(p1_service_perc, dtype=np.float64)
+    p2_service_perc = np.asarray(p2_service_perc, dtype=np.float64)
+    p1_service_game_perc = get_game_win_perc_batch(p1_service_perc)
+    p1_return_game_perc = 1 - get_game_win_perc_batch(p2_service_perc)
+    scores = {(0, 0): np.ones(p1_service_perc.shape)}
+    win_perc = np.zeros(p1_service_perc.shape)
+    for game_idx in range(12):
+        p1_game_perc = p1_service_game_perc if game_idx % 2 == 0 else p1_return_game_perc
+        next_scores = {}
+        for (p1_games, p2_games), score_perc in scores.items():
+            for (next_p1_games, next_p2_games), step_perc in (((p1_games + 1, p2_games), p1_game_perc), ((p1_games, p2_games + 1), 1 - p1_game_perc)):
+                if next_p1_games == 7 or (next_p1_games == 6 and next_p2_games <= 4):
+                    win_perc = win_perc + score_perc * step_perc
+                elif next_p2_games == 7 or (next_p2_games == 6 and next_p1_games <= 4):
+                    continue
+                else:
+                    next_scores[(next_p1_games, next_p2_games)] = next_scores.get((next_p1_games, next_p2_games), 0.0) + score_perc * step_perc
+        scores = next_scores
+    p1_win_perc = win_perc + scores[(6, 6)] * get_tiebreak_win_perc_batch(p1_service_perc, p2_service_perc)
+    return p1_win_perc, 1 - p1_win_perc
+
+def get_sets_win_prob(first_set_win_perc, second_set_win_perc, best_of=3):
+    """
+    Get player 1's chance to win a match where the first server alternates every set
+
+    :param first_set_win_perc: player 1's chance to win a set they serve first in, as in sets 1, 3 and 5
+    :param second_set_win_perc: player 1's chance to win a set their opponent serves first in
+    :param best_of: the number of sets in the match
+    :return: player 1's match win percentage
+    """
+    sets_to_win = best_of // 2 + 1
+    # Probability of each (player 1 sets, player 2 sets) score before the next set
+    scores = {(0, 0): 1.0}
+    win_prob = 0.0
+    for set_idx in range(best_of):
+        set_win_perc = first_set_win_perc if set_idx % 2 == 0 else second_set_win_perc
+        next_scores = {}
+        for (p1_sets, p2_sets), score_prob in scores.items():
+            if p1_sets + 1 == sets_to_win:
+                win_prob = win_prob + score_prob * set_win_perc
+            else:
+                next_scores[(p1_sets + 1, p2_sets)] = next_scores.get((p1_sets + 1, p2_sets), 0.0) + score_prob * set_win_perc
+            if p2_sets + 1 < sets_to_win:
+                next_scores[(p1_sets, p2_sets + 1)] = next_scores.get((p1_sets, p2_sets + 1), 0.0) + score_prob * (1 - set_win_perc)
+        scores = next_scores
+    return win_prob
+
+@traced(describe=lambda p1_service_perc, *args, **kwargs: {"matches": len(np.atleast_1d(p1_service_perc))})
+def get_match_prob_batch(p1_service_perc, p2_service_perc, best_of=3):
+    """
+    get_match_prob for arrays of service point win percentages
+
+    Prices every match's sets together with get_set_win_perc_batch, so pricing thousands of matches
+    costs a handful of numpy calls instead of six inversions each.
+
+    :param p1_service_perc: array of decimal percentage winrates of player 1 on their serve
+    :param p2_service_perc: array of decimal percentage winrates of player 2 on their serve
+    :param best_of: the number of sets, an int or an array with one entry per match
+    :return: arrays of match win percentages for each player
+    """
+    p1_service_perc = np.atleast_1d(np.asarray(p1_service_perc, dtype=np.float64))
+    p2_service_perc = np.atleast_1d(np.asarray(p2_service_perc, dtype=np.float64))
+    p1_win_prob = np.full(len(p1_service_perc), np.nan)
+    valid = np.isfinite(p1_service_perc) & np.isfinite(p2_service_perc)
+    if valid.any():
+        set_win_perc, _ = get_set_win_perc_batch(np.concatenate([p1_service_perc[valid], p2_service_perc[valid]]),
+                                                 np.concatenate([p2_service_perc[valid], p1_service_perc[valid]]))
+        p1_set_win_p1_serves_first, p2_set_win_p2_serves_first = np.split(set_win_perc, 2)
+        p1_set_win_p2_serves_first = 1 - p2_set_win_p2_serves_first
+        best_of = np.broadcast_to(np.asarray(best_of), p1_service_perc.shape)[valid]
+        valid_win_prob = np.zeros(valid.sum())
+        for num_sets in np.unique(best_of):
+            in_format = best_of == num_sets
+            serving_first = get_sets_win_prob(p1_set_win_p1_serves_first[in_format], p1_set_win_p2_serves_first[in_format], int(num_sets))
+            serving_second = get_sets_win_prob(p1_set_win_p2_serves_first[in_format], p1_set_win_p1_serves_first[in_format], int(num_sets))
+            valid_win_prob[in_format] = (serving_first + serving_second) / 2
+        p1_win_prob[valid] = valid_win_prob
+    return p1_win_prob, 1 - p1_win_prob
+
+@traced()
+def get_match_prob(p1_service_perc, p2_service_perc, best_of=3):
     """
     Get the percentage chance of each of 2 players to win a matfch of tennis 
     given their service point win percentages and how many games are in the match
     
     :param p1_service_perc: the decimal percentage winrate of player 1 on their serve
     :param p2_service_perc: the decimal percentage winrate of player 2 on their serve
+    :param best_of: the number of sets in the match
     :return: win percentages for a match of tennis for each player
     """
+    if best_of != 3:
+        p1_set_win_p1_serves_first, p2_set_win_p1_serves_first = get_set_win_perc(p1_service_perc, p2_service_perc)
+        p2_set_win_p2_serves_first, p1_set_win_p2_serves_first = get_set_win_perc(p2_service_perc, p1_service_perc)
+        p1_win_prob = (get_sets_win_prob(p1_set_win_p1_serves_first, p1_set_win_p2_serves_first, best_of) +
+                       get_sets_win_prob(p1_set_win_p2_serves_first, p1_set_win_p1_serves_first, best_of)) / 2
+        return p1_win_prob, 1 - p1_win_prob
     p1_set_win_p1_serves_first, p2_set_win_p1_serves_first = get_set_win_perc(p1_service_perc, p2_service_perc)
     p2_set_win_p2_serves_first, p1_set_win_p2_serves_first = get_set_win_perc(p2_service_perc, p1_service_perc)
     
@@ -0,0 +1,80 @@
+import numpy as np
+
+# Every tunable constant and feature toggle of the model, overridden per run with get_model_config
+DEFAULT_MODEL_CONFIG = {
+    # combine_serve_return: weight on a player's own serve numbers for a 0% and a 100% ELO win probability
+    "min_weight": 0.25,
+    "max_weight": 0.75,
+    # Opponent quality: scale serve/return by per_100 for every 100 ELO of average opponent below the tour average
+    "use_opponent_quality": True,
+    "opponent_factor_per_100": 0.05,
+    "opponent_factor_min": 0.8,
+    "opponent_factor_max": 1.2,
+    "tour_top_n": 300,
+    # Surface speed normalization, with these speeds when a tournament's speed is unknown
+    "use_surface_speed": True,
+    "fallback_speeds": {"Grass": 1.14, "Clay": 0.7195, "Hard": 1.118158},
+    # Use ELO to weight the serve/return blend, an ELO difference of 0 otherwise
+    "use_elo": True,
+    # Window and recency weighting of the serve/return estimate
+    "num_weeks": 52,
+    "half_life_weeks": None,
+    "event_boost": 1.0,
+    "point_weighted": True,
+    # Local data pricer: minimum matches with stats and surface shrinkage
+    "min_stat_matches": 3,
+    "surface_prior": 10,
+}
+
+def get_model_config(overrides=None):
+    """
+    DEFAULT_MODEL_CONFIG with some values replaced
+
+    :param overrides: dict of config values to change, keys must already be in DEFAULT_MODEL_CONFIG
+    :return: a new config dict
+    :raises ValueError: for an unknown key
+    """
+    overrides = overrides or {}
+    unknown = set(overrides) - set(DEFAULT_MODEL_CONFIG)
+    if unknown:
+        raise ValueError(f"Unknown model config keys: {', '.join(sorted(unknown))}")
+    config = dict(DEFAULT_MODEL_CONFIG, fallback_speeds=dict(DEFAULT_MODEL_CONFIG["fallback_speeds"]))
+    config.update(overrides)
+    return config
+
+def get_opponent_quality_factor(avg_tour_elo, avg_opponent_elo, per_100=0.05, min_factor=0.8, max_factor=1.2):
+    """
+    Scale for serve/return numbers earned against weaker or stronger than average opponents
+
+    For every 100 ELO points the opponents averaged below the tour, scale performance down by per_100,
+    and up by per_100 for every 100 above, limited to [min_factor, max_factor]
+    """
+    return np.clip(1 - ((avg_tour_elo - avg_opponent_elo) / 100) * per_100, min_factor, max_factor)
+
+def get_elo_win_probability(elo_diff):
+    """Probability that the higher rated player wins given the ELO difference"""
+    return 1 / (1 + 10 ** (-elo_diff / 400))
+
+def combine_serve_return(player1_spw, player1_rpw, player2_spw, player2_rpw, elo_diff, min_weight=0.25, max_weight=0.75):
+    """
+    Blend each player's serve points won with their opponent's return points won,
+    trusting the stronger player's own numbers more
+
+    :param player1_spw: player 1's service points won percentage (0-100)
+    :param player1_rpw: player 1's return points won percentage (0-100)
+    :param player2_spw: player 2's service points won percentage (0-100)
+    :param player2_rpw: player 2's return points won percentage (0-100)
+    :param elo_diff: player 1's ELO minus player 2's ELO
+    :return: the combined service points won percentage of player 1 and player 2
+    """
+    win_probability = get_elo_win_probability(elo_diff)
+    weight_range = max_weight - min_weight
+
+    # Player 1's weight is higher when they have higher win probability
+    player1_weight = min_weight + (win_probability * weight_range)
+    player2_weight = 1 - player1_weight
+
+    # maybe adjust the way combined spw is calculated to take into account ranking difference
+    player1_combined_spw = (player1_weight * player1_spw) + ((1 - player1_weight) * (100 - player2_rpw))
+    player2_combined_spw = (player2_weight * player2_spw) + ((1 - player2_weight) * (100 - player1_rpw))
+    return player1_combined_spw, player2_combined_spw
@@ -0,0 +1,120 @@
+import os
+import re
+import threading
+import numpy as np
+import pandas as pd
+
+PLAYERS_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "data", "atp_players.csv")
+
+# "Auger-Aliassime F.", "Varillas J. P.", "Meligeni Rodrigues F"
+ABBREVIATED_NAME_PATTERN = re.compile(r"^(.+?)\s+([A-Z][a-z]?)\.?(?:[\s-]*[A-Z][a-z]?\.?)*$")
+
+def normalize_name(name):
+    """Lowercase letters only, so "O Connell", "O'Connell" and "OConnell" compare equal"""
+    return re.sub(r"[^a-z]", "", str(name).lower())
+
+class PlayerRegistry:
+    """atp_players.csv loaded once and indexed by player_id for vectorized id -> name lookups"""
+
+    def __init__(self, path=PLAYERS_PATH):
+        self.players = pd.read_csv(path)
+        indexed = self.players.drop_duplicates("player_id").set_index("player_id")
+        self.first_names = indexed["name_first"]
+        self.last_names = indexed["name_last"]
+        self.full_names = self.first_names + " " + self.last_names
+        name_index = self.players.dropna(subset=["name_first", "name_last"]).drop_duplicates(["name_first", "name_last"])
+        self._ids_by_name = dict(zip(zip(name_index["name_first"], name_index["name_last"]), name_index["player_id"]))
+        self._by_last_name = None
+        self._by_last_word = None
+        self._first_name_index = None
+        self._abbreviated_cache = {}
+
+    def get_first_names(self, player_ids):
+        """Get the first name of every id in a column, NaN where the id is unknown"""
+        return pd.Series(player_ids).map(self.first_names)
+
+    def get_last_names(self, player_ids):
+        """Get the last name of every id in a column, NaN where the id is unknown"""
+        return pd.Series(player_ids).map(self.last_names)
+
+    def get_full_names(self, player_ids):
+        """Get "first last" for every id in a column, NaN where the id or either name is unknown"""
+        return pd.Series(player_ids).map(self.full_names)
+
+    def get_name(self, player_id):
+        return self.first_names.loc[player_id], self.last_names.loc[player_id]
+
+    def get_id(self, first_name, last_name):
+        """
+        Get a player's id from their first and last name
+
+        :return: the player id
+        :raises KeyError: if no player has that name
+        """
+        return self._ids_by_name[(first_name, last_name)]
+
+    def get_ids(self, first_names, last_names):
+        """Get the ids for columns of first and last names, -1 where the name is unknown"""
+        return np.array([self._ids_by_name.get(key, -1) for key in zip(first_names, last_names)], dtype=np.int64)
+
+    def _abbreviated_index(self):
+        """Candidate (player_id, normalized first, normalized last) rows keyed by normalized full last name and by its first word, youngest first"""
+        if self._by_last_name is None:
+            named = self.players.dropna(subset=["name_last"]).sort_values("dob", ascending=False)
+            self._by_last_name = {}
+            self._by_last_word = {}
+            for player_id, first_name, last_name in zip(named["player_id"], named["name_first"].fillna(""), named["name_last"]):
+                candidate = (int(player_id), normalize_name(first_name), normalize_name(last_name))
+                self._by_last_name.setdefault(candidate[2], []).append(candidate)
+                self._by_last_word.setdefault(normalize_name(re.split(r"[\s-]+", last_name)[0]), []).append(candidate)
+        return self._by_last_name, self._by_last_word
+
+    def resolve_abbreviated(self, name):
+        """
+        Resolve a "Last F." style name (as in the backtest workbooks) to a player id
+
+        Tries the exact last name, then only its first word ("Ramos-Vinolas" -> "Ramos"), then
+        first and last swapped ("Bu Y." -> Bu Yunchaokete). Ties go to the youngest player.
+
+        :return: the player id, or -1 if no player matches
+        """
+        if name in self._abbreviated_cache:
+            return self._abbreviated_cache[name]
+        player_id = -1
+        name_match = ABBREVIATED_NAME_PATTERN.match(str(name).strip())
+        if name_match:
+            by_last_name, by_last_word = self._abbreviated_index()
+            last_name = name_match.group(1)
+            last_key = normalize_name(last_name)
+            initial = name_match.group(2)[0].lower()
+            searches = [
+                (by_last_name.get(last_key, []), lambda first, last: first.startswith(initial)),
+                (by_last_word.get(normalize_name(re.split(r"[\s-]+", last_name)[0]), []), lambda first, last: first.startswith(initial)),
+                (self._by_first_name().get(last_key, []), lambda first, last: last.startswith(initial)),
+            ]
+            for candidates, matches in searches:
+                player_id = next((candidate[0] for candidate in candidates if matches(candidate[1], candidate[2])), -1)
+                if player_id != -1:
+                    break
+        self._abbreviated_cache[name] = player_id
+        return player_id
+
+    def _by_first_name(self):
+        if self._first_name_index is None:
+            self._first_name_index = {}
+            for candidates in self._abbreviated_index()[0].values():
+                for candidate in candidates:
+                    self._first_name_index.setdefault(candidate[1], []).append(candidate)
+        return self._first_name_index
+
+_registry = None
+_registry_lock = threading.Lock()
+
+def get_registry():
+    """Get the process-wide PlayerRegistry, loading atp_players.csv on first use"""
+    global _registry
+    if _registry is None:
+        with _registry_lock:
+            if _registry is None:
+                _registry = PlayerRegistry()
+    return _registry
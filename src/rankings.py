@@ -0,0 +1,193 @@
+import argparse
+import glob
+import json
+import os
+import shutil
+import threading
+import time
+import numpy as np
+import pandas as pd
+from history import DATA_DIR, STORE_DIR, _swap_in, to_yyyymmdd
+
+RANKINGS_DIR = os.path.join(DATA_DIR, "atp_rankings")
+RANKINGS_STORE_DIR = os.path.join(STORE_DIR, "rankings")
+
+# Lookup keys are (player position << DATE_BITS) | yyyymmdd, so one sorted int64 array orders
+# the index by player then ranking date
+DATE_BITS = 32
+
+def ranking_files(rankings_dir=RANKINGS_DIR):
+    return sorted(glob.glob(os.path.join(rankings_dir, "*.csv")))
+
+def to_yyyymmdd_array(dates):
+    """Vectorized to_yyyymmdd for an array of dates"""
+    dates = pd.DatetimeIndex(pd.to_datetime(np.atleast_1d(dates)))
+    return (dates.year * 10000 + dates.month * 100 + dates.day).to_numpy(dtype=np.int64)
+
+def build_rankings_index(rankings_dir=RANKINGS_DIR, store_dir=RANKINGS_STORE_DIR):
+    """
+    Write the weekly ranking csvs as per-player sorted arrays for memory-mapped as-of lookups
+
+    Rows are sorted by (player, ranking_date). Alongside the date, rank and points columns are the
+    sorted player ids with each player's row offsets, and the int64 lookup keys.
+
+    :return: the number of ranking rows written
+    """
+    files = ranking_files(rankings_dir)
+    rankings = pd.concat([pd.read_csv(path) for path in files], ignore_index=True)
+    rankings = rankings.dropna(subset=["ranking_date", "player", "rank"])
+    # A few weeks list a player twice, keep their better rank
+    rankings = rankings.sort_values("rank", kind="mergesort").drop_duplicates(["player", "ranking_date"])
+    player_ids = rankings["player"].to_numpy(dtype=np.int64)
+    dates = rankings["ranking_date"].to_numpy(dtype=np.int64)
+    order = np.lexsort((dates, player_ids))
+    player_ids, dates = player_ids[order], dates[order]
+
+    index_ids, index_starts, positions = np.unique(player_ids, return_index=True, return_inverse=True)
+    # Written next to the live index and swapped in whole, so readers never see a half-built one
+    build_dir = f"{store_dir}.building-{os.getpid()}"
+    if os.path.exists(build_dir):
+        shutil.rmtree(build_dir)
+    os.makedirs(build_dir)
+    np.save(os.path.join(build_dir, "player_ids.npy"), index_ids.astype(np.int64))
+    np.save(os.path.join(build_dir, "player_offsets.npy"), np.append(index_starts, len(player_ids)).astype(np.int64))
+    np.save(os.path.join(build_dir, "keys.npy"), (positions.reshape(-1).astype(np.int64) << DATE_BITS) | dates)
+    np.save(os.path.join(build_dir, "dates.npy"), dates.astype(np.int32))
+    np.save(os.path.join(build_dir, "ranks.npy"), rankings["rank"].to_numpy(dtype=np.int32)[order])
+    np.save(os.path.join(build_dir, "points.npy"), pd.to_numeric(rankings["points"], errors="coerce").to_numpy(dtype=np.float32)[order])
+    meta = {"rows": int(len(rankings)), "sources": {os.path.basename(path): os.path.getmtime(path) for path in files}}
+    with open(os.path.join(build_dir, "meta.json"), "w") as f:
+        json.dump(meta, f, indent=1)
+    _swap_in(build_dir, store_dir)
+    return len(rankings)
+
+def is_stale(rankings_dir=RANKINGS_DIR, store_dir=RANKINGS_STORE_DIR):
+    """True if the index is missing or any ranking csv was added or changed since it was built"""
+    meta_path = os.path.join(store_dir, "meta.json")
+    if not os.path.exists(meta_path):
+        return True
+    with open(meta_path) as f:
+        sources = json.load(f)["sources"]
+    return sources != {os.path.basename(path): os.path.getmtime(path) for path in ranking_files(rankings_dir)}
+
+def refresh_rankings_index(rankings_dir=RANKINGS_DIR, store_dir=RANKINGS_STORE_DIR):
+    """
+    Rebuild the index if there are ranking csvs and they changed since it was built
+
+    :return: True if it was rebuilt
+    """
+    if not ranking_files(rankings_dir) or not is_stale(rankings_dir, store_dir):
+        return False
+    print("Rebuilding the rankings index, its csvs changed since it was built")
+    build_rankings_index(rankings_dir, store_dir)
+    return True
+
+class RankingsIndex:
+    """As-of rank and points lookups over the memory-mapped rankings index"""
+
+    def __init__(self, store_dir=RANKINGS_STORE_DIR):
+        if not os.path.exists(os.path.join(store_dir, "meta.json")):
+            raise FileNotFoundError(f"No rankings index in {store_dir}, run `python rankings.py build` first")
+        self.store_dir = store_dir
+        self.player_ids = self._load("player_ids")
+        self.player_offsets = self._load("player_offsets")
+        self.keys = self._load("keys")
+        self.dates = self._load("dates")
+        self.ranks = self._load("ranks")
+        self.points = self._load("points")
+
+    def _load(self, name):
+        return np.load(os.path.join(self.store_dir, f"{name}.npy"), mmap_mode="r")
+
+    def lookup(self, player_id, date, max_age_days=None):
+        """
+        Get a player's rank and points from the latest ranking published on or before a date
+
+        :param date: anything to_yyyymmdd accepts
+        :param max_age_days: treat rankings older than this as unknown
+        :return: (rank, points), (None, None) if the player had no ranking yet
+        """
+        position = np.searchsorted(self.player_ids, player_id)
+        if position >= len(self.player_ids) or self.player_ids[position] != player_id:
+            return None, None
+        lo, hi = int(self.player_offsets[position]), int(self.player_offsets[position + 1])
+        date = to_yyyymmdd(date)
+        row = lo + int(np.searchsorted(self.dates[lo:hi], date, side="right")) - 1
+        if row < lo:
+            return None, None
+        if max_age_days is not None and (pd.Timestamp(str(date)) - pd.Timestamp(str(self.dates[row]))).days > max_age_days:
+            return None, None
+        points = float(self.points[row])
+        return int(self.ranks[row]), None if np.isnan(points) else points
+
+    def batch_lookup(self, player_ids, dates, max_age_days=None):
+        """
+        Vectorized lookup for arrays of players and dates
+
+        :param player_ids: array of player ids
+        :param dates: a date or array of dates, one per player
+        :return: (ranks, points, ranking dates) float arrays, NaN where unknown
+        """
+        player_ids = np.atleast_1d(np.asarray(player_ids, dtype=np.int64))
+        dates = np.broadcast_to(to_yyyymmdd_array(dates), player_ids.shape)
+        positions = np.minimum(np.searchsorted(self.player_ids, player_ids), len(self.player_ids) - 1)
+        known = np.asarray(self.player_ids[positions]) == player_ids
+        query_keys = (positions.astype(np.int64) << DATE_BITS) | dates
+        rows = np.searchsorted(self.keys, query_keys, side="right") - 1
+        found = known & (rows >= 0)
+        rows = np.maximum(rows, 0)
+        found &= (np.asarray(self.keys[rows]) >> DATE_BITS) == positions
+        ranking_dates = np.asarray(self.dates[rows])
+        if max_age_days is not None:
+            ages = (pd.to_datetime(dates.astype(str), format="%Y%m%d") - pd.to_datetime(ranking_dates.astype(str), format="%Y%m%d")).days
+            found &= np.asarray(ages) <= max_age_days
+        ranks = np.where(found, np.asarray(self.ranks[rows]), np.nan)
+        points = np.where(found, np.asarray(self.points[rows], dtype=np.float64), np.nan)
+        return ranks, points, np.where(found, ranking_dates, np.nan)
+
+    def history(self, player_id):
+        """Get a player's full ranking history as a DataFrame"""
+        position = np.searchsorted(self.player_ids, player_id)
+        if position >= len(self.player_ids) or self.player_ids[position] != player_id:
+            return pd.DataFrame(columns=["ranking_date", "rank", "points"])
+        rows = slice(int(self.player_offsets[position]), int(self.player_offsets[position + 1]))
+        return pd.DataFrame({
+            "ranking_date": pd.to_datetime(np.asarray(self.dates[rows]).astype(str), format="%Y%m%d"),
+            "rank": np.asarray(self.ranks[rows]),
+            "points": np.asarray(self.points[rows], dtype=np.float64),
+        })
+
+_rankings = None
+_rankings_lock = threading.Lock()
+
+def get_rankings():
+    """Get the process-wide RankingsIndex, (re)building it first if the ranking csvs changed"""
+    global _rankings
+    if _rankings is None:
+        with _rankings_lock:
+            if _rankings is None:
+                refresh_rankings_index()
+                _rankings = RankingsIndex()
+    return _rankings
+
+def main():
+    parser = argparse.ArgumentParser(description="Build or query the as-of rankings index")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    subparsers.add_parser("build", help="Index data/atp_rankings/*.csv")
+    query_parser = subparsers.add_parser("query", help="A player's rank and points on a date")
+    query_parser.add_argument("player_id", type=int)
+    query_parser.add_argument("date")
+    args = parser.parse_args()
+
+    if args.command == "build":
+        start = time.perf_counter()
+        rows = build_rankings_index()
+        print(f"Indexed {rows} ranking rows in {time.perf_counter() - start:.1f}s")
+    else:
+        rankings = get_rankings()
+        start = time.perf_counter()
+        rank, points = rankings.lookup(args.player_id, args.date)
+        print(f"rank {rank}, points {points} in {(time.perf_counter() - start) * 1e6:.0f}us")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,135 @@
+import numpy as np
+
+# Matches of an event that started this many days before the match are treated as the current event
+EVENT_DAYS = 13
+
+def decay_weights(age_days, half_life_days):
+    """Exponential decay weights, 1 for a match played today and 0.5 for one half_life_days old"""
+    if half_life_days is None:
+        return np.ones(np.shape(age_days))
+    return 0.5 ** (np.asarray(age_days, dtype=np.float64) / half_life_days)
+
+def recency_weights(dates, as_of, half_life_days=None, current_event=None, event_boost=1.0, serve_points=None):
+    """
+    Weight each past match by how recent it is, whether it is from the current event and how
+    many serve points it had
+
+    :param dates: array of match dates
+    :param as_of: the date being priced
+    :param half_life_days: days for a match's weight to halve, None for no decay
+    :param current_event: optional boolean array, True for matches of the event being priced
+    :param event_boost: weight multiplier for current event matches
+    :param serve_points: optional array of serve points per match, weights matches by points played
+    :return: array of weights, not normalized
+    """
+    ages = (np.datetime64(as_of, "D") - np.asarray(dates, dtype="datetime64[D]")).astype(np.float64)
+    weights = decay_weights(np.maximum(ages, 0), half_life_days)
+    if current_event is not None:
+        weights = np.where(current_event, weights * event_boost, weights)
+    if serve_points is not None:
+        weights = weights * np.nan_to_num(np.asarray(serve_points, dtype=np.float64))
+    return weights
+
+def decayed_cumsum(days, values, half_life_days, starts):
+    """
+    Running time-decayed sums along rows sorted by day within each group
+
+    Evaluates sums[k] = sums[k - 1] * 0.5 ** ((days[k] - days[k - 1]) / half_life_days) + values[k],
+    restarting at every group start, as a prefix scan: each pass folds in the rows offset rows
+    back, so it takes log2 of the longest group's length vectorized passes.
+
+    :param days: int array of days, ascending within each group
+    :param values: (rows, columns) array added at each row
+    :param half_life_days: days for a sum to halve, None for plain running sums
+    :param starts: boolean array, True at the first row of each group
+    :return: (rows, columns) array of the sums after each row
+    """
+    sums = np.array(values, dtype=np.float64)
+    if half_life_days is None:
+        factors = np.ones(len(days))
+    else:
+        factors = decay_weights(np.maximum(np.diff(np.asarray(days, dtype=np.float64), prepend=0.0), 0.0), half_life_days)
+    factors[starts] = 0.0
+    offset = 1
+    while offset < len(sums) and factors[offset:].any():
+        sums[offset:] += factors[offset:, None] * sums[:-offset]
+        factors[offset:] *= factors[:-offset]
+        offset *= 2
+    return sums
+
+class RecencyState:
+    """
+    Time-decayed sums of every player after each of their matches
+
+    The sums after a match are the ones after the player's previous match decayed to its day
+    plus its own values, an O(1) update per match, evaluated for the whole history at once by
+    decayed_cumsum and one match at a time by append. The decayed sums of any run of a player's matches as of a later day are
+    then the sums after its last match minus those before its first, both decayed to that day,
+    so a window costs the same whatever its length.
+    """
+
+    def __init__(self, groups, days, values, half_life_days=None):
+        """
+        :param groups: array of player indexes, rows sorted by (group, day)
+        :param days: int array of the days matches were played
+        :param values: (rows, columns) array of the values each match adds
+        :param half_life_days: days for a match's weight to halve, None for no decay
+        """
+        self.groups = np.asarray(groups, dtype=np.int64)
+        self.days = np.asarray(days, dtype=np.int64)
+        self.half_life_days = half_life_days
+        self.starts = np.ones(len(self.days), dtype=bool)
+        self.starts[1:] = self.groups[1:] != self.groups[:-1]
+        self.sums = decayed_cumsum(self.days, values, half_life_days, self.starts)
+
+    def append(self, group, day, values):
+        """
+        Add a match played on or after its player's last one, updating the sums from that match's
+
+        The row goes after the player's other rows, so rows of later players move up by one and
+        row ranges taken before the append are stale.
+
+        :param group: player index
+        :param day: day the match was played
+        :param values: array of the values it adds, one per column
+        :return: index of the new row
+        :raises ValueError: if the player's last match is after day
+        """
+        values = np.asarray(values, dtype=np.float64).reshape(-1)
+        row = int(np.searchsorted(self.groups, group, side="right"))
+        start = row == 0 or self.groups[row - 1] != group
+        if start:
+            sums = values
+        elif self.days[row - 1] > day:
+            raise ValueError(f"Player {group} already has a match on day {self.days[row - 1]}, after day {day}")
+        else:
+            sums = self.sums[row - 1] * decay_weights(day - self.days[row - 1], self.half_life_days) + values
+        self.groups = np.insert(self.groups, row, group)
+        self.days = np.insert(self.days, row, day)
+        self.starts = np.insert(self.starts, row, start)
+        self.sums = np.insert(self.sums, row, sums, axis=0)
+        return row
+
+    def _after(self, rows, days, valid):
+        """Sums after each row decayed to days, zero where not valid"""
+        rows = np.where(valid, rows, 0)
+        factors = np.where(valid, decay_weights(np.maximum(days - self.days[rows], 0), self.half_life_days), 0.0)
+        return self.sums[rows] * factors[:, None]
+
+    def window_sums(self, lo, hi, days):
+        """
+        Decayed sums of the rows in [lo, hi) as of days, for many windows at once
+
+        :param lo: array of first rows, each window within one player's rows
+        :param hi: array of rows past the last, lo where the window is empty
+        :param days: array of days after every row of the windows
+        :return: (windows, columns) array of sums
+        """
+        lo, hi = np.asarray(lo), np.asarray(hi)
+        if not len(self.days):
+            return np.zeros((len(lo), self.sums.shape[1]))
+        days = np.asarray(days, dtype=np.int64)
+        filled = hi > lo
+        # The row before the window only counts when it is the same player's
+        earlier = filled & ~self.starts[np.minimum(lo, len(self.days) - 1)]
+        return self._after(hi - 1, days, filled) - self._after(lo - 1, days, earlier)
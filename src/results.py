@@ -0,0 +1,204 @@
+from multiprocessing import shared_memory
+import numpy as np
+import pandas as pd
+from util import compress_name
+
+# One row per match, rates as percentages, codes index the history's surfaces, events and
+# opponents lists with -1 for unknown, opponent_rank is -1 when unranked
+RESULT_DTYPE = np.dtype([
+    ("day", np.int32),
+    ("surface", np.int16),
+    ("event", np.int32),
+    ("opponent", np.int32),
+    ("opponent_rank", np.int32),
+    ("spw", np.float32),
+    ("rpw", np.float32),
+    ("excluded", np.bool_),
+])
+
+# Team events played outside the tour, left out of every window
+EXCLUDED_EVENTS = r"Davis Cup|Laver Cup"
+EVENT_PATTERN = r"\d{4}\s+(.+?)\s+\S+$"
+OPPONENT_PATTERN = r"(?:\(?\d+\)?\s*)?([A-Za-z]+(?:\s[A-Za-z]+)?)\s*\[[A-Z]+\]"
+
+def _codes(values):
+    """Categorical codes of a Series with -1 for missing values, and the list of categories"""
+    codes, categories = pd.factorize(values, use_na_sentinel=True)
+    return codes.astype(np.int32), [str(category) for category in categories]
+
+def _parse_rates(values):
+    """Percentages from strings like "64.3%", NaN where missing"""
+    return pd.to_numeric(values.astype(str).str.rstrip("%"), errors="coerce").to_numpy(dtype=np.float32)
+
+class ResultHistory:
+    """
+    A player's match results as one structured array sorted by day
+
+    Scraped tables are parsed once by from_frame, so windows are two binary searches and a mask
+    instead of string filters over a DataFrame.
+    """
+    __slots__ = ("records", "surfaces", "events", "opponents")
+
+    def __init__(self, records, surfaces, events, opponents):
+        self.records = records
+        self.surfaces = surfaces
+        self.events = events
+        self.opponents = opponents
+
+    @classmethod
+    def from_frame(cls, results):
+        """
+        Parse a results table in the format of PlayerDataScraper.get_recent_results
+
+        :param results: DataFrame with Match, Date, Surface, Scoreline, vRk, SPW and RPW columns, rows without a
+        date are dropped
+        """
+        dates = pd.to_datetime(results["Date"])
+        results, dates = results[dates.notna()], dates[dates.notna()]
+        match = results["Match"].astype(object)
+        surface_codes, surfaces = _codes(results["Surface"])
+        event_codes, events = _codes(match.str.extract(EVENT_PATTERN, expand=False))
+        opponent_names = results["Scoreline"].astype(object).str.extract(OPPONENT_PATTERN, expand=False)
+        opponent_codes, opponents = _codes(opponent_names.dropna().str.strip().map(compress_name).reindex(opponent_names.index))
+
+        records = np.empty(len(results), dtype=RESULT_DTYPE)
+        records["day"] = dates.to_numpy().astype("datetime64[D]").astype(np.int32)
+        records["surface"] = surface_codes
+        records["event"] = event_codes
+        records["opponent"] = opponent_codes
+        records["opponent_rank"] = pd.to_numeric(results["vRk"].astype(str), errors="coerce").fillna(-1).to_numpy(dtype=np.int32)
+        records["spw"] = _parse_rates(results["SPW"])
+        records["rpw"] = _parse_rates(results["RPW"])
+        records["excluded"] = match.str.contains(EXCLUDED_EVENTS, na=False).to_numpy(dtype=bool)
+        return cls(records[np.argsort(records["day"], kind="stable")], surfaces, events, opponents)
+
+    def __len__(self):
+        return len(self.records)
+
+    def _select(self, records):
+        return ResultHistory(records[~records["excluded"]], self.surfaces, self.events, self.opponents)
+
+    def last_weeks(self, num_weeks=-1):
+        """The results of the num_weeks weeks up to the latest match, all of them for -1, without excluded events"""
+        if num_weeks == -1 or not len(self.records):
+            return self._select(self.records)
+        days = self.records["day"]
+        cutoff = int(days[-1]) - 7 * num_weeks
+        return self._select(self.records[np.searchsorted(days, cutoff, side="left"):])
+
+    def before(self, date, num_weeks):
+        """The results of the num_weeks weeks up to and including a date, without excluded events"""
+        day = int(pd.Timestamp(date).to_datetime64().astype("datetime64[D]").astype(np.int64))
+        days = self.records["day"]
+        start = np.searchsorted(days, day - 7 * num_weeks, side="right")
+        end = np.searchsorted(days, day, side="right")
+        return self._select(self.records[start:end])
+
+    @staticmethod
+    def _labels(codes, categories):
+        labels = np.array(categories + [None], dtype=object)
+        return labels[codes]
+
+    def surface_names(self):
+        return self._labels(self.records["surface"], self.surfaces)
+
+    def event_names(self):
+        return self._labels(self.records["event"], self.events)
+
+    def opponent_names(self):
+        return self._labels(self.records["opponent"], self.opponents)
+
+    def to_frame(self):
+        """The results as a DataFrame, oldest first, with float SPW and RPW percentages"""
+        records = self.records
+        return pd.DataFrame({
+            "Date": records["day"].astype("datetime64[D]").astype("datetime64[ns]"),
+            "Surface": self.surface_names(),
+            "Event": self.event_names(),
+            "Opponent": self.opponent_names(),
+            "vRk": np.where(records["opponent_rank"] >= 0, records["opponent_rank"], np.nan),
+            "SPW": records["spw"].astype(np.float64),
+            "RPW": records["rpw"].astype(np.float64),
+        })
+
+class SharedResults:
+    """
+    Many players' ResultHistory records packed into one shared memory block
+
+    The process that packs them owns the block and must close it, which unlinks it; using it as
+    a context manager does. Pickled, it is the block's name and layout, so worker processes map
+    the records instead of copying them. Workers must be started by multiprocessing from the
+    owner: they share its resource tracker, so attaching doesn't hand the block to a tracker
+    that would unlink it when the worker exits.
+    """
+
+    def __init__(self, histories):
+        """
+        :param histories: dict of ResultHistory by any picklable key
+        """
+        histories = dict(histories)
+        length = sum(len(history) for history in histories.values())
+        shm = shared_memory.SharedMemory(create=True, size=max(length * RESULT_DTYPE.itemsize, 1))
+        self._set(shm, np.ndarray((length,), dtype=RESULT_DTYPE, buffer=shm.buf), {}, owner=True)
+        start = 0
+        for key, history in histories.items():
+            end = start + len(history)
+            self.records[start:end] = history.records
+            self.layout[key] = (start, end, history.surfaces, history.events, history.opponents)
+            start = end
+
+    def _set(self, shm, records, layout, owner):
+        # Records first, so they are released before the block when this is collected
+        self.records = records
+        self.layout = layout
+        self.name = shm.name
+        self._shm = shm
+        self._owner = owner
+
+    def __len__(self):
+        return len(self.layout)
+
+    def __contains__(self, key):
+        return key in self.layout
+
+    def __getitem__(self, key):
+        """The key's history, a view of the shared records valid until the block is closed"""
+        start, end, surfaces, events, opponents = self.layout[key]
+        return ResultHistory(self.records[start:end], surfaces, events, opponents)
+
+    def close(self):
+        """Unmap the block, and unlink it if this process packed it"""
+        if self._shm is None:
+            return
+        shm, self._shm, self.records = self._shm, None, None
+        try:
+            shm.close()
+        except BufferError:
+            # Histories taken from the block are still alive, they keep the mapping until they go
+            pass
+        if self._owner:
+            shm.unlink()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def __reduce__(self):
+        if self._shm is None:
+            raise ValueError("Can't send closed SharedResults to another process")
+        return _attach, (self.name, len(self.records), self.layout)
+
+# SharedResults attached in this process by block name, so every task sent the same block maps it once
+_attached = {}
+
+def _attach(name, length, layout):
+    """Map a SharedResults block in a worker, once per process"""
+    shared = _attached.get(name)
+    if shared is None:
+        shared = SharedResults.__new__(SharedResults)
+        shm = shared_memory.SharedMemory(name=name)
+        shared._set(shm, np.ndarray((length,), dtype=RESULT_DTYPE, buffer=shm.buf), layout, owner=False)
+        _attached[name] = shared
+    return shared
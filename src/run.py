@@ -1,39 +1,66 @@
-import pandas as pd
-from tqdm import tqdm
+import numpy as np
 from datetime import date
-from manip import PlayerServeReturnStats
 from mdp import get_match_prob
+from model import combine_serve_return, get_model_config
+from tracing import span, traced
 from util import get_american_odds
 
-def predict_match(player1_first, player1_last, player2_first, player2_last, current_tournament, num_weeks=-1, match_date=None):
-    player1_stats = PlayerServeReturnStats(player1_first, player1_last, num_weeks, current_tournament)
-    player2_stats = PlayerServeReturnStats(player2_first, player2_last, num_weeks, current_tournament)
-    
-    elo_table = player1_stats.get_adjusted_elo()
-    player1_avg_elo = elo_table.loc[elo_table["Player"] == f"{player1_first} {player1_last}", "Average Elo"].values[0]
-    player2_avg_elo = elo_table.loc[elo_table["Player"] == f"{player2_first} {player2_last}", "Average Elo"].values[0]
-    elo_diff = player1_avg_elo - player2_avg_elo
-    
-    win_probability = 1 / (1 + 10 ** (-elo_diff / 400))
-    
-    min_weight = 0.25
-    max_weight = 0.75
-    weight_range = max_weight - min_weight
+def _describe_player(first_name, last_name, *args, **kwargs):
+    return {"player": f"{first_name} {last_name}"}
+
+def _describe_match(player1_first, player1_last, player2_first, player2_last, current_tournament, *args, **kwargs):
+    return {"match": f"{player1_first} {player1_last} vs {player2_first} {player2_last}", "tournament": current_tournament}
+
+@traced(describe=_describe_player)
+def load_player_stats(first_name, last_name, num_weeks, current_tournament, career=False, player_cache=None, config=None):
+    """
+    Build a PlayerServeReturnStats for a player, reusing already scraped results when a cache is given
+
+    :param career: load the full career results, needed to estimate from a past match date
+    :param player_cache: optional object with a get(first_name, last_name, num_weeks, current_tournament, career) method
+    :param config: optional model config overrides for newly built stats, see model.DEFAULT_MODEL_CONFIG, cached stats
+    are shared so pass the config to estimate_spw_rpw instead
+    :return: the player's PlayerServeReturnStats
+    """
+    if player_cache is None:
+        # manip pulls in pandas and the scrapers, only load them once stats are actually gathered
+        from manip import PlayerServeReturnStats
+
+        return PlayerServeReturnStats(first_name, last_name, num_weeks, current_tournament, career=career, config=config)
+    return player_cache.get(first_name, last_name, num_weeks, current_tournament, career)
+
+@traced(describe=_describe_match)
+def predict_match(player1_first, player1_last, player2_first, player2_last, current_tournament, num_weeks=-1, match_date=None, player_cache=None,
+                  config=None, best_of=3):
+    """
+    :param config: optional model config overrides, e.g. {"use_elo": False}, see model.DEFAULT_MODEL_CONFIG
+    :param best_of: the number of sets in the match
+    :return: each player's match win probability
+    """
+    config = get_model_config(config)
+    # gather_from_match_date reads all_history, which is only scraped for career stats
+    career = match_date is not None
+    player1_stats = load_player_stats(player1_first, player1_last, num_weeks, current_tournament, career, player_cache, config)
+    player2_stats = load_player_stats(player2_first, player2_last, num_weeks, current_tournament, career, player_cache, config)
     
-    # Player 1's weight is higher when they have higher win probability
-    player1_weight = min_weight + (win_probability * weight_range)
-    player2_weight = 1 - player1_weight
+    elo_diff = 0
+    if config["use_elo"]:
+        elo_table = player1_stats.get_adjusted_elo(as_of=match_date)
+        with span("elo_lookup", "run"):
+            player1_avg_elo = elo_table.loc[elo_table["Player"] == f"{player1_first} {player1_last}", "Average Elo"].values[0]
+            player2_avg_elo = elo_table.loc[elo_table["Player"] == f"{player2_first} {player2_last}", "Average Elo"].values[0]
+        elo_diff = player1_avg_elo - player2_avg_elo
 
-    player1_spw, player1_rpw = player1_stats.estimate_spw_rpw(match_date=match_date)
-    player2_spw, player2_rpw = player2_stats.estimate_spw_rpw(match_date=match_date)
+    player1_spw, player1_rpw = player1_stats.estimate_spw_rpw(match_date=match_date, config=config)
+    player2_spw, player2_rpw = player2_stats.estimate_spw_rpw(match_date=match_date, config=config)
     
-    # maybe adjust the way combined spw is calculated to take into account ranking difference
-    player1_combined_spw = (player1_weight * player1_spw) + ((1 - player1_weight) * (100 - player2_rpw))
-    player2_combined_spw = (player2_weight * player2_spw) + ((1 - player2_weight) * (100 - player1_rpw))
+    player1_combined_spw, player2_combined_spw = combine_serve_return(player1_spw, player1_rpw, player2_spw, player2_rpw, elo_diff,
+                                                                      config["min_weight"], config["max_weight"])
     
-    return get_match_prob(player1_combined_spw / 100, player2_combined_spw / 100)
+    return get_match_prob(player1_combined_spw / 100, player2_combined_spw / 100, best_of)
 
-def batch_predeiction(match_data, num_weeks=-1):
+@traced(describe=lambda match_data, *args, **kwargs: {"matches": len(match_data)})
+def batch_predeiction(match_data, num_weeks=-1, player_cache=None):
     """
     Batch process multiple matches through the predict_match function
     
@@ -44,11 +71,17 @@ def batch_predeiction(match_data, num_weeks=-1):
         
     num_weeks : int, default=-1
         Number of weeks of data to use
+
+    player_cache : optional object with a get(first_name, last_name, num_weeks, current_tournament, career) method
+        Passed through to predict_match
         
     Returns:
     --------
     pandas DataFrame with match predictions and player information
     """
+    import pandas as pd
+    from tqdm import tqdm
+
     if all(len(entry) == 5 for entry in match_data):
         columns = ['player1_first', 'player1_last', 'player2_first', 'player2_last', 'current_tournament']
         match_df = pd.DataFrame(match_data, columns=columns)
@@ -63,11 +96,14 @@ def batch_predeiction(match_data, num_weeks=-1):
     match_df['p2_win_prob'] = None
     
     def process_match(row):
-        p1_first, p1_last = row[0], row[1]
-        p2_first, p2_last = row[2], row[3]
-        current_tournament = row[4]
+        p1_first, p1_last = row.iloc[0], row.iloc[1]
+        p2_first, p2_last = row.iloc[2], row.iloc[3]
+        current_tournament = row.iloc[4]
         if len(row) > 5:
-            match_date = row[5]
+            match_date = row.iloc[5]
+        # The match_date column holds NaN rather than None for slates without dates
+        if pd.isna(match_date):
+            match_date = None
         
         attempts = 0
         max_attempts = 3
@@ -78,13 +114,14 @@ def batch_predeiction(match_data, num_weeks=-1):
                     p2_first, p2_last, 
                     current_tournament, 
                     num_weeks, 
-                    match_date)
+                    match_date,
+                    player_cache)
                 p1_win_prob = result[0]
                 p2_win_prob = result[1]
                 
                 return p1_win_prob, p2_win_prob
             except Exception as e:
-                if attempts == max_attempts:
+                if attempts + 1 == max_attempts:
                     print(f"FAILED AFTER {max_attempts} ATTEMPTS: {p1_first} {p1_last} vs {p2_first} {p2_last}: {str(e)}")
                     return None, None
                 else:
@@ -105,11 +142,12 @@ def batch_predeiction(match_data, num_weeks=-1):
             desc="Processing matches"
         ))
     """
-    for i, (p1_win_prob, p2_win_prob) in enumerate(results):
-        match_df.loc[i, 'p1_win_prob'] = p1_win_prob
-        match_df.loc[i, 'p2_win_prob'] = p2_win_prob
-        match_df.loc[i, 'p1_odds'] = get_american_odds(p1_win_prob)
-        match_df.loc[i, 'p2_odds'] = get_american_odds(p2_win_prob)
+    # Failed matches come back as (None, None), which become NaN probabilities and None odds
+    probabilities = np.array(results, dtype=np.float64).reshape(-1, 2)
+    match_df['p1_win_prob'] = probabilities[:, 0]
+    match_df['p2_win_prob'] = probabilities[:, 1]
+    match_df['p1_odds'] = get_american_odds(probabilities[:, 0])
+    match_df['p2_odds'] = get_american_odds(probabilities[:, 1])
     
     return match_df
 
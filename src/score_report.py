@@ -0,0 +1,71 @@
+import argparse
+import time
+import numpy as np
+import pandas as pd
+from history import DATA_DIR, LEVELS, level_files
+from util import UNPARSEABLE, COMPLETED, RETIRED, WALKOVER, DEFAULTED, ABANDONED, parse_scores, score_reader
+
+STATUS_NAMES = {
+    COMPLETED: "completed",
+    RETIRED: "retired",
+    WALKOVER: "walkover",
+    DEFAULTED: "defaulted",
+    ABANDONED: "abandoned",
+    UNPARSEABLE: "unparseable",
+}
+
+def load_score_column(data_dir=DATA_DIR, levels=None):
+    """
+    Collect every score string in data/atp_* with where it came from
+
+    :return: DataFrame with level, file, row and score columns
+    """
+    levels = list(LEVELS) if levels is None else levels
+    frames = []
+    for level in levels:
+        for year, path in level_files(data_dir, level):
+            scores = pd.read_csv(path, usecols=["score"], dtype={"score": str})["score"]
+            frames.append(pd.DataFrame({"level": level, "year": year, "row": np.arange(len(scores)), "score": scores}))
+    return pd.concat(frames, ignore_index=True)
+
+def benchmark_score_parsing(scores, repeat=3):
+    """
+    Time parse_scores on a score column against the per-string score_reader loop
+
+    :return: dict with the best time of each in seconds
+    """
+    batch_times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        parse_scores(scores)
+        batch_times.append(time.perf_counter() - start)
+    start = time.perf_counter()
+    for score in scores:
+        score_reader(score)
+    loop_time = time.perf_counter() - start
+    return {"batch": min(batch_times), "loop": loop_time}
+
+def main():
+    parser = argparse.ArgumentParser(description="Parse every score in data/atp_* and report the ones that fail")
+    parser.add_argument("--levels", nargs="*", default=None, choices=list(LEVELS))
+    parser.add_argument("--output", default=None, help="Write the unparseable rows to this csv")
+    args = parser.parse_args()
+
+    score_df = load_score_column(levels=args.levels)
+    scores = score_df["score"].to_numpy(dtype=object)
+    timings = benchmark_score_parsing(scores)
+    print(f"{len(scores)} scores ({len(pd.unique(scores))} distinct)")
+    print(f"parse_scores: {timings['batch']:.3f}s, score_reader loop: {timings['loop']:.3f}s")
+
+    parsed = parse_scores(scores)
+    status = pd.Series(parsed["status"]).map(STATUS_NAMES)
+    print(status.value_counts().to_string())
+
+    unparseable = score_df[(parsed["status"] == UNPARSEABLE) & score_df["score"].notna()]
+    print(f"\n{len(unparseable)} unparseable rows, most common:")
+    print(unparseable["score"].value_counts().head(20).to_string())
+    if args.output:
+        unparseable.to_csv(args.output, index=False)
+
+if __name__ == "__main__":
+    main()
@@ -3,12 +3,16 @@ import pandas as pd
 import time
 import re
 from typing import Literal
-from selenium import webdriver
-from bs4 import BeautifulSoup
+from tracing import traced
 from util import convert_to_space
 
 class DataScraper:
+    @traced(describe=lambda self, url: {"url": url})
     def scrape_html(self, url):
+        # selenium and bs4 are slow to import and only needed once a page is actually scraped
+        from selenium import webdriver
+        from bs4 import BeautifulSoup
+
         driver = webdriver.Chrome()
         driver.get(url)
         html_content = driver.page_source
@@ -29,6 +33,7 @@ class DataScraper:
                 
         return stat_rows, stat_headers
     
+    @traced()
     def get_surface_speed(self):
         serve_url = "https://tennisabstract.com/reports/atp_surface_speed.html"
         surface_rows, surface_headers = self.get_url_tables(serve_url)
@@ -38,6 +43,7 @@ class DataScraper:
         surface_df = surface_df.replace(["", " ", None], np.nan)
         return surface_df
     
+    @traced()
     def get_elo_data(self):
         elo_url = "https://tennisabstract.com/reports/atp_elo_ratings.html"
         y_elo_url = "https://tennisabstract.com/reports/atp_season_yelo_ratings.html"
@@ -74,17 +80,21 @@ class PlayerDataScraper(DataScraper):
         pid = re.search(r'p=(\d+)/', key_games_url).group(1)
         return str(pid)
     
+    @traced(describe=lambda self, table_name: {"player": f"{self.first_name} {self.last_name}", "table": table_name})
     def get_table_df(self, table_name: table_options):
         ### Gonna need to edit this so that it gets basic return stats from the recent matches table
-        def add_duplicate_suffix(series):
-            counts = series.value_counts()
-            return series.where(counts == 1, series + '_' + series.groupby(series).cumcount().add(1).astype(str))
-        
         if table_name not in ['recent_results_serve', 'recent_results_return', 'all_results_serve', 'all_results_return']:
             self.pid = self.get_pid()
         
         stat_url = self.player_stats_url.get_url(table_name)
-        stat_html = self.scrape_html(stat_url)
+        return self.parse_table_df(self.scrape_html(stat_url), table_name)
+
+    def parse_table_df(self, stat_html, table_name: table_options):
+        """The last table of a scraped page as a DataFrame, get_table_df without the browser"""
+        def add_duplicate_suffix(series):
+            counts = series.value_counts()
+            return series.where(counts == 1, series + '_' + series.groupby(series).cumcount().add(1).astype(str))
+
         stat_all_tables = stat_html.find_all("table")
         stat_table = stat_all_tables[-1]
         stat_headers = convert_to_space([th.text.strip() for th in stat_table.find_all("th")])
@@ -147,14 +157,7 @@ class PlayerDataScraper(DataScraper):
                 time.sleep(delay)
             except Exception as e:
                 print(f"Error retrieving {table_option}: {e}")
-        recent_results_serve = recent_results["recent_results_serve"]
-        recent_results_return = recent_results["recent_results_return"]
-        merged_df = recent_results_serve[["Match", "", "Date", "Surface", "vRk", "A%", "DF%", "1stIn", "1st%", "2nd%", "SPW"]].merge(
-            recent_results_return[["Match", "vA%", "v1st%", "v2nd%", "RPW"]], on="Match", how="outer")
-        merged_df.rename(columns={'': 'Scoreline'}, inplace=True)
-        merged_df["Date"] = merged_df["Date"].str.replace(r"[^\x00-\x7F]+", "-", regex=True)  # Normalize hyphens
-        merged_df["Date"] = pd.to_datetime(merged_df["Date"], format="%d-%b-%Y")
-        return merged_df.sort_values(by="Date", ascending=False)
+        return self.merge_results(recent_results["recent_results_serve"], recent_results["recent_results_return"])
     
     def get_all_results(self, delay=5):
         all_results = {}
@@ -165,12 +168,15 @@ class PlayerDataScraper(DataScraper):
                 time.sleep(delay)
             except Exception as e:
                 print(f"Error retrieving {table_option}: {e}")
-        all_results_serve = all_results["all_results_serve"]
-        all_results_return = all_results["all_results_return"]
-        merged_df = all_results_serve[["Match", "", "Date", "Surface", "vRk", "A%", "DF%", "1stIn", "1st%", "2nd%", "SPW"]].merge(
-            all_results_return[["Match", "vA%", "v1st%", "v2nd%", "RPW"]], on="Match", how="outer")
+        return self.merge_results(all_results["all_results_serve"], all_results["all_results_return"])
+
+    @staticmethod
+    def merge_results(results_serve, results_return):
+        """One row per match from the serve and return results tables, newest first"""
+        merged_df = results_serve[["Match", "", "Date", "Surface", "vRk", "A%", "DF%", "1stIn", "1st%", "2nd%", "SPW"]].merge(
+            results_return[["Match", "vA%", "v1st%", "v2nd%", "RPW"]], on="Match", how="outer")
         merged_df.rename(columns={'': 'Scoreline'}, inplace=True)
-        merged_df["Date"] = merged_df["Date"].str.replace(r"[^\x00-\x7F]+", "-", regex=True)
+        merged_df["Date"] = merged_df["Date"].str.replace(r"[^\x00-\x7F]+", "-", regex=True)  # Normalize hyphens
         merged_df["Date"] = pd.to_datetime(merged_df["Date"], format="%d-%b-%Y")
         return merged_df.sort_values(by="Date", ascending=False)
     
@@ -0,0 +1,281 @@
+import argparse
+import collections
+import contextlib
+import copy
+import json
+import os
+import socket
+import socketserver
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from manip import PlayerServeReturnStats, TennisDataScraper
+from run import predict_match
+from util import get_american_odds
+
+class PlayerStatsCache:
+    """
+    Keeps recently used players' scraped results warm so repeat requests skip the browser
+
+    Holds at most max_players players, dropping the least recently used first, and drops
+    entries older than the ttl whenever a new player is stored.
+    """
+
+    def __init__(self, ttl=6 * 60 * 60, max_players=512):
+        self.ttl = ttl
+        self.max_players = max_players
+        self._entries = collections.OrderedDict()
+        # key -> [lock, number of threads holding or waiting for it]
+        self._key_locks = {}
+        self._lock = threading.Lock()
+
+    @contextlib.contextmanager
+    def _key_lock(self, key):
+        """Hold a player's lock, which lives while any thread holds or waits for it"""
+        with self._lock:
+            key_lock = self._key_locks.setdefault(key, [threading.Lock(), 0])
+            key_lock[1] += 1
+        try:
+            with key_lock[0]:
+                yield
+        finally:
+            with self._lock:
+                key_lock[1] -= 1
+                if not key_lock[1]:
+                    del self._key_locks[key]
+
+    def _store(self, key, stats):
+        now = time.monotonic()
+        entry = (now, stats)
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            for expired in [key for key, (loaded, _) in self._entries.items() if now - loaded > self.ttl]:
+                del self._entries[expired]
+            while len(self._entries) > self.max_players:
+                self._entries.popitem(last=False)
+        return entry
+
+    def get(self, first_name, last_name, num_weeks, current_tournament, career=False):
+        """
+        Get a player's stats for the given window and tournament, scraping only on a miss or after the ttl
+
+        :param career: load the full career results, needed to estimate from a past match date
+        :return: a PlayerServeReturnStats sharing the cached scraped results
+        """
+        key = (first_name, last_name, career)
+        # One scrape per player at a time, concurrent requests for the same player wait for it
+        with self._key_lock(key):
+            with self._lock:
+                entry = self._entries.get(key)
+                if entry is not None and time.monotonic() - entry[0] <= self.ttl:
+                    self._entries.move_to_end(key)
+                else:
+                    entry = None
+            if entry is None:
+                stats = PlayerServeReturnStats(first_name, last_name, num_weeks, current_tournament, career=career)
+                entry = self._store(key, stats)
+        player_stats = copy.copy(entry[1])
+        player_stats.num_weeks = num_weeks
+        player_stats.current_tournament = current_tournament
+        return player_stats
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+class PredictionService:
+    """Long-running match pricer holding the shared data, player cache and a background refresher"""
+
+    MATCH_FIELDS = ["player1_first", "player1_last", "player2_first", "player2_last", "current_tournament"]
+
+    def __init__(self, num_weeks=-1, refresh_interval=6 * 60 * 60, player_ttl=6 * 60 * 60, max_players=512):
+        self.num_weeks = num_weeks
+        self.refresh_interval = refresh_interval
+        self.player_cache = PlayerStatsCache(ttl=player_ttl, max_players=max_players)
+        self.last_refresh = None
+        self._stop = threading.Event()
+        self._refresher = None
+
+    def warm_up(self):
+        """Load the shared surface and ELO tables before the first request arrives"""
+        TennisDataScraper._ensure_data_initialized()
+        TennisDataScraper().get_adjusted_elo()
+        self.last_refresh = time.time()
+
+    def refresh(self):
+        """Reload the surface and ELO snapshots, keeping the current ones if the scrape fails"""
+        if TennisDataScraper.refresh_shared_data():
+            TennisDataScraper().get_adjusted_elo()
+            self.last_refresh = time.time()
+            return True
+        return False
+
+    def _refresh_loop(self):
+        while not self._stop.wait(self.refresh_interval):
+            print("Refreshing surface speed and ELO snapshots...")
+            self.refresh()
+
+    def start_refresher(self):
+        if self.refresh_interval and self.refresh_interval > 0:
+            self._refresher = threading.Thread(target=self._refresh_loop, name="elo-refresher", daemon=True)
+            self._refresher.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def predict(self, match):
+        """
+        Price a single match
+
+        :param match: dict with player1_first, player1_last, player2_first, player2_last, current_tournament
+        and optionally num_weeks and match_date
+        :return: dict with both players' win probabilities and American odds
+        """
+        missing = [field for field in self.MATCH_FIELDS if not match.get(field)]
+        if missing:
+            raise ValueError(f"Missing match fields: {', '.join(missing)}")
+        num_weeks = int(match.get("num_weeks", self.num_weeks))
+        match_date = match.get("match_date")
+        if match_date is not None:
+            import pandas as pd
+            try:
+                match_date = pd.Timestamp(match_date)
+            except ValueError as e:
+                raise ValueError(f"Invalid match_date {match_date!r}: {e}") from e
+        p1_win_prob, p2_win_prob = predict_match(
+            match["player1_first"], match["player1_last"],
+            match["player2_first"], match["player2_last"],
+            match["current_tournament"],
+            num_weeks,
+            match_date,
+            player_cache=self.player_cache)
+        result = {field: match[field] for field in self.MATCH_FIELDS}
+        result["p1_win_prob"] = float(p1_win_prob)
+        result["p2_win_prob"] = float(p2_win_prob)
+        result["p1_odds"] = get_american_odds(p1_win_prob)
+        result["p2_odds"] = get_american_odds(p2_win_prob)
+        return result
+
+    def predict_batch(self, matches):
+        """Price a list of matches, reporting per-match errors instead of failing the whole batch"""
+        results = []
+        for match in matches:
+            try:
+                results.append(self.predict(match))
+            except Exception as e:
+                results.append({"error": str(e), "match": match})
+        return results
+
+    def health(self):
+        return {
+            "status": "ok",
+            "initialized": TennisDataScraper._shared_data["initialized"],
+            "last_refresh": self.last_refresh,
+            "cached_players": len(self.player_cache),
+        }
+
+class PredictionRequestHandler(BaseHTTPRequestHandler):
+    """
+    JSON API:
+        GET  /health          service status
+        POST /predict         a single match object
+        POST /predict/batch   {"matches": [match, ...]} or a bare list of matches
+        POST /refresh         reload ELO and surface snapshots now
+    """
+    service = None
+
+    def address_string(self):
+        # Unix socket peers have no host/port
+        if isinstance(self.client_address, tuple) and self.client_address:
+            return str(self.client_address[0])
+        return "unix"
+
+    def _send_json(self, status, payload):
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _read_json(self):
+        length = int(self.headers.get("Content-Length", 0))
+        if length == 0:
+            return {}
+        return json.loads(self.rfile.read(length))
+
+    def do_GET(self):
+        if self.path == "/health":
+            self._send_json(200, self.service.health())
+        else:
+            self._send_json(404, {"error": f"Unknown path: {self.path}"})
+
+    def do_POST(self):
+        try:
+            payload = self._read_json()
+        except ValueError as e:
+            self._send_json(400, {"error": f"Invalid JSON: {e}"})
+            return
+        try:
+            if self.path == "/predict":
+                self._send_json(200, self.service.predict(payload))
+            elif self.path == "/predict/batch":
+                matches = payload.get("matches", []) if isinstance(payload, dict) else payload
+                self._send_json(200, {"results": self.service.predict_batch(matches)})
+            elif self.path == "/refresh":
+                self._send_json(200, {"refreshed": self.service.refresh()})
+            else:
+                self._send_json(404, {"error": f"Unknown path: {self.path}"})
+        except ValueError as e:
+            self._send_json(400, {"error": str(e)})
+        except Exception as e:
+            self._send_json(500, {"error": str(e)})
+
+class ThreadingUnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def server_bind(self):
+        if os.path.exists(self.server_address):
+            os.remove(self.server_address)
+        socketserver.UnixStreamServer.server_bind(self)
+        # HTTPServer normally sets these from the bound host/port
+        self.server_name = socket.gethostname()
+        self.server_port = 0
+
+def make_server(service, host="127.0.0.1", port=8765, socket_path=None):
+    handler = type("BoundPredictionRequestHandler", (PredictionRequestHandler,), {"service": service})
+    if socket_path is not None:
+        return ThreadingUnixHTTPServer(socket_path, handler)
+    return ThreadingHTTPServer((host, port), handler)
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve match predictions from a warm, long-running process")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--socket", dest="socket_path", default=None, help="Serve on a Unix socket instead of TCP")
+    parser.add_argument("--num-weeks", type=int, default=24)
+    parser.add_argument("--refresh-interval", type=float, default=6 * 60 * 60, help="Seconds between ELO/surface refreshes, 0 disables")
+    parser.add_argument("--player-ttl", type=float, default=6 * 60 * 60, help="Seconds before a player's results are re-scraped")
+    parser.add_argument("--max-players", type=int, default=512, help="Players kept warm, least recently used dropped first")
+    args = parser.parse_args()
+
+    service = PredictionService(num_weeks=args.num_weeks, refresh_interval=args.refresh_interval, player_ttl=args.player_ttl,
+                                max_players=args.max_players)
+    service.warm_up()
+    service.start_refresher()
+    server = make_server(service, args.host, args.port, args.socket_path)
+    print(f"Serving predictions on {args.socket_path or f'http://{args.host}:{args.port}'}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        service.stop()
+        server.server_close()
+
+if __name__ == "__main__":
+    main()
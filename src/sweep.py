@@ -0,0 +1,209 @@
+import argparse
+import ast
+import csv
+import itertools
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pandas as pd
+from backtest import BACKTEST_DIR, ODDS_COLUMNS, STAKING_METHODS, evaluate_season, load_season, summarize_results
+from history import refresh_match_store
+from model import DEFAULT_MODEL_CONFIG, get_model_config
+from rankings import refresh_rankings_index
+
+SWEEP_DIR = os.path.join(BACKTEST_DIR, "sweeps")
+
+# Summary columns reported for every configuration
+METRICS = ["log_loss", "brier", "roi", "profit", "bets", "priced"]
+
+def parse_value(text):
+    """Parse a command line value as a python literal, falling back to the raw string"""
+    if text.lower() == "none":
+        return None
+    try:
+        return ast.literal_eval(text)
+    except (ValueError, SyntaxError):
+        return text
+
+def parse_assignments(assignments):
+    """
+    Parse "key=v1,v2,..." grid arguments, or "key=lo:hi" ranges for random search
+
+    :return: dict of key -> list of values, or key -> (lo, hi) for a range
+    """
+    space = {}
+    for assignment in assignments:
+        key, _, values = assignment.partition("=")
+        if ":" in values and "," not in values:
+            low, high = values.split(":")
+            space[key] = (float(low), float(high))
+        else:
+            space[key] = [parse_value(value) for value in values.split(",")]
+    return space
+
+def apply_overrides(overrides):
+    """
+    Build a full model config from flat overrides
+
+    Dotted keys reach into dict values, e.g. "fallback_speeds.Clay".
+    """
+    config = get_model_config()
+    for key, value in overrides.items():
+        name, _, sub_key = key.partition(".")
+        if name not in DEFAULT_MODEL_CONFIG:
+            raise ValueError(f"Unknown model config key: {name}")
+        if sub_key:
+            config[name] = dict(config[name], **{sub_key: value})
+        else:
+            config[name] = value
+    return config
+
+def expand_grid(grid):
+    """Every combination of a key -> values grid, as a list of flat override dicts"""
+    keys = list(grid)
+    return [dict(zip(keys, values)) for values in itertools.product(*(grid[key] for key in keys))]
+
+def sample_configs(space, num_configs, seed=0):
+    """
+    Random search over a space of key -> list of choices or (lo, hi) uniform range
+
+    :return: list of flat override dicts
+    """
+    rng = np.random.default_rng(seed)
+    configs = []
+    for _ in range(num_configs):
+        overrides = {}
+        for key, values in space.items():
+            if isinstance(values, tuple):
+                overrides[key] = float(rng.uniform(*values))
+            else:
+                overrides[key] = values[rng.integers(len(values))]
+        configs.append(overrides)
+    return configs
+
+# Per worker process: the seasons and a pricer whose caches persist across configurations
+_worker = {}
+
+def _init_worker(years, levels):
+    from features import PointInTimePricer
+
+    _worker["seasons"] = {year: load_season(year) for year in years}
+    _worker["pricer"] = PointInTimePricer(levels=levels)
+
+def evaluate_config(overrides, bookmaker="PS", staking="flat", min_edge=0.0, kelly_fraction=0.25, holdout_years=()):
+    """
+    Price every season of this worker under one configuration
+
+    :param overrides: flat config overrides, see apply_overrides
+    :param holdout_years: seasons left out of the total METRICS and summarized as test_ metrics instead
+    :return: dict of the overrides, the training seasons' total METRICS, the held out seasons' test_ METRICS and
+    each season's log_loss and roi
+    """
+    config = apply_overrides(overrides)
+    pricer = _worker["pricer"]
+    row = dict(overrides)
+    train, test = [], []
+    for year, season in _worker["seasons"].items():
+        results = evaluate_season(season, pricer.price(season, config), bookmaker, staking, min_edge, kelly_fraction)
+        summary = summarize_results(results)
+        row[f"{year}_log_loss"] = summary["log_loss"]
+        row[f"{year}_roi"] = summary["roi"]
+        (test if year in holdout_years else train).append(results)
+    summary = summarize_results(pd.concat(train, ignore_index=True))
+    row.update({metric: summary[metric] for metric in METRICS})
+    if test:
+        summary = summarize_results(pd.concat(test, ignore_index=True))
+        row.update({f"test_{metric}": summary[metric] for metric in METRICS})
+    return row
+
+def run_sweep(configs, years, bookmaker="PS", staking="flat", min_edge=0.0, kelly_fraction=0.25, workers=None,
+              levels=("singles", "challenger"), output=None, holdout_years=()):
+    """
+    Evaluate many model configurations on the backtest seasons
+
+    Configurations are ranked on the training seasons only, the held out seasons' test_ metrics
+    show how the best of them do on seasons the choice didn't see. Each worker loads the seasons, features and ELO once and keeps the pricer's per-season caches,
+    so configurations that only change cheap constants reuse the expensive intermediate arrays.
+    Rows are appended to output as they finish so a long sweep can be inspected while it runs.
+
+    :param configs: list of flat override dicts, from expand_grid or sample_configs
+    :param workers: number of processes, 1 runs in this process
+    :param output: optional csv path to stream rows to
+    :param holdout_years: seasons priced under every configuration but kept out of the ranking
+    :return: DataFrame with one row per configuration, best training log-loss first
+    """
+    holdout_years = tuple(sorted(set(holdout_years)))
+    if not set(years) - set(holdout_years):
+        raise ValueError("Every season is held out, nothing is left to rank configurations on")
+    years = sorted(set(years) | set(holdout_years))
+    workers = (os.cpu_count() or 1) if workers is None else workers
+    arguments = ([bookmaker] * len(configs), [staking] * len(configs), [min_edge] * len(configs), [kelly_fraction] * len(configs),
+                 [holdout_years] * len(configs))
+    rows = []
+    writer = None
+    output_file = None
+    if output:
+        os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+        output_file = open(output, "w", newline="")
+    try:
+        if workers <= 1:
+            _init_worker(years, levels)
+            results = map(evaluate_config, configs, *arguments)
+            executor = None
+        else:
+            # Rebuild stale match stores and the rankings index once here rather than in every worker
+            refresh_match_store(levels)
+            refresh_rankings_index()
+            executor = ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(years, levels))
+            results = executor.map(evaluate_config, configs, *arguments, chunksize=max(1, len(configs) // (workers * 16)))
+        for row in results:
+            rows.append(row)
+            if output_file is not None:
+                if writer is None:
+                    writer = csv.DictWriter(output_file, fieldnames=list(row))
+                    writer.writeheader()
+                writer.writerow(row)
+                output_file.flush()
+        if executor is not None:
+            executor.shutdown()
+    finally:
+        if output_file is not None:
+            output_file.close()
+    return pd.DataFrame(rows).sort_values("log_loss", kind="stable").reset_index(drop=True)
+
+def main():
+    parser = argparse.ArgumentParser(description="Sweep model constants and toggles over the backtest seasons")
+    parser.add_argument("--grid", nargs="*", default=[], help='Grid values, e.g. min_weight=0.2,0.25,0.3 use_elo=True,False')
+    parser.add_argument("--random", type=int, default=0, help="Sample this many configs instead of the full grid")
+    parser.add_argument("--range", nargs="*", default=[], help="Uniform ranges for random search, e.g. max_weight=0.6:0.9")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--years", nargs="*", type=int, default=list(range(2021, 2026)))
+    parser.add_argument("--holdout-years", nargs="*", type=int, default=[],
+                        help="Seasons reported as test_ metrics but not used to rank configs, e.g. the last one")
+    parser.add_argument("--bookmaker", default="PS", choices=list(ODDS_COLUMNS))
+    parser.add_argument("--staking", default="flat", choices=STAKING_METHODS)
+    parser.add_argument("--min-edge", type=float, default=0.0)
+    parser.add_argument("--kelly-fraction", type=float, default=0.25)
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--output", default=None, help=f"csv to stream results to, defaults to a timestamped file in {SWEEP_DIR}")
+    parser.add_argument("--top", type=int, default=20)
+    args = parser.parse_args()
+
+    space = parse_assignments(args.grid + args.range)
+    if args.random:
+        configs = sample_configs(space, args.random, args.seed)
+    else:
+        if any(isinstance(values, tuple) for values in space.values()):
+            parser.error("Ranges need --random")
+        configs = expand_grid(space)
+    output = args.output or os.path.join(SWEEP_DIR, f"sweep_{time.strftime('%Y%m%d_%H%M%S')}.csv")
+
+    start = time.perf_counter()
+    results = run_sweep(configs, args.years, args.bookmaker, args.staking, args.min_edge, args.kelly_fraction, args.workers,
+                        output=output, holdout_years=args.holdout_years)
+    print(results.head(args.top).to_string(index=False))
+    print(f"Evaluated {len(configs)} configs in {time.perf_counter() - start:.1f}s, results in {output}")
+
+if __name__ == "__main__":
+    main()
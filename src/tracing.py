@@ -0,0 +1,275 @@
+import atexit
+import contextlib
+import functools
+import itertools
+import json
+import os
+import random
+import threading
+import time
+
+SPEEDSCOPE_SCHEMA = "https://www.speedscope.app/file-format-schema.json"
+
+class Span:
+    """One timed stage, times in nanoseconds with start relative to the tracer's origin"""
+    __slots__ = ("span_id", "parent_id", "name", "category", "args", "thread_id", "depth", "start", "wall", "cpu")
+
+    def __init__(self, span_id, parent_id, name, category, args, thread_id, depth, start, wall, cpu):
+        self.span_id = span_id
+        self.parent_id = parent_id
+        self.name = name
+        self.category = category
+        self.args = args
+        self.thread_id = thread_id
+        self.depth = depth
+        self.start = start
+        self.wall = wall
+        self.cpu = cpu
+
+class _ActiveSpan:
+    __slots__ = ("tracer", "name", "category", "args", "span_id", "stack", "start", "cpu_start")
+
+    def __init__(self, tracer, name, category, args):
+        self.tracer = tracer
+        self.name = name
+        self.category = category
+        self.args = args
+
+    def __enter__(self):
+        stack = self.tracer._stack()
+        if stack:
+            # Children follow their root's sampling decision
+            self.span_id = next(self.tracer._ids) if stack[-1] is not None else None
+        else:
+            self.span_id = next(self.tracer._ids) if self.tracer._sample() else None
+        stack.append(self.span_id)
+        self.stack = stack
+        if self.span_id is not None:
+            self.cpu_start = time.thread_time_ns()
+            self.start = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if self.span_id is not None:
+            wall = time.perf_counter_ns() - self.start
+            cpu = time.thread_time_ns() - self.cpu_start
+        self.stack.pop()
+        if self.span_id is None:
+            return False
+        args = self.args
+        if exc_type is not None:
+            args = dict(args, error=exc_type.__name__)
+        parent_id = self.stack[-1] if self.stack else None
+        self.tracer._record(Span(self.span_id, parent_id, self.name, self.category, args, threading.get_ident(),
+                                 len(self.stack), self.start - self.tracer.origin, wall, cpu))
+        return False
+
+class Tracer:
+    """
+    Records a tree of spans per thread with wall and CPU time
+
+    :param sample_rate: fraction of root spans recorded with their whole subtree, an unsampled
+    tree only pushes and pops a marker per span
+    :param max_spans: spans kept before new ones are counted in dropped instead
+    """
+
+    def __init__(self, sample_rate=1.0, max_spans=1000000, seed=None):
+        self.sample_rate = sample_rate
+        self.max_spans = max_spans
+        self.spans = []
+        self.dropped = 0
+        self.origin = time.perf_counter_ns()
+        self._ids = itertools.count(1)
+        self._local = threading.local()
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def _stack(self):
+        stack = getattr(self._local, "stack", None)
+        if stack is None:
+            stack = self._local.stack = []
+        return stack
+
+    def _sample(self):
+        return self.sample_rate >= 1 or self._random.random() < self.sample_rate
+
+    def _record(self, span):
+        with self._lock:
+            if len(self.spans) < self.max_spans:
+                self.spans.append(span)
+            else:
+                self.dropped += 1
+
+    def span(self, name, category="", args=None):
+        return _ActiveSpan(self, name, category, args or {})
+
+    def summary(self):
+        """
+        Aggregate the spans by name
+
+        :return: list of dicts with name, count, wall_ms, cpu_ms and self_ms (wall time not
+        spent in child spans), most wall time first
+        """
+        child_wall = {}
+        for span in self.spans:
+            if span.parent_id is not None:
+                child_wall[span.parent_id] = child_wall.get(span.parent_id, 0) + span.wall
+        totals = {}
+        for span in self.spans:
+            total = totals.setdefault(span.name, {"name": span.name, "count": 0, "wall_ms": 0.0, "cpu_ms": 0.0, "self_ms": 0.0})
+            total["count"] += 1
+            total["wall_ms"] += span.wall / 1e6
+            total["cpu_ms"] += span.cpu / 1e6
+            total["self_ms"] += (span.wall - child_wall.get(span.span_id, 0)) / 1e6
+        return sorted(totals.values(), key=lambda total: total["wall_ms"], reverse=True)
+
+    def format_summary(self):
+        lines = [f"{'span':<40} {'count':>7} {'wall ms':>11} {'cpu ms':>11} {'self ms':>11}"]
+        for total in self.summary():
+            lines.append(f"{total['name']:<40} {total['count']:>7} {total['wall_ms']:>11.2f} {total['cpu_ms']:>11.2f} {total['self_ms']:>11.2f}")
+        if self.dropped:
+            lines.append(f"{self.dropped} spans dropped past max_spans={self.max_spans}")
+        return "\n".join(lines)
+
+    def to_chrome_trace(self):
+        """The spans as Chrome trace complete events, CPU time and the span's args under args"""
+        events = []
+        for span in sorted(self.spans, key=lambda span: (span.thread_id, span.start, span.depth)):
+            events.append({
+                "name": span.name,
+                "cat": span.category,
+                "ph": "X",
+                "ts": span.start / 1e3,
+                "dur": span.wall / 1e3,
+                "pid": os.getpid(),
+                "tid": span.thread_id,
+                "args": dict(span.args, cpu_ms=span.cpu / 1e6),
+            })
+        return {"traceEvents": events, "displayTimeUnit": "ms", "otherData": {"dropped_spans": self.dropped}}
+
+    def to_speedscope(self, name="tennis_model"):
+        """The spans as a speedscope file with one evented wall time profile per thread"""
+        frames = {}
+        profiles = []
+        for thread_id in sorted({span.thread_id for span in self.spans}):
+            events = []
+            for span in self.spans:
+                if span.thread_id != thread_id:
+                    continue
+                frame = frames.setdefault(span.name, len(frames))
+                # At equal times, closes come before opens, outer spans open first and close last
+                events.append((span.start, 1, span.depth, "O", frame))
+                events.append((span.start + span.wall, 0, -span.depth, "C", frame))
+            events.sort()
+            profiles.append({
+                "type": "evented",
+                "name": f"{name} thread {thread_id}",
+                "unit": "nanoseconds",
+                "startValue": events[0][0],
+                "endValue": events[-1][0],
+                "events": [{"type": event_type, "frame": frame, "at": at} for at, _, _, event_type, frame in events],
+            })
+        return {
+            "$schema": SPEEDSCOPE_SCHEMA,
+            "name": name,
+            "shared": {"frames": [{"name": frame_name} for frame_name in frames]},
+            "profiles": profiles,
+        }
+
+    def save(self, path, fmt=None):
+        """
+        Write the trace as JSON
+
+        :param fmt: "chrome" or "speedscope", by default speedscope for .speedscope.json paths
+        """
+        if fmt is None:
+            fmt = "speedscope" if path.endswith(".speedscope.json") else "chrome"
+        if fmt not in ("chrome", "speedscope"):
+            raise ValueError(f"Unknown trace format: {fmt}")
+        trace = self.to_speedscope() if fmt == "speedscope" else self.to_chrome_trace()
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        with open(path, "w") as f:
+            json.dump(trace, f, default=str)
+        return path
+
+_tracer = None
+_null_span = contextlib.nullcontext()
+
+def get_tracer():
+    """The active Tracer, None when tracing is off"""
+    return _tracer
+
+def start_tracing(sample_rate=1.0, max_spans=1000000, seed=None):
+    global _tracer
+    _tracer = Tracer(sample_rate, max_spans, seed)
+    return _tracer
+
+def stop_tracing():
+    """Turn tracing off and return the Tracer that was recording"""
+    global _tracer
+    tracer, _tracer = _tracer, None
+    return tracer
+
+@contextlib.contextmanager
+def tracing(path=None, sample_rate=1.0, fmt=None):
+    """
+    Trace the body of a with block, writing the trace to path on exit if given
+
+    Paths ending in .speedscope.json are written for speedscope, anything else as a Chrome
+    trace for chrome://tracing or Perfetto.
+    """
+    tracer = start_tracing(sample_rate)
+    try:
+        yield tracer
+    finally:
+        stop_tracing()
+        if path:
+            tracer.save(path, fmt)
+
+def span(name, category="", **args):
+    """
+    Context manager timing a stage when tracing is on
+
+    :param args: extra values shown with the span, e.g. player="Jannik Sinner"
+    """
+    tracer = _tracer
+    if tracer is None:
+        return _null_span
+    return tracer.span(name, category, args)
+
+def traced(name=None, category=None, describe=None):
+    """
+    Decorator timing every call of a function when tracing is on
+
+    :param name: span name, defaults to the function's qualified name
+    :param category: defaults to the function's module
+    :param describe: optional function of the call's arguments returning the span's args dict
+    """
+    def decorator(function):
+        span_name = name or function.__qualname__
+        span_category = category or function.__module__
+
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            tracer = _tracer
+            if tracer is None:
+                return function(*args, **kwargs)
+            with tracer.span(span_name, span_category, describe(*args, **kwargs) if describe else None):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorator
+
+def _start_from_environment():
+    """Trace the whole process when TENNIS_TRACE is set to an output path, "{pid}" becoming the process id"""
+    path = os.environ.get("TENNIS_TRACE")
+    if not path:
+        return
+    tracer = start_tracing(float(os.environ.get("TENNIS_TRACE_SAMPLE", 1.0)))
+
+    def save():
+        if tracer.spans:
+            tracer.save(path.replace("{pid}", str(os.getpid())))
+    atexit.register(save)
+
+_start_from_environment()
@@ -1,3 +1,7 @@
+import re
+from collections import namedtuple
+import numpy as np
+
 def convert_to_space(heading_list):
     cleaned_list = []
     for heading in heading_list:
@@ -5,49 +9,320 @@ def convert_to_space(heading_list):
         cleaned_list.append(cleaned_str)
     return cleaned_list
 
+def compress_name(name):
+    """Remove all spaces after the first, as Tennis Abstract's ELO tables name players"""
+    parts = name.split()
+    if len(parts) > 2:
+        return parts[0] + ' ' + ''.join(parts[1:])
+    return name
+
 ### Score Reader
-def score_reader(score):
+COMPLETED = 0
+RETIRED = 1
+WALKOVER = 2
+DEFAULTED = 3
+ABANDONED = 4
+UNPARSEABLE = -1
+
+MAX_SETS = 5
+
+# Set tokens: "6-4", "7-6(5)", "13-11", "7-6(10)" and bracketed match tiebreaks "[10-8]"
+SET_TOKEN_PATTERN = re.compile(r"^(?:(\d{1,2})-(\d{1,2})(?:\((\d{1,2})\))?|\[(\d{1,2})-(\d{1,2})\])$")
+# Match endings, matched case-insensitively against the text after the last set
+STATUS_PATTERNS = [
+    (re.compile(r"^(?:RET|RE|RET\.)$", re.IGNORECASE), RETIRED),
+    (re.compile(r"^(?:W/O|WO|WALKOVER)$", re.IGNORECASE), WALKOVER),
+    (re.compile(r"^(?:DEF|DEF\.|DEFAULT)$", re.IGNORECASE), DEFAULTED),
+    (re.compile(r"^(?:ABD|ABN|PLAYED AND (?:ABANDONED|UNFINISHED))$", re.IGNORECASE), ABANDONED),
+]
+
+class SetScore(namedtuple("SetScore", ["w_games", "l_games", "tiebreak_points", "match_tiebreak"], defaults=(None, False))):
+    """One set from the winner's perspective, tiebreak_points being the tiebreak loser's points"""
+    __slots__ = ()
+
+    @property
+    def is_tiebreak(self):
+        return self.match_tiebreak or self.tiebreak_points is not None or {self.w_games, self.l_games} == {6, 7}
+
+    @property
+    def winner(self):
+        """'w' or 'l' for the side that took the set, None if it was unfinished"""
+        if self.w_games == self.l_games:
+            return None
+        return 'w' if self.w_games > self.l_games else 'l'
+
+def parse_score(score):
+    """
+    Parse a score string into structured per-set results
+
+    Handles multi-digit games ("13-11", "10-8"), tiebreak points of any length ("7-6(10)"),
+    bracketed match tiebreaks ("[10-8]") and RET / W/O / DEF / abandoned endings.
+
+    :param score: a score string such as "6-7(10) 7-6(4) [10-8]"
+    :return: (tuple of SetScore, status) where status is one of COMPLETED, RETIRED, WALKOVER,
+    DEFAULTED, ABANDONED or UNPARSEABLE (with no sets)
+    """
+    if not isinstance(score, str):
+        return (), UNPARSEABLE
+    tokens = score.replace("\xa0", " ").replace("?", "").split()
+    sets = []
+    idx = 0
+    for idx, token in enumerate(tokens):
+        token_match = SET_TOKEN_PATTERN.match(token)
+        if token_match is None:
+            break
+        w_games, l_games, tiebreak, w_match_tb, l_match_tb = token_match.groups()
+        if w_match_tb is not None:
+            sets.append(SetScore(int(w_match_tb), int(l_match_tb), None, True))
+        else:
+            sets.append(SetScore(int(w_games), int(l_games), int(tiebreak) if tiebreak is not None else None))
+    else:
+        idx = len(tokens)
+    ending = " ".join(tokens[idx:])
+    if not ending:
+        status = COMPLETED if sets else UNPARSEABLE
+    else:
+        status = UNPARSEABLE
+        for pattern, ending_status in STATUS_PATTERNS:
+            if pattern.match(ending):
+                status = ending_status
+                break
+    if status == UNPARSEABLE or len(sets) > MAX_SETS:
+        return (), UNPARSEABLE
+    return tuple(sets), status
+
+def summarize_sets(sets, status=COMPLETED):
+    """
+    Total games, tiebreaks and sets of a parsed score
+
+    :param sets: the SetScore tuple returned by parse_score
+    :param status: the parse status, the last set of a retired/defaulted/abandoned match only
+    counts as a tiebreak if its tiebreak points were recorded
+    :return: w_games_won, l_games_won, tiebreaks, w_tiebreaks_won, l_tiebreaks_won, tiebreak_points
+    """
     w_games_won = 0
     l_games_won = 0
     w_tiebreaks_won = 0
     l_tiebreaks_won = 0
     tiebreaks = 0
     tiebreak_points = []
-    num_sets = 1
-
-    i = 1
-    for num in score[1:-1]:
-        if num == '-':
-            w_games_won += int(score[i-1])
-            l_games_won += int(score[i+1])
-        if num == '(':
+    for set_idx, set_score in enumerate(sets):
+        unfinished = status != COMPLETED and set_idx == len(sets) - 1
+        if set_score.match_tiebreak:
+            # A match tiebreak counts as a single game for whoever won it
+            w_games_won += set_score.winner == 'w'
+            l_games_won += set_score.winner == 'l'
+        else:
+            w_games_won += set_score.w_games
+            l_games_won += set_score.l_games
+        if unfinished and set_score.tiebreak_points is None:
+            continue
+        if set_score.is_tiebreak and set_score.winner is not None:
             tiebreaks += 1
-            if score[i-1] == '7':
+            if set_score.winner == 'w':
                 loser = 'l'
                 w_tiebreaks_won += 1
             else:
                 loser = 'w'
                 l_tiebreaks_won += 1
+            if set_score.match_tiebreak:
+                tiebreak_points.append(f"{loser} {min(set_score.w_games, set_score.l_games)}")
+            elif set_score.tiebreak_points is not None:
+                tiebreak_points.append(f"{loser} {set_score.tiebreak_points}")
+    return w_games_won, l_games_won, tiebreaks, w_tiebreaks_won, l_tiebreaks_won, tiebreak_points
 
-            tiebreak_points.append(f"{loser} {score[i+1]}")
-        if num == ' ':
-            num_sets += 1
-        i += 1
+def score_reader(score):
+    sets, status = parse_score(score)
+    w_games_won, l_games_won, tiebreaks, w_tiebreaks_won, l_tiebreaks_won, tiebreak_points = summarize_sets(sets, status)
     total_games = w_games_won + l_games_won
+    num_sets = max(len(sets), 1)
     return w_games_won, l_games_won, total_games, tiebreaks, w_tiebreaks_won, l_tiebreaks_won, tiebreak_points, num_sets
 
-def get_american_odds(win_percentage):
-    # Convert decimal odds to American odds
-    win_percentage = win_percentage * 100
-    decimal_odds = 100 / win_percentage
-    
-    if win_percentage <= 50:
-        # Underdog (positive odds)
-        american_odds = round((decimal_odds - 1) * 100)
-        return f"+{american_odds}"
+def parse_scores(scores):
+    """
+    Parse a whole column of score strings into NumPy arrays from the winner's perspective
+
+    Each distinct score string is parsed once with parse_score, so a season of ~3000
+    matches costs a few hundred regex calls. Unparseable scores come back with
+    status UNPARSEABLE and zeroed counts rather than raising.
+
+    :param scores: iterable of score strings such as "7-6(5) 6-4"
+    :return: dict of arrays: w_games, l_games, total_games, tiebreaks, w_tiebreaks, l_tiebreaks,
+    num_sets and status of shape (n,), and set_w, set_l, set_tiebreak (loser's tiebreak points)
+    of shape (n, MAX_SETS) padded with -1, plus a match_tiebreak flag for bracketed final sets
+    """
+    # Hash-based factorize, cheaper than sorting the strings with np.unique
+    lookup = {}
+    inverse = np.fromiter(
+        (lookup.setdefault(score if isinstance(score, str) else "", len(lookup)) for score in scores),
+        dtype=np.int64)
+    unique_scores = list(lookup)
+    counts = np.zeros((len(unique_scores), 7), dtype=np.int32)
+    set_scores = np.full((len(unique_scores), 3, MAX_SETS), -1, dtype=np.int16)
+    match_tiebreak = np.zeros(len(unique_scores), dtype=bool)
+    for idx, score in enumerate(unique_scores):
+        sets, status = parse_score(score)
+        w_games, l_games, tiebreaks, w_tiebreaks, l_tiebreaks, _ = summarize_sets(sets, status)
+        counts[idx] = (w_games, l_games, tiebreaks, w_tiebreaks, l_tiebreaks, len(sets), status)
+        for set_idx, set_score in enumerate(sets):
+            set_scores[idx, 0, set_idx] = set_score.w_games
+            set_scores[idx, 1, set_idx] = set_score.l_games
+            if set_score.tiebreak_points is not None:
+                set_scores[idx, 2, set_idx] = set_score.tiebreak_points
+            match_tiebreak[idx] |= set_score.match_tiebreak
+    counts = counts[inverse]
+    set_scores = set_scores[inverse]
+    return {
+        "w_games": counts[:, 0],
+        "l_games": counts[:, 1],
+        "total_games": counts[:, 0] + counts[:, 1],
+        "tiebreaks": counts[:, 2],
+        "w_tiebreaks": counts[:, 3],
+        "l_tiebreaks": counts[:, 4],
+        "num_sets": counts[:, 5],
+        "status": counts[:, 6].astype(np.int8),
+        "set_w": set_scores[:, 0],
+        "set_l": set_scores[:, 1],
+        "set_tiebreak": set_scores[:, 2],
+        "match_tiebreak": match_tiebreak[inverse],
+    }
+
+### Odds
+# Displayed American odds are capped here, so a 0% or 100% probability still has a price
+AMERICAN_ODDS_LIMIT = 10000
+
+MARGIN_METHODS = ["multiplicative", "shin", "power"]
+
+def prob_to_decimal(probabilities):
+    """Fair decimal odds of win probabilities in [0, 1], inf at 0 and NaN where unknown"""
+    probabilities = np.asarray(probabilities, dtype=np.float64)
+    with np.errstate(divide="ignore"):
+        return np.where((probabilities >= 0) & (probabilities <= 1), 1 / probabilities, np.nan)
+
+def decimal_to_prob(decimal_odds):
+    """Implied probabilities of decimal odds, NaN for odds below 1"""
+    decimal_odds = np.asarray(decimal_odds, dtype=np.float64)
+    return np.where(decimal_odds >= 1, 1 / decimal_odds, np.nan)
+
+def decimal_to_american(decimal_odds):
+    """
+    American odds of decimal odds, positive from 2.0 up and negative below
+
+    :return: float array, -inf for decimal odds of 1 and NaN for odds below 1
+    """
+    decimal_odds = np.asarray(decimal_odds, dtype=np.float64)
+    profit = decimal_odds - 1
+    with np.errstate(divide="ignore"):
+        american = np.where(decimal_odds >= 2, 100 * profit, -100 / profit)
+    return np.where(decimal_odds >= 1, american, np.nan)
+
+def american_to_decimal(american_odds):
+    """Decimal odds of American odds, NaN for the undefined range strictly between -100 and +100"""
+    american_odds = np.asarray(american_odds, dtype=np.float64)
+    with np.errstate(divide="ignore"):
+        decimal_odds = np.where(american_odds > 0, 1 + american_odds / 100, 1 - 100 / american_odds)
+    return np.where(np.abs(american_odds) >= 100, decimal_odds, np.nan)
+
+def prob_to_american(probabilities):
+    return decimal_to_american(prob_to_decimal(probabilities))
+
+def american_to_prob(american_odds):
+    return decimal_to_prob(american_to_decimal(american_odds))
+
+def fractional_to_decimal(numerators, denominators):
+    return 1 + np.asarray(numerators, dtype=np.float64) / np.asarray(denominators, dtype=np.float64)
+
+def decimal_to_fractional(decimal_odds, max_denominator=100):
+    """
+    Fractional odds of decimal odds, the closest fraction with the smallest denominator
+
+    :param max_denominator: largest denominator tried, 100 covers every fraction bookmakers quote
+    :return: (numerators, denominators) int arrays, 0/1 where the odds are unknown
+    """
+    decimal_odds = np.asarray(decimal_odds, dtype=np.float64)
+    profit = np.nan_to_num(decimal_odds - 1, nan=0.0, posinf=0.0, neginf=0.0).clip(min=0)
+    denominators = np.arange(1, max_denominator + 1)
+    numerators = np.rint(profit[..., None] * denominators)
+    errors = np.abs(numerators / denominators - profit[..., None])
+    # argmin returns the first, and so smallest, denominator among equally close fractions
+    best = np.argmin(np.round(errors, 12), axis=-1)
+    numerators = np.take_along_axis(numerators, best[..., None], axis=-1)[..., 0].astype(np.int64)
+    return numerators, denominators[best]
+
+def get_overround(decimal_odds):
+    """The bookmaker's book sum of implied probabilities, over the outcomes on the last axis"""
+    return decimal_to_prob(decimal_odds).sum(axis=-1)
+
+def _shin_probabilities(implied, z):
+    book = implied.sum(axis=-1, keepdims=True)
+    z = z[..., None]
+    return (np.sqrt(z ** 2 + 4 * (1 - z) * implied ** 2 / book) - z) / (2 * (1 - z))
+
+def remove_margin(decimal_odds, method="multiplicative", iterations=60):
+    """
+    Margin-free probabilities of a market's decimal odds
+
+    "multiplicative" scales the implied probabilities to sum to 1, "shin" solves Shin's insider
+    trading model for its insider share z, and "power" raises the implied probabilities to the
+    power k that makes them sum to 1. Shin and power move more of the margin onto longshots.
+    Both are solved for every market at once, by bisection on z and Newton's method on k.
+
+    :param decimal_odds: array of decimal odds with the market's outcomes on the last axis,
+    e.g. shape (matches, 2) for winner and loser odds
+    :param method: one of MARGIN_METHODS
+    :return: array of probabilities, the same shape, NaN for markets with unknown odds
+    """
+    if method not in MARGIN_METHODS:
+        raise ValueError(f"Unknown margin method: {method}, expected one of {MARGIN_METHODS}")
+    implied = decimal_to_prob(decimal_odds)
+    known = np.isfinite(implied).all(axis=-1)
+    implied = np.where(known[..., None], implied, 0.5)
+    if method == "multiplicative":
+        probabilities = implied / implied.sum(axis=-1, keepdims=True)
+    elif method == "shin":
+        # The probabilities sum to sqrt(book) >= 1 at z = 0 and fall below 1 as z approaches 1
+        low, high = np.zeros(implied.shape[:-1]), np.ones(implied.shape[:-1])
+        for _ in range(iterations):
+            z = (low + high) / 2
+            over = _shin_probabilities(implied, z).sum(axis=-1) > 1
+            low, high = np.where(over, z, low), np.where(over, high, z)
+        # A book without margin has no insider share to solve for, scale it like multiplicative
+        overround = implied.sum(axis=-1, keepdims=True) > 1
+        probabilities = np.where(overround, _shin_probabilities(implied, (low + high) / 2), implied / implied.sum(axis=-1, keepdims=True))
     else:
-        # Favorite (negative odds)
-        american_odds = round(100 / (decimal_odds - 1))
-        if american_odds == float('inf'):  # Handle 100% probability
-            return "-10000"  # Very high negative odds for near-certain events
-        return f"-{american_odds}"
\ No newline at end of file
+        # sum(implied ** k) is convex and decreasing in k, so Newton's method from k = 1 converges monotonically
+        k = np.ones(implied.shape[:-1])
+        log_implied = np.log(np.clip(implied, 1e-300, None))
+        for _ in range(iterations):
+            powered = implied ** k[..., None]
+            step = (powered.sum(axis=-1) - 1) / (powered * log_implied).sum(axis=-1)
+            k = k - np.where(np.isfinite(step), step, 0.0)
+        probabilities = implied ** k[..., None]
+    return np.where(known[..., None], probabilities, np.nan)
+
+def get_expected_value(probabilities, decimal_odds):
+    """Expected profit per unit staked of bets at decimal odds, NaN where either is unknown"""
+    return np.asarray(probabilities, dtype=np.float64) * np.asarray(decimal_odds, dtype=np.float64) - 1
+
+def get_edges(probabilities, decimal_odds, method="multiplicative"):
+    """
+    Model probability minus the margin-free market probability of every outcome
+
+    :param probabilities: model probabilities, shaped like decimal_odds
+    :param decimal_odds: decimal odds with the market's outcomes on the last axis
+    :return: array of probability edges
+    """
+    return np.asarray(probabilities, dtype=np.float64) - remove_margin(decimal_odds, method)
+
+def get_american_odds(win_percentage):
+    """
+    Fair American odds of a win probability, as displayed: "+150", "-200"
+
+    Prices are capped at AMERICAN_ODDS_LIMIT, so 0% and 100% are "+10000" and "-10000".
+
+    :param win_percentage: a probability in [0, 1] or an array of them
+    :return: string, or an array of strings for array input, None where the probability is unknown
+    """
+    american = np.rint(np.clip(prob_to_american(np.asarray(win_percentage, dtype=np.float64)), -AMERICAN_ODDS_LIMIT, AMERICAN_ODDS_LIMIT))
+    formatted = np.array([None if np.isnan(odds) else f"{odds:+.0f}" for odds in american.reshape(-1)], dtype=object)
+    return formatted.reshape(american.shape) if american.ndim else formatted[0]
@@ -0,0 +1,66 @@
+import numpy as np
+import pandas as pd
+import elo
+from elo import EloEngine
+from features import PointInTimeFeatures, PointInTimePricer, estimate_match_days, to_days
+
+def event_matches():
+    """An earlier event, then an event player 1 wins whose rounds the workbook lists two days after they are estimated"""
+    rows = []
+    for start, draw in [("2022-12-19", [("R16", 2, 1), ("QF", 2, 3)]),
+                        ("2023-01-02", [("R16", 1, 4), ("QF", 1, 2), ("SF", 1, 3), ("F", 1, 5)])]:
+        for round_name, winner, loser in draw:
+            rows.append({
+                "tourney_date": pd.Timestamp(start), "tourney_name": f"Event {start}", "tourney_level": "A", "surface": "Hard",
+                "round": round_name, "best_of": 3, "winner_id": 100 + winner, "loser_id": 100 + loser,
+                "winner_rank": 10.0, "loser_rank": 20.0,
+                "w_svpt": 80.0, "w_1stWon": 50.0, "w_2ndWon": 5.0, "l_svpt": 70.0, "l_1stWon": 35.0, "l_2ndWon": 5.0,
+                "score": "6-4 6-4",
+            })
+    matches = pd.DataFrame(rows)
+    days = estimate_match_days(matches["tourney_date"], matches["round"], matches["best_of"])
+    season = pd.DataFrame({"winner_id": matches["winner_id"], "loser_id": matches["loser_id"], "Surface": "Hard",
+                           "Date": (days + 2).astype("datetime64[D]")})
+    return matches, days, season
+
+def test_match_days_find_each_match():
+    matches, days, season = event_matches()
+    features = PointInTimeFeatures(matches=matches)
+    found = features.match_days(season["winner_id"].to_numpy(), season["loser_id"].to_numpy(), season["Date"].to_numpy())
+    np.testing.assert_array_equal(found, days)
+    # Matches missing from the history fall back to their date
+    missing = features.match_days([101, 999], [106, 101], season["Date"].to_numpy()[:2])
+    np.testing.assert_array_equal(missing, to_days(season["Date"].to_numpy()[:2]))
+
+def test_features_never_see_the_priced_match():
+    matches, days, season = event_matches()
+    pricer = PointInTimePricer()
+    pricer._features = features = PointInTimeFeatures(matches=matches)
+    player_ids, dates, _ = pricer._sides(season)
+    _, _, pairs, rows = features.window_rows(player_ids, dates, -1)
+    event_days = to_days(np.tile(matches["tourney_date"].to_numpy(), 2))
+    own_days = np.tile(days, 2)
+    # No row from the priced match's event on or after its own day
+    leaked = (features.event_days[rows] == event_days[pairs]) & (features.days[rows] >= own_days[pairs])
+    assert not leaked.any()
+    # Player 1's final sees the earlier event and the three earlier rounds, but not the final
+    final = len(matches) - 1
+    assert sorted(features.opponent_ids[rows[pairs == final]]) == [102, 102, 103, 104]
+    # Asking at the listed dates, as before, would have let the final into the semifinal's features
+    _, _, listed_pairs, listed_rows = features.window_rows(player_ids, np.tile(season["Date"].to_numpy(), 2), -1)
+    assert 105 in features.opponent_ids[listed_rows[listed_pairs == final - 1]]
+
+def test_elo_never_sees_the_priced_match(monkeypatch):
+    matches, _, season = event_matches()
+    engine = EloEngine.replay(matches=matches)
+    monkeypatch.setattr(elo, "get_elo_engine", lambda: engine)
+    pricer = PointInTimePricer()
+    pricer._features = PointInTimeFeatures(matches=matches)
+    # Every match is rated in listed order, so each side's rating going into it is the history's
+    history = engine.history
+    pre_match = np.concatenate([(history["winner_elo"] + history["winner_surface_elo"]) / 2,
+                                (history["loser_elo"] + history["loser_surface_elo"]) / 2])
+    np.testing.assert_allclose(pricer.get_elo(season), pre_match)
+    # The listed dates come after each match's estimated day, so asking at them takes in its own result
+    listed, _ = engine.batch_ratings(season["winner_id"], season["Date"])
+    assert not np.allclose(listed, history["winner_elo"])
@@ -0,0 +1,114 @@
+from functools import lru_cache
+import numpy as np
+import pytest
+from mdp import get_match_prob, get_match_prob_batch, get_set_transition_matrix, get_set_win_perc, get_set_win_perc_batch
+
+SERVICE_PERCS = [(0.66, 0.62), (0.7, 0.55), (0.5, 0.8), (0.6, 0.6), (0.9, 0.35), (0.52, 0.51)]
+
+def brute_force_game(service_perc):
+    """The server's chance to hold, recursing over point scores"""
+    @lru_cache(maxsize=None)
+    def hold(server_points, returner_points):
+        if server_points >= 4 and server_points - returner_points >= 2:
+            return 1.0
+        if returner_points >= 4 and returner_points - server_points >= 2:
+            return 0.0
+        if server_points == returner_points >= 3:
+            return service_perc ** 2 / (service_perc ** 2 + (1 - service_perc) ** 2)
+        return service_perc * hold(server_points + 1, returner_points) + (1 - service_perc) * hold(server_points, returner_points + 1)
+    return hold(0, 0)
+
+def brute_force_tiebreak(p1_service_perc, p2_service_perc):
+    """Player 1's chance to win a tiebreak they serve first in, recursing over point scores"""
+    @lru_cache(maxsize=None)
+    def win(p1_points, p2_points):
+        if p1_points >= 7 and p1_points - p2_points >= 2:
+            return 1.0
+        if p2_points >= 7 and p2_points - p1_points >= 2:
+            return 0.0
+        if p1_points == p2_points >= 6:
+            p1_takes_both, p2_takes_both = p1_service_perc * (1 - p2_service_perc), (1 - p1_service_perc) * p2_service_perc
+            return p1_takes_both / (p1_takes_both + p2_takes_both)
+        point_perc = p1_service_perc if (p1_points + p2_points + 1) // 2 % 2 == 0 else 1 - p2_service_perc
+        return point_perc * win(p1_points + 1, p2_points) + (1 - point_perc) * win(p1_points, p2_points + 1)
+    return win(0, 0)
+
+def brute_force_set(p1_service_perc, p2_service_perc):
+    """Player 1's chance to win a set they serve first in, recursing over game scores"""
+    p1_hold, p1_break = brute_force_game(p1_service_perc), 1 - brute_force_game(p2_service_perc)
+
+    @lru_cache(maxsize=None)
+    def win(p1_games, p2_games):
+        if p1_games == 7 or (p1_games == 6 and p2_games <= 4):
+            return 1.0
+        if p2_games == 7 or (p2_games == 6 and p1_games <= 4):
+            return 0.0
+        if p1_games == p2_games == 6:
+            return brute_force_tiebreak(p1_service_perc, p2_service_perc)
+        game_perc = p1_hold if (p1_games + p2_games) % 2 == 0 else p1_break
+        return game_perc * win(p1_games + 1, p2_games) + (1 - game_perc) * win(p1_games, p2_games + 1)
+    return win(0, 0)
+
+def brute_force_match(p1_service_perc, p2_service_perc, best_of=3):
+    """Player 1's chance to win a match, each player serving first in half of them and the first server alternating every set"""
+    sets_to_win = best_of // 2 + 1
+    set_perc = {True: brute_force_set(p1_service_perc, p2_service_perc), False: 1 - brute_force_set(p2_service_perc, p1_service_perc)}
+
+    @lru_cache(maxsize=None)
+    def win(p1_sets, p2_sets, p1_serves_first):
+        if p1_sets == sets_to_win:
+            return 1.0
+        if p2_sets == sets_to_win:
+            return 0.0
+        perc = set_perc[p1_serves_first]
+        return perc * win(p1_sets + 1, p2_sets, not p1_serves_first) + (1 - perc) * win(p1_sets, p2_sets + 1, not p1_serves_first)
+    return (win(0, 0, True) + win(0, 0, False)) / 2
+
+SET_STATES = ["0-0", "1-0", "0-1", "2-0", "1-1", "0-2", "3-0", "2-1", "1-2", "0-3", "4-0", "3-1",
+              "2-2", "1-3", "0-4", "5-0", "4-1", "3-2", "2-3", "1-4", "0-5", "5-1", "4-2", "3-3",
+              "2-4", "1-5", "5-2", "4-3", "3-4", "2-5", "5-3", "4-4", "3-5", "5-4", "4-5", "5-5",
+              "6-5", "5-6", "Set Player 1", "Set Player 2", "6-6"]
+
+def test_set_transition_matrix_follows_the_serve():
+    p1_hold, p2_hold = 0.8, 0.7
+    matrix = get_set_transition_matrix(p1_hold, p2_hold)
+    for state, score in enumerate(SET_STATES[:38]):
+        p1_games, p2_games = map(int, score.split("-"))
+        # Player 1 serves the first game and every other one after it
+        p1_game_perc = p1_hold if (p1_games + p2_games) % 2 == 0 else 1 - p2_hold
+        expected = np.zeros(len(SET_STATES))
+        for games, perc in [((p1_games + 1, p2_games), p1_game_perc), ((p1_games, p2_games + 1), 1 - p1_game_perc)]:
+            if games == (6, 6):
+                target = "6-6"
+            elif max(games) == 7 or (max(games) == 6 and min(games) <= 4):
+                target = "Set Player 1" if games[0] > games[1] else "Set Player 2"
+            else:
+                target = f"{games[0]}-{games[1]}"
+            expected[SET_STATES.index(target)] += perc
+        np.testing.assert_allclose(matrix[state], expected, err_msg=score)
+
+@pytest.mark.parametrize("p1_service_perc, p2_service_perc", SERVICE_PERCS)
+def test_set_win_perc_matches_brute_force(p1_service_perc, p2_service_perc):
+    expected = brute_force_set(p1_service_perc, p2_service_perc)
+    assert get_set_win_perc(p1_service_perc, p2_service_perc)[0] == pytest.approx(expected, abs=1e-12)
+    assert get_set_win_perc_batch([p1_service_perc], [p2_service_perc])[0][0] == pytest.approx(expected, abs=1e-12)
+
+@pytest.mark.parametrize("best_of", [3, 5])
+def test_match_prob_batch_matches_scalar_and_brute_force(best_of):
+    p1_service_perc, p2_service_perc = np.array(SERVICE_PERCS).T
+    batch, batch_p2 = get_match_prob_batch(p1_service_perc, p2_service_perc, best_of)
+    for idx, (p1, p2) in enumerate(SERVICE_PERCS):
+        expected = brute_force_match(p1, p2, best_of)
+        assert get_match_prob(p1, p2, best_of)[0] == pytest.approx(expected, abs=1e-12)
+        assert batch[idx] == pytest.approx(expected, abs=1e-12)
+    np.testing.assert_allclose(batch + batch_p2, 1.0)
+
+def test_match_prob_batch_mixed_formats_and_missing():
+    p1_service_perc = np.array([0.66, np.nan, 0.7, 0.6])
+    p2_service_perc = np.array([0.62, 0.6, 0.55, 0.6])
+    best_of = np.array([3, 3, 5, 5])
+    win_prob, _ = get_match_prob_batch(p1_service_perc, p2_service_perc, best_of)
+    assert np.isnan(win_prob[1])
+    for idx in [0, 2, 3]:
+        assert win_prob[idx] == pytest.approx(brute_force_match(p1_service_perc[idx], p2_service_perc[idx], best_of[idx]), abs=1e-12)
+    assert win_prob[3] == pytest.approx(0.5)
@@ -0,0 +1,25 @@
+import os
+import time
+from rankings import RankingsIndex, is_stale, refresh_rankings_index
+
+def write_week(rankings_dir, name, rows):
+    with open(os.path.join(rankings_dir, name), "w") as f:
+        f.write("ranking_date,rank,player,points\n" + "".join(f"{date},{rank},{player},{points}\n" for date, rank, player, points in rows))
+
+def test_rebuild_swaps_in_a_whole_index(tmp_path):
+    rankings_dir, store_dir = str(tmp_path / "atp_rankings"), str(tmp_path / "store" / "rankings")
+    os.makedirs(rankings_dir)
+    assert not refresh_rankings_index(rankings_dir, store_dir)
+    write_week(rankings_dir, "atp_rankings_20s.csv", [(20240101, 1, 100, 9000), (20240101, 2, 200, 8000)])
+    assert refresh_rankings_index(rankings_dir, store_dir)
+    assert not refresh_rankings_index(rankings_dir, store_dir)
+    before = RankingsIndex(store_dir)
+
+    time.sleep(0.01)
+    write_week(rankings_dir, "atp_rankings_20s.csv", [(20240101, 1, 100, 9000), (20240101, 2, 200, 8000), (20240108, 1, 200, 9100)])
+    assert is_stale(rankings_dir, store_dir)
+    assert refresh_rankings_index(rankings_dir, store_dir)
+    # Only the swapped in index is left, and readers opened before the rebuild keep their arrays
+    assert os.listdir(tmp_path / "store") == ["rankings"]
+    assert RankingsIndex(store_dir).lookup(200, "2024-01-10") == (1, 9100.0)
+    assert before.lookup(200, "2024-01-10") == (2, 8000.0)
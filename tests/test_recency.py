@@ -0,0 +1,131 @@
+import numpy as np
+import pandas as pd
+import pytest
+from features import SURFACES, PointInTimeFeatures, estimate_match_days
+from recency import EVENT_DAYS, RecencyState, decayed_cumsum, recency_weights
+
+ROUNDS = ["R32", "R16", "QF", "SF", "F"]
+
+def synthetic_matches(seed=0, players=6, events=40):
+    """A few players meeting in consecutive weekly events, some matches without stats"""
+    rng = np.random.default_rng(seed)
+    rows = []
+    start = pd.Timestamp("2020-01-06")
+    for event in range(events):
+        # Gaps of one to three weeks, some short enough for the previous event to stay current
+        start += pd.Timedelta(weeks=int(rng.integers(1, 4)))
+        surface = SURFACES[event % 3] if event % 7 else None
+        for round_name in rng.choice(ROUNDS, size=int(rng.integers(1, 4)), replace=False):
+            winner, loser = rng.choice(players, size=2, replace=False)
+            w_svpt, l_svpt = rng.integers(40, 120, size=2).astype(float)
+            w_won, l_won = np.floor(w_svpt * rng.uniform(0.5, 0.75)), np.floor(l_svpt * rng.uniform(0.5, 0.75))
+            if rng.uniform() < 0.1:
+                w_svpt = l_svpt = np.nan
+            rows.append({
+                "tourney_date": start, "tourney_name": f"Event {event}", "tourney_level": "A", "surface": surface,
+                "round": round_name, "best_of": 3, "winner_id": 100 + winner, "loser_id": 100 + loser,
+                "winner_rank": 10.0, "loser_rank": 20.0,
+                "w_svpt": w_svpt, "w_1stWon": w_won, "w_2ndWon": 0.0, "l_svpt": l_svpt, "l_1stWon": l_won, "l_2ndWon": 0.0,
+            })
+    return pd.DataFrame(rows)
+
+def brute_force(matches, player_id, date, weeks, half_life_weeks, event_boost, point_weighted, surface=None, surface_speeds=None):
+    """decayed_serve_return for one pair, weighting every match with recency_weights"""
+    days = estimate_match_days(matches["tourney_date"], matches["round"], matches["best_of"])
+    sides = []
+    for won, (player, opponent, side, other) in [(True, ("winner_id", "loser_id", "w_", "l_")), (False, ("loser_id", "winner_id", "l_", "w_"))]:
+        mine = (matches[player] == player_id).to_numpy()
+        frame = matches[mine]
+        sides.append(pd.DataFrame({
+            "day": days[mine], "event": frame["tourney_date"].to_numpy().astype("datetime64[D]").astype(np.int64),
+            "surface": frame["surface"].to_numpy(dtype=object),
+            "svpt": frame[side + "svpt"].to_numpy(), "sv_won": (frame[side + "1stWon"] + frame[side + "2ndWon"]).to_numpy(),
+            "rtpt": frame[other + "svpt"].to_numpy(), "rt_won": (frame[other + "svpt"] - frame[other + "1stWon"] - frame[other + "2ndWon"]).to_numpy(),
+        }))
+    history = pd.concat(sides).sort_values("day", kind="stable")
+    day = pd.Timestamp(date).to_datetime64().astype("datetime64[D]").astype(np.int64)
+    window = history[(history["day"] < day) & ((weeks == -1) | (history["day"] >= day - 7 * weeks))]
+    latest_event = window["event"].iloc[-1] if len(window) else day
+    current_event = (window["day"] >= latest_event).to_numpy() & (day - latest_event <= EVENT_DAYS)
+    window = window.assign(current_event=current_event)
+    window = window[window["svpt"] > 0]
+    if surface is not None:
+        window = window[window["surface"] == surface]
+    if not len(window):
+        return np.nan, np.nan
+    speeds = np.ones(len(window)) if surface_speeds is None else window["surface"].map(surface_speeds).fillna(1.0).to_numpy()
+    dates = window["day"].to_numpy().astype("datetime64[D]")
+    half_life_days = None if half_life_weeks is None else 7 * half_life_weeks
+    if point_weighted:
+        sv_weights = recency_weights(dates, date, half_life_days, window["current_event"], event_boost, window["svpt"])
+        rt_weights = recency_weights(dates, date, half_life_days, window["current_event"], event_boost, window["rtpt"])
+    else:
+        sv_weights = rt_weights = recency_weights(dates, date, half_life_days, window["current_event"], event_boost)
+    spw = np.average(100 * window["sv_won"] / window["svpt"] / speeds, weights=sv_weights)
+    rpw = np.average(100 * window["rt_won"] / window["rtpt"] * speeds, weights=rt_weights)
+    return spw, rpw
+
+@pytest.fixture(scope="module")
+def matches():
+    return synthetic_matches()
+
+@pytest.fixture(scope="module")
+def features(matches):
+    return PointInTimeFeatures(matches=matches)
+
+def test_decayed_cumsum_matches_running_update():
+    rng = np.random.default_rng(1)
+    groups = np.repeat(np.arange(4), [1, 5, 17, 40])
+    days = np.concatenate([np.sort(rng.integers(0, 3000, size=n)) for n in [1, 5, 17, 40]])
+    values = rng.uniform(size=(len(days), 2))
+    starts = np.r_[True, groups[1:] != groups[:-1]]
+    expected = np.zeros_like(values)
+    for row in range(len(days)):
+        carried = 0.0 if starts[row] else expected[row - 1] * 0.5 ** ((days[row] - days[row - 1]) / 30)
+        expected[row] = carried + values[row]
+    np.testing.assert_allclose(decayed_cumsum(days, values, 30, starts), expected, rtol=1e-12)
+
+def test_window_sums_without_earlier_rows():
+    state = RecencyState(np.array([0, 0, 1, 1]), np.array([0, 10, 0, 10]), np.ones((4, 1)), half_life_days=10)
+    sums = state.window_sums(np.array([0, 1, 2, 2]), np.array([2, 2, 4, 2]), np.array([20, 20, 20, 20]))
+    np.testing.assert_allclose(sums[:, 0], [0.25 + 0.5, 0.5, 0.75, 0.0])
+
+@pytest.mark.parametrize("half_life_days", [None, 30])
+def test_append_matches_batch(half_life_days):
+    rng = np.random.default_rng(2)
+    groups = np.repeat(np.arange(4), [3, 8, 1, 12])
+    days = np.concatenate([np.sort(rng.integers(0, 1000, size=n)) for n in [3, 8, 1, 12]])
+    values = rng.uniform(size=(len(days), 2))
+    batch = RecencyState(groups, days, values, half_life_days)
+    # Start from each player's first half and append the rest in play order, a new player among them
+    head = (np.arange(len(days)) - np.searchsorted(groups, groups) < np.bincount(groups)[groups] // 2) & (groups != 2)
+    state = RecencyState(groups[head], days[head], values[head], half_life_days)
+    for row in np.flatnonzero(~head)[np.argsort(days[~head], kind="stable")]:
+        state.append(groups[row], days[row], values[row])
+    for name in ["groups", "days", "starts"]:
+        np.testing.assert_array_equal(getattr(state, name), getattr(batch, name))
+    np.testing.assert_allclose(state.sums, batch.sums, rtol=1e-12)
+    lo, hi = np.array([0, 4, 11, 12, 15]), np.array([3, 11, 12, 24, 15])
+    np.testing.assert_allclose(state.window_sums(lo, hi, np.full(5, 1000)), batch.window_sums(lo, hi, np.full(5, 1000)), rtol=1e-12)
+    with pytest.raises(ValueError):
+        state.append(3, days[-1] - 1, values[-1])
+
+@pytest.mark.parametrize("weeks, half_life_weeks, event_boost, point_weighted, surface_speeds", [
+    (-1, None, 1.0, True, None),
+    (-1, 8, 2.0, True, None),
+    (26, 4, 1.5, False, None),
+    (12, 1, 3.0, True, {"Clay": 0.75, "Grass": 1.15}),
+    (-1, 0.1, 1.0, False, {"Hard": 1.1}),
+])
+def test_decayed_serve_return_matches_recency_weights(matches, features, weeks, half_life_weeks, event_boost, point_weighted, surface_speeds):
+    dates = pd.date_range("2020-03-01", "2022-06-01", freq="8D")
+    player_ids = np.resize(np.arange(100, 107), len(dates))
+    surfaces = np.resize(SURFACES[:3], len(dates))
+    decayed = features.decayed_serve_return(player_ids, dates, weeks, half_life_weeks, event_boost, point_weighted, surfaces,
+                                            surface_speeds)
+    for pair, (player_id, date, surface) in enumerate(zip(player_ids, dates, surfaces)):
+        spw, rpw = brute_force(matches, player_id, date, weeks, half_life_weeks, event_boost, point_weighted, None, surface_speeds)
+        surface_spw, surface_rpw = brute_force(matches, player_id, date, weeks, half_life_weeks, event_boost, point_weighted, surface,
+                                               surface_speeds)
+        np.testing.assert_allclose(decayed.loc[pair, ["spw", "rpw", "surface_spw", "surface_rpw"]].to_numpy(dtype=np.float64),
+                                   [spw, rpw, surface_spw, surface_rpw], rtol=1e-9)
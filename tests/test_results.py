@@ -0,0 +1,66 @@
+import multiprocessing
+import pickle
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+import numpy as np
+import pandas as pd
+import pytest
+from results import ResultHistory, SharedResults
+
+def scraped_results():
+    """Results in the format of PlayerDataScraper.get_recent_results, newest first"""
+    return pd.DataFrame({
+        "Match": ["2024 Wimbledon R32", "2024 Davis Cup Finals RR", "2024 Roland Garros F", "2024 Roland Garros SF"],
+        "Date": pd.to_datetime(["2024-07-01", "2024-06-20", "2024-05-27", "2024-05-27"]),
+        "Surface": ["Grass", "Hard", "Clay", "Clay"],
+        "Scoreline": ["d. Felix Auger Aliassime [CAN] 6-4 6-4", "d. Some Player [ITA] 6-1 6-1", "L (2) Jannik Sinner [ITA] 6-4 6-4",
+                      "d. Casper Ruud [NOR] 7-5 6-3"],
+        "vRk": ["20", "300", "2", ""],
+        "SPW": ["70.0%", "80.0%", "60.5%", "65.0%"],
+        "RPW": ["40.0%", "50.0%", "35.5%", "38.0%"],
+    })
+
+def test_from_frame_parses_once_oldest_first():
+    history = ResultHistory.from_frame(scraped_results())
+    frame = history.to_frame()
+    assert list(frame["Date"].dt.strftime("%Y-%m-%d")) == ["2024-05-27", "2024-05-27", "2024-06-20", "2024-07-01"]
+    assert list(frame["Event"]) == ["Roland Garros", "Roland Garros", "Davis Cup Finals", "Wimbledon"]
+    # Seeds in front of the opponent's name are dropped
+    assert frame["Opponent"].iloc[0] == "Jannik Sinner"
+    assert np.isnan(frame["vRk"].iloc[1])
+    np.testing.assert_allclose(frame["SPW"], [60.5, 65.0, 80.0, 70.0], rtol=1e-6)
+
+def test_windows_leave_out_team_events():
+    history = ResultHistory.from_frame(scraped_results())
+    assert len(history.last_weeks()) == 3
+    assert list(history.last_weeks(2).event_names()) == ["Wimbledon"]
+    assert list(history.before("2024-06-30", 8).event_names()) == ["Roland Garros", "Roland Garros"]
+
+def test_pickles_with_its_categories():
+    history = ResultHistory.from_frame(scraped_results())
+    copy = pickle.loads(pickle.dumps(history))
+    pd.testing.assert_frame_equal(copy.to_frame(), history.to_frame())
+
+def shared_frame(shared, key):
+    """A shared history as a DataFrame and whether its records were mapped rather than copied, in a worker"""
+    history = shared[key]
+    return history.to_frame(), not history.records.flags.owndata
+
+def test_shared_results_attach_from_another_process():
+    history = ResultHistory.from_frame(scraped_results())
+    with SharedResults({"alcaraz": history, "last two": ResultHistory.from_frame(scraped_results().iloc[:2])}) as shared:
+        # Written after packing, so the worker only sees it through the shared block
+        shared.records["spw"][0] = 99.0
+        with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context("spawn")) as executor:
+            frame, mapped = executor.submit(shared_frame, shared, "alcaraz").result()
+            last_two, _ = executor.submit(shared_frame, shared, "last two").result()
+        assert mapped
+        assert frame["SPW"].iloc[0] == 99.0
+        pd.testing.assert_frame_equal(frame.iloc[1:], history.to_frame().iloc[1:])
+        assert list(last_two["Event"]) == ["Davis Cup Finals", "Wimbledon"]
+        name = shared.name
+    # The owner's close unlinks the block
+    with pytest.raises(FileNotFoundError):
+        shared_memory.SharedMemory(name=name)
+    with pytest.raises(ValueError):
+        pickle.dumps(shared)
@@ -0,0 +1,43 @@
+import threading
+import time
+import server
+
+class SlowStats:
+    """Stands in for PlayerServeReturnStats, counting scrapes"""
+    scrapes = []
+
+    def __init__(self, first_name, last_name, num_weeks, current_tournament, career=False):
+        SlowStats.scrapes.append((first_name, last_name, career))
+        time.sleep(0.02)
+        self.num_weeks = num_weeks
+        self.current_tournament = current_tournament
+
+def test_concurrent_requests_scrape_a_player_once(monkeypatch):
+    monkeypatch.setattr(server, "PlayerServeReturnStats", SlowStats)
+    SlowStats.scrapes = []
+    cache = server.PlayerStatsCache()
+    barrier = threading.Barrier(16)
+
+    def request(first_name):
+        barrier.wait()
+        cache.get(first_name, "Player", 52, "Wimbledon")
+
+    threads = [threading.Thread(target=request, args=(name,)) for name in ["Jannik", "Carlos"] * 8]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert sorted(SlowStats.scrapes) == [("Carlos", "Player", False), ("Jannik", "Player", False)]
+    # Locks go once nobody holds or waits for them
+    assert not cache._key_locks
+
+def test_expired_players_are_scraped_again(monkeypatch):
+    monkeypatch.setattr(server, "PlayerServeReturnStats", SlowStats)
+    SlowStats.scrapes = []
+    cache = server.PlayerStatsCache(ttl=0.05)
+    cache.get("Jannik", "Sinner", 52, "Wimbledon")
+    stats = cache.get("Jannik", "Sinner", 12, "US Open")
+    assert (stats.num_weeks, stats.current_tournament) == (12, "US Open")
+    time.sleep(0.1)
+    cache.get("Jannik", "Sinner", 52, "Wimbledon")
+    assert len(SlowStats.scrapes) == 2